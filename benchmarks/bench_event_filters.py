@@ -0,0 +1,69 @@
+'''
+Time util.compare_dict against util.compile_filter on the filters the library uses, matched against a mix of messages shaped like a busy MeshCentral server's event stream.
+
+Run with:
+    python benchmarks/bench_event_filters.py [--messages 100000] [--repeat 5]
+'''
+import argparse
+import random
+import time
+import meshctrl.util
+
+FILTERS = {
+    "console": {"action": "msg", "type": "console"},
+    "runcommands": {"action": "msg", "type": "runcommands", "responseid": "meshctrl_run_command_42"},
+    "agentlog": {"event": {"etype": "node", "action": "agentlog"}},
+    "user group": {"event": {"etype": "ugrp"}},
+    "open url": {"type": "openUrl", "url": "https://example.com"},
+    "tags (set)": {"event": {"node": {"tags": {"prod", "windows"}}}},
+}
+
+def make_messages(count):
+    rand = random.Random(0)
+    messages = []
+    for i in range(count):
+        nodeid = f"node//{rand.getrandbits(256):064x}"
+        kind = rand.random()
+        if kind < 0.4:
+            messages.append({"action": "event", "event": {"etype": "node", "action": "nodeconnect", "nodeid": nodeid, "conn": 1, "pwr": 1, "domain": ""}})
+        elif kind < 0.6:
+            messages.append({"action": "event", "event": {"etype": "node", "action": "changenode", "nodeid": nodeid, "domain": "", "node": {
+                "_id": nodeid, "name": f"host-{i}", "meshid": "mesh//abc", "tags": rand.choice([["prod", "windows"], ["dev", "linux"], []]),
+                "agent": {"ver": 0, "id": 4, "caps": 15}, "links": {"user//admin": {"rights": 4294967295}},
+            }}})
+        elif kind < 0.8:
+            messages.append({"action": "msg", "type": "console", "nodeid": nodeid, "value": f"line {i}\n"})
+        elif kind < 0.9:
+            messages.append({"action": "msg", "type": "runcommands", "nodeid": nodeid, "result": "ok\n", "responseid": f"meshctrl_run_command_{i % 50}"})
+        else:
+            messages.append({"action": "event", "event": {"etype": "node", "action": "agentlog", "nodeid": nodeid, "msg": "log"}})
+    return messages
+
+def best(func, messages, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        matched = 0
+        for message in messages:
+            if func(message):
+                matched += 1
+        times.append(time.perf_counter() - start)
+    return min(times), matched
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    print(f"{args.messages} messages, best of {args.repeat}")
+    for name, filter in FILTERS.items():
+        old, old_matched = best(lambda data: meshctrl.util.compare_dict(filter, data), messages, args.repeat)
+        compiled = meshctrl.util.compile_filter(filter)
+        new, new_matched = best(compiled, messages, args.repeat)
+        assert old_matched == new_matched, f"{name}: compare_dict matched {old_matched}, compile_filter matched {new_matched}"
+        print(f"{name:>12}: compare_dict {old*1000:7.1f} ms  compile_filter {new*1000:7.1f} ms  ({old/new:.1f}x, {new_matched} matched)")
+
+if __name__ == "__main__":
+    main()
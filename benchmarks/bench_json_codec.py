@@ -0,0 +1,73 @@
+'''
+Decode/encode time of the available JSON codecs on a synthetic `nodes` reply for a 20k device server.
+
+Run with:
+    python benchmarks/bench_json_codec.py [--nodes 20000] [--meshes 200] [--repeat 5] [--no-gc]
+
+Decoding a payload this size allocates a few hundred thousand containers, so the cyclic garbage collector can account for a large share of the measured time. Pass --no-gc to time the codecs alone.
+'''
+import argparse
+import gc
+import random
+import time
+import meshctrl.codec
+
+def make_nodes_payload(node_count, mesh_count):
+    rand = random.Random(0)
+    nodes = {}
+    for i in range(node_count):
+        meshid = f"mesh//{rand.getrandbits(128):032x}{i % mesh_count:04d}"
+        nodes.setdefault(meshid, []).append({
+            "_id": f"node//{rand.getrandbits(256):064x}",
+            "name": f"host-{i:05d}",
+            "rname": f"HOST-{i:05d}.corp.example.com",
+            "icon": 1,
+            "agct": 1700000000000 + i,
+            "conn": rand.choice([0, 1]),
+            "pwr": rand.choice([0, 1]),
+            "ip": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+            "osdesc": "Microsoft Windows 11 Pro - 23H2/22631",
+            "agent": {"ver": 0, "id": 4, "caps": 15},
+            "tags": ["prod", "windows"],
+            "users": [f"CORP\\user{i}"],
+            "lastconnect": 1700000000000 + i,
+            "lastaddr": f"192.0.2.{i % 256}:50123",
+            "links": {"user//admin": {"rights": 4294967295}},
+        })
+    return {"action": "nodes", "nodes": nodes, "tag": "meshctrl_list_devices_1", "responseid": "meshctrl_list_devices_1"}
+
+def available_codecs():
+    for name in ("json", "orjson", "msgspec"):
+        try:
+            yield meshctrl.codec.get_codec(name)
+        except ImportError:
+            print(f"{name}: not installed, skipping")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=20000)
+    parser.add_argument("--meshes", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-gc", action="store_true", help="Disable the garbage collector while timing")
+    args = parser.parse_args()
+    if args.no_gc:
+        gc.disable()
+
+    payload = make_nodes_payload(args.nodes, args.meshes)
+    message = meshctrl.codec.JSONCodec().dumps(payload)
+    print(f"payload: {args.nodes} nodes in {args.meshes} meshes, {len(message)/1e6:.1f} MB")
+    for codec in available_codecs():
+        decode = []
+        encode = []
+        for i in range(args.repeat):
+            start = time.perf_counter()
+            data = codec.loads(message)
+            decode.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            codec.dumps(data)
+            encode.append(time.perf_counter() - start)
+        assert data == payload
+        print(f"{codec.name:>8}: decode {min(decode)*1000:8.1f} ms  encode {min(encode)*1000:8.1f} ms  (best of {args.repeat})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+'''
+Messages per second through Session._listen_data_task, with and without listeners attached.
+
+The session never connects, and the receive loop is fed from an in-memory socket, so this measures our own per-message overhead rather than the network.
+
+Run with:
+    python benchmarks/bench_listen_loop.py [--messages 200000] [--repeat 3]
+'''
+import argparse
+import asyncio
+import json
+import random
+import time
+import meshctrl
+
+class FakeSocket(object):
+    def __init__(self, messages):
+        self._messages = messages
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for message in self._messages:
+            yield message
+
+def make_messages(count):
+    rand = random.Random(0)
+    messages = []
+    for i in range(count):
+        nodeid = f"node//{rand.getrandbits(256):064x}"
+        kind = rand.random()
+        if kind < 0.5:
+            data = {"action": "event", "event": {"etype": "node", "action": "nodeconnect", "nodeid": nodeid, "conn": 1, "pwr": 1, "domain": ""}}
+        elif kind < 0.8:
+            data = {"action": "msg", "type": "console", "nodeid": nodeid, "value": f"line {i}\n"}
+        else:
+            data = {"action": "getsysinfo", "nodeid": nodeid, "tag": f"meshctrl_device_info_{i}", "responseid": f"meshctrl_device_info_{i}", "noinfo": True}
+        messages.append(json.dumps(data))
+    return messages
+
+async def drain(generator):
+    async for item in generator:
+        pass
+
+async def run(session, messages, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        await session._listen_data_task(FakeSocket(messages))
+        # Let listeners catch up, so their cost is counted
+        await asyncio.sleep(0)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(messages) / best
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    session = meshctrl.Session("ws://127.0.0.1:1", user="bench", password="bench")
+    # We only want the session's state, not its connection attempts
+    session._main_loop_task.cancel()
+
+    scenarios = [
+        ("no listeners", []),
+        ("1 events() on a rare action", [lambda: session.events({"action": "wssessioncount"})]),
+        ("50 events() on rare nodeids", [lambda i=i: session.events({"action": "msg", "nodeid": f"node//{i}"}) for i in range(50)]),
+        ("1 events() matching console", [lambda: session.events({"action": "msg", "type": "console"})]),
+        ("raw_messages()", [lambda: session.raw_messages()]),
+    ]
+    print(f"{args.messages} messages, best of {args.repeat}")
+    for name, listeners in scenarios:
+        tasks = [asyncio.create_task(drain(listener())) for listener in listeners]
+        await asyncio.sleep(0)
+        rate = await run(session, messages, args.repeat)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        print(f"{name:>30}: {rate:10,.0f} messages/s")
+
+if __name__ == "__main__":
+    asyncio.run(main())
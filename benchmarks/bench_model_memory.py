@@ -0,0 +1,75 @@
+'''
+Memory retained by 100k Device, Mesh and UserGroup models, regular versus compact variants.
+
+Models are built from decoded JSON, the same way the session builds them, and the raw server data is dropped before measuring. What is left is what a long running process keeps for its inventory.
+
+Run with:
+    python benchmarks/bench_model_memory.py [--count 100000]
+'''
+import argparse
+import gc
+import json
+import random
+import tracemalloc
+import meshctrl
+
+OS_DESCRIPTIONS = ["Microsoft Windows 11 Pro - 23H2/22631", "Microsoft Windows 10 Enterprise - 22H2/19045", "Ubuntu 22.04.4 LTS", "Debian GNU/Linux 12 (bookworm)"]
+
+def make_nodes(count):
+    rand = random.Random(0)
+    nodes = [{
+        "_id": f"node//{rand.getrandbits(256):064x}",
+        "name": f"host-{i:06d}",
+        "rname": f"HOST-{i:06d}",
+        "domain": "",
+        "icon": 1,
+        "agct": 1700000000000 + i,
+        "conn": rand.choice([0, 1]),
+        "pwr": rand.choice([0, 1]),
+        "osdesc": rand.choice(OS_DESCRIPTIONS),
+        "ip": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+        "agent": {"ver": 0, "id": 4, "caps": 15},
+        "meshid": f"mesh//{i % 100:064x}",
+    } for i in range(count)]
+    # Round trip so every string is a separate object, like it would be coming off the wire
+    return json.dumps(nodes)
+
+def make_meshes(count):
+    return json.dumps([{"_id": f"mesh//{i:064x}", "name": f"group-{i}", "mtype": 2, "desc": "", "domain": "", "creation": 1700000000000,
+                        "creatorid": "user//admin", "creatorname": "admin", "links": {"user//admin": {"name": "admin", "rights": 4294967295}}} for i in range(count)])
+
+def make_user_groups(count):
+    return json.dumps([{"_id": f"ugrp//{i:064x}", "name": f"group-{i}", "domain": ""} for i in range(count)])
+
+def measure(payload, build):
+    gc.collect()
+    tracemalloc.start()
+    data = json.loads(payload)
+    models = [build(d) for d in data]
+    del data
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del models
+    return current, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+
+    cases = [
+        ("Device", make_nodes(args.count), meshctrl.device.Device, meshctrl.device.CompactDevice),
+        ("Mesh", make_meshes(args.count), meshctrl.mesh.Mesh, meshctrl.mesh.CompactMesh),
+        ("UserGroup", make_user_groups(args.count), meshctrl.user_group.UserGroup, meshctrl.user_group.CompactUserGroup),
+    ]
+    for name, payload, regular, compact in cases:
+        results = []
+        for cls in (regular, compact):
+            current, peak = measure(payload, lambda d: cls(d["_id"], None, **d))
+            results.append(current)
+            print(f"{cls.__name__:>17}: {current/1e6:8.1f} MB retained ({current/args.count:6.0f} B/instance), {peak/1e6:8.1f} MB peak")
+        print(f"{'':>17}  compact {name} uses {100*(1 - results[1]/results[0]):.0f}% less memory\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+'''
+Throughput of HTTPPool.download, the http(s) path of Files.download, fetching one stream versus several byte ranges at once.
+
+A local HTTP server stands in for MeshCentral's devicefile.ashx. It honors Range requests, and caps each connection at --rate MB/s, like a server relaying a file from an agent over one slow link per request. Pass --no-ranges to see the fallback to a single stream.
+
+Run with:
+    python benchmarks/bench_parallel_download.py [--size 64] [--rate 50] [--repeat 3]
+'''
+import argparse
+import asyncio
+import io
+import os
+import time
+import meshctrl
+
+async def serve(body, rate, ranges):
+    chunk_size = 65536
+    delay = chunk_size / (rate * 1024 * 1024)
+    handlers = set()
+
+    async def handler(reader, writer):
+        handlers.add(asyncio.current_task())
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                first, last = 0, len(body) - 1
+                if ranges and b"\r\nRange: bytes=" in head:
+                    spec = head.split(b"\r\nRange: bytes=", 1)[1].split(b"\r\n", 1)[0].decode()
+                    first, last = spec.split("-")
+                    first = int(first)
+                    last = int(last) if last else len(body) - 1
+                    writer.write(f"HTTP/1.1 206 Partial Content\r\nContent-Range: bytes {first}-{last}/{len(body)}\r\nContent-Length: {last-first+1}\r\n\r\n".encode())
+                else:
+                    writer.write(f"HTTP/1.1 200 OK\r\nContent-Length: {len(body)}\r\n\r\n".encode())
+                for offset in range(first, last + 1, chunk_size):
+                    if reader.at_eof():
+                        # Client hung up, as it does after taking the first range from an open ended request
+                        return
+                    writer.write(body[offset:min(offset + chunk_size, last + 1)])
+                    await writer.drain()
+                    await asyncio.sleep(delay)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            handlers.discard(asyncio.current_task())
+
+    server = await asyncio.start_server(handler, "127.0.0.1", 0)
+    return server, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/devicefile.ashx", handlers
+
+async def run(url, body, parallel, repeat):
+    best = None
+    pool = meshctrl.httpclient.HTTPPool()
+    for i in range(repeat):
+        target = io.BytesIO()
+        start = time.perf_counter()
+        size = await pool.download(url, target, parallel=parallel)
+        elapsed = time.perf_counter() - start
+        assert size == len(body) and target.getvalue() == body, "Downloaded wrong data"
+        best = elapsed if best is None else min(best, elapsed)
+    await pool.close()
+    return len(body) / best / (1024 * 1024)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=64, help="File size in MB")
+    parser.add_argument("--rate", type=float, default=50, help="Per connection rate limit in MB/s")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-ranges", action="store_true", help="Stand-in ignores Range requests")
+    args = parser.parse_args()
+
+    body = os.urandom(args.size * 1024 * 1024)
+    server, url, handlers = await serve(body, args.rate, not args.no_ranges)
+    print(f"{args.size} MB at {args.rate} MB/s per connection, {'no ' if args.no_ranges else ''}range support, best of {args.repeat}")
+    for parallel in (1, 2, 4, 8):
+        rate = await run(url, body, parallel, args.repeat)
+        print(f"parallel={parallel}: {rate:8.1f} MB/s")
+    # Let the stand-in see the client's connections close
+    if handlers:
+        await asyncio.wait(set(handlers), timeout=5)
+    server.close()
+    await server.wait_closed()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,61 @@
+'''
+Messages per second through Session._send_data_task, by how many queued messages it sends back to back before yielding to the event loop. Each message is its own socket write either way.
+
+A local websocket server stands in for MeshCentral. It answers the login handshake and otherwise just counts what it receives, so this measures the client's write path rather than the server.
+
+Run with:
+    python benchmarks/bench_send_batch.py [--messages 50000] [--repeat 3]
+'''
+import argparse
+import asyncio
+import json
+import time
+import websockets.asyncio.server
+import meshctrl
+
+async def serve():
+    received = {"count": 0, "target": None, "done": None}
+
+    async def handler(websocket):
+        await websocket.send(json.dumps({"action": "serverinfo", "serverinfo": {"domain": ""}}))
+        await websocket.send(json.dumps({"action": "userinfo", "userinfo": {"_id": "user//bench"}}))
+        async for message in websocket:
+            received["count"] += 1
+            if received["count"] == received["target"]:
+                received["done"].set()
+
+    server = await websockets.asyncio.server.serve(handler, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1], received
+
+async def run(port, received, count, repeat, **kwargs):
+    best = None
+    async with meshctrl.Session(f"ws://127.0.0.1:{port}", user="bench", password="bench", **kwargs) as session:
+        message = json.dumps({"action": "getsysinfo", "nodeid": "node//" + "0" * 64, "nodeinfo": True})
+        for i in range(repeat):
+            received["count"] = 0
+            received["target"] = count
+            received["done"] = asyncio.Event()
+            start = time.perf_counter()
+            for j in range(count):
+                session._message_queue.put_nowait(message)
+            await received["done"].wait()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return count / best
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    server, port, received = await serve()
+    print(f"{args.messages} messages, best of {args.repeat}")
+    for batch_size in (1, 16, 64, 256):
+        rate = await run(port, received, args.messages, args.repeat, send_batch_size=batch_size)
+        print(f"send_batch_size={batch_size:<4}: {rate:10,.0f} messages/s")
+    server.close()
+    await server.wait_closed()
+
+if __name__ == "__main__":
+    asyncio.run(main())
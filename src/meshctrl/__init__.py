@@ -16,11 +16,17 @@ finally:
     del version, PackageNotFoundError
 
 from .session import Session
+from . import codec
+from . import inventory
+from . import scheduler
+from . import metrics
+from . import profiling
 from . import constants
 from . import shell
 from . import tunnel
 from . import util
 from . import files
+from . import httpclient
 from . import exceptions
 from . import device
 from . import mesh
@@ -0,0 +1,134 @@
+'''
+JSON codecs used to encode and decode messages on the control channel and tunnels.
+
+orjson or msgspec will be used if they are installed, since the payloads returned for large servers (`nodes`, `getDeviceDetails`) can be several megabytes. Otherwise we fall back to the standard library.
+'''
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+    import msgspec.json
+except ImportError:
+    msgspec = None
+
+class JSONCodec(object):
+    '''
+    Codec based on the standard library json module. Subclass this and override :py:meth:`loads` and :py:meth:`dumps` to provide your own codec.
+
+    Attributes:
+        name (str): Name of the codec
+    '''
+    name = "json"
+
+    def loads(self, data):
+        '''
+        Decode a message
+
+        Args:
+            data (str|bytes): JSON document
+
+        Returns:
+            object: Decoded data
+
+        Raises:
+            ValueError: data is not valid JSON
+        '''
+        return json.loads(data)
+
+    def dumps(self, data):
+        '''
+        Encode a message
+
+        Args:
+            data (object): Data to encode
+
+        Returns:
+            str: JSON document. This is always a str, since the server expects text frames.
+        '''
+        return json.dumps(data)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}()"
+
+class OrjsonCodec(JSONCodec):
+    '''
+    Codec based on orjson
+    '''
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("orjson is not installed")
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, data):
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            # orjson is stricter than json (ints over 64 bits, odd subclasses). Don't fail where the standard library wouldn't.
+            return json.dumps(data)
+
+class MsgspecCodec(JSONCodec):
+    '''
+    Codec based on msgspec
+    '''
+    name = "msgspec"
+
+    def __init__(self):
+        if msgspec is None:
+            raise ImportError("msgspec is not installed")
+        self._encoder = msgspec.json.Encoder()
+        self._decoder = msgspec.json.Decoder()
+
+    def loads(self, data):
+        try:
+            return self._decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+    def dumps(self, data):
+        try:
+            return self._encoder.encode(data).decode("utf-8")
+        except (TypeError, msgspec.EncodeError):
+            return json.dumps(data)
+
+_codecs = {
+    "orjson": OrjsonCodec,
+    "msgspec": MsgspecCodec,
+    "json": JSONCodec,
+}
+
+def get_codec(codec=None):
+    '''
+    Get a JSON codec
+
+    Args:
+        codec (str|JSONCodec|None): Codec object, or name of the codec to use ("orjson", "msgspec" or "json"). If None, use the fastest installed codec.
+
+    Returns:
+        :py:class:`JSONCodec`: The codec
+
+    Raises:
+        ValueError: Unknown codec name
+        ImportError: Requested codec is not installed
+    '''
+    if isinstance(codec, JSONCodec):
+        return codec
+    if codec is not None:
+        try:
+            return _codecs[codec]()
+        except KeyError:
+            raise ValueError(f"Unknown JSON codec: {codec}")
+    if orjson is not None:
+        return OrjsonCodec()
+    if msgspec is not None:
+        return MsgspecCodec()
+    return JSONCodec()
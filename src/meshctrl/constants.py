@@ -289,3 +289,28 @@ class FileType(enum.IntEnum):
     #: File
     FILE = 3
 
+@document_enum
+class OverflowPolicy(enum.StrEnum):
+    """
+    What to do when a subscriber's queue is full, as used by :py:func:`~meshctrl.session.Session.events` and :py:func:`~meshctrl.session.Session.raw_messages`
+    """
+    #: Throw away the oldest queued message to make room
+    drop_oldest = enum.auto()
+    #: Throw away the new message
+    drop_newest = enum.auto()
+    #: Wait for the subscriber to make room. This holds up every message to the session, responses included, until it does.
+    block = enum.auto()
+    #: Replace the queued message with the same key, if there is one. Otherwise behave like drop_oldest.
+    coalesce = enum.auto()
+
+@document_enum
+class Priority(enum.IntEnum):
+    """
+    Send priority of a control channel message. Lower values are sent first.
+    """
+    #: Operator actions which someone is waiting on, such as ping, messages and power actions
+    interactive = 0
+    #: Everything else
+    normal = 1
+    #: Large fetches, such as listing every device or syncing the inventory
+    bulk = 2
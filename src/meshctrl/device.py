@@ -1,61 +1,15 @@
 from . import constants
+from . import util
+import abc
+import collections.abc
 import datetime
 
-class Device(object):
+class _DeviceBase(object):
     '''
-    Object to represent a device. This object is a rough wrapper; it is not guarunteed to be up to date with the state on the server, for instance.
-
-    Args:
-        nodeid (str): id of the device on the server
-        session (~meshctrl.session.Session): Parent session used to run commands
-        agent (~meshctrl.types.Agent|dict|None): Information about the agent. Meshcentral returns this data in an unreadable way, so if the dict doesn't match :py:class:`~meshctrl.types.Agent`, we will attempt to convert to our format.
-        name (str|None): Device name as it is shown on the meshcentral server
-        description (str|None): Device description as it is shown on the meshcentral server. Also accepted as desc.
-        tags (list[str]|None): tags associated with device.
-        users (list[str]|None): latest known usernames which have logged in.
-        created_at (datetime.Datetime|int|None): Time at which device mas created. Also accepted as agct.
-        computer_name (str|None): Device name as reported from the agent. This may be different from name. Also accepted as rname.
-        icon (~meshctrl.constants.Icon): Icon displayed on the website
-        mesh (~meshctrl.mesh.Mesh|None): Mesh object under which this device exists. Is None for individual device access.
-        meshtype (~meshctrl.constants.MeshType|None): Type of mesh this device is connected to. Also accepted as mtype.
-        meshname (str|None): Name of the mesh to which this device is connected. Also accepted as groupname.
-        domain (str|None): Domain on server to which device is connected.
-        host (str): reachable hostname of device. Not meaningful for agent meshes.
-        ip (str): IP from which device connected.
-        connected: (bool): Whether the device is currently connected. Also accepted as conn.
-        powered_on (bool): Whether the device is currently powered on. Also accepted as pwr.
-        os_description (str|None): Description of the underlying OS. Also accepted as osdesc.
-        lastaddr (str|None): IP from which the agent most recently connected. This may be set even if ip is not.
-        lastconnect (datetime.Datetime|int|None): Last time at which the agent was connected to the server
-        links (dict[str, ~meshctrl.types.UserLink]|None): Collection of links for the device,
-        details (dict[str, dict]|None): Extra details about the device. These are not well defined, but are filled by calling :py:meth:`~meshctrl.session.Session.list_devices` with `details=True`.
-
-    Returns:
-        :py:class:`Device`: Object representing a device on the meshcentral server.
-
-    Attributes:
-        nodeid (str): id of the device on the server
-        agent (~meshctrl.types.Agent|dict|None): Information about the agent. Meshcentral returns this data in an unreadable way, so if the dict doesn't match :py:class:`~meshctrl.types.Agent`, we will attempt to convert to our format.
-        name (str|None): Device name as it is shown on the meshcentral server
-        description (str|None): Device description as it is shown on the meshcentral server.
-        tags (list[str]): tags associated with device.
-        users (list[str]): latest known usernames which have logged in.
-        computer_name (str|None): Device name as reported from the agent. This may be different from name. Also accepted as rname.
-        icon (~meshctrl.constants.Icon): Icon displayed on the website
-        mesh (~meshctrl.mesh.Mesh|None): Mesh object under which this device exists. Is None for individual device access.
-        meshtype (~meshctrl.constants.MeshType|None): Type of mesh this device is connected to. Also accepted as mtype.
-        meshname (str|None): Name of the mesh to which this device is connected. Also accepted as groupname.
-        domain (str|None): Domain on server to which device is connected.
-        host (str): reachable hostname of device. Not meaningful for agent meshes.
-        ip (str): IP from which device connected.
-        connected: (bool): Whether the device is currently connected. Also accepted as conn.
-        powered_on (bool): Whether the device is currently powered on. Also accepted as pwr.
-        os_description (str|None): Description of the underlying OS. Also accepted as osdesc.
-        lastaddr (str|None): IP from which the agent most recently connected. This may be set even if ip is not.
-        lastconnect (datetime.Datetime|None): Last time at which the agent was connected to the server
-        links (dict[str, ~meshctrl.types.UserLink]|None): Collection of links for the device
-        details (dict[str, dict]): Extra details about the device. These are not well defined, but are filled by calling :py:meth:`~meshctrl.session.Session.list_devices` with `details=True`.
+    Implementation of :py:class:`Device`, shared with :py:class:`CompactDevice`.
     '''
+    __slots__ = ()
+
     def __init__(self, nodeid, session, agent=None,
                        name=None, desc=None, description=None,
                        tags=None, users=None,
@@ -95,26 +49,9 @@ class Device(object):
         self.users = users if users is not None else []
         self.details = details if details is not None else {}
 
-        created_at = created_at if created_at is not None else agct
-        if not isinstance(created_at, datetime.datetime) and created_at is not None:
-            try:
-                created_at = datetime.datetime.fromtimestamp(created_at)
-            except (OSError, ValueError):
-                # Meshcentral returns in miliseconds, while fromtimestamp, and most of python, expects the argument in seconds. Try seconds frist, then translate from ms if it fails.
-                # This doesn't work for really early timestamps, but I don't expect that to be a problem here.
-                created_at = datetime.datetime.fromtimestamp(created_at/1000.0)
-
-        self.created_at = created_at
-
-        if not isinstance(lastconnect, datetime.datetime) and lastconnect is not None:
-            try:
-                lastconnect = datetime.datetime.fromtimestamp(lastconnect)
-            except (OSError, ValueError):
-                # Meshcentral returns in miliseconds, while fromtimestamp, and most of python, expects the argument in seconds. Try seconds frist, then translate from ms if it fails.
-                # This doesn't work for really early timestamps, but I don't expect that to be a problem here.
-                lastconnect = datetime.datetime.fromtimestamp(lastconnect/1000.0)
-
-        self.lastconnect = lastconnect
+        # Timestamps are converted to datetimes the first time they are read. Building thousands of devices shouldn't pay for fields nobody looks at.
+        self._created_at = created_at if created_at is not None else agct
+        self._lastconnect = lastconnect
         self.lastaddr = lastaddr
 
         # In case meshcentral gives us props we don't understand, store them here.
@@ -343,6 +280,32 @@ class Device(object):
         '''
         return await self._session.power_off_devices(self.nodeid, timeout=timeout)
 
+    @property
+    def created_at(self):
+        '''
+        Time at which device was created
+        '''
+        if not isinstance(self._created_at, datetime.datetime):
+            self._created_at = util._parse_timestamp(self._created_at)
+        return self._created_at
+
+    @created_at.setter
+    def created_at(self, value):
+        self._created_at = value
+
+    @property
+    def lastconnect(self):
+        '''
+        Last time at which the agent was connected to the server
+        '''
+        if not isinstance(self._lastconnect, datetime.datetime):
+            self._lastconnect = util._parse_timestamp(self._lastconnect)
+        return self._lastconnect
+
+    @lastconnect.setter
+    def lastconnect(self, value):
+        self._lastconnect = value
+
     @property
     def short_nodeid(self):
         '''
@@ -358,12 +321,138 @@ class Device(object):
         return self.nodeid
 
     def __str__(self):
-        return f"<Device: nodeid={self.nodeid} name={self.name} description={self.description} computer_name={self.computer_name} icon={self.icon} "\
+        return f"<{type(self).__name__}: nodeid={self.nodeid} name={self.name} description={self.description} computer_name={self.computer_name} icon={self.icon} "\
                f"mesh={self.mesh} meshtype={self.meshtype} meshname={self.meshname} domain={self.domain} host={self.host} ip={self.ip} "\
                f"tags={self.tags} users={self.users} details={self.details} created_at={self.created_at} lastaddr={self.lastaddr} lastconnect={self.lastconnect} "\
                f"connected={self.connected} powered_on={self.powered_on} os_description={self.os_description} links={self.links} _extra_props={self._extra_props}>"
     def __repr__(self):
-        return f"Device(nodeid={repr(self.nodeid)}, session={repr(self._session)}, name={repr(self.name)}, description={repr(self.description)}, computer_name={repr(self.computer_name)}, icon={repr(self.icon)}, "\
+        return f"{type(self).__name__}(nodeid={repr(self.nodeid)}, session={repr(self._session)}, name={repr(self.name)}, description={repr(self.description)}, computer_name={repr(self.computer_name)}, icon={repr(self.icon)}, "\
                f"mesh={repr(self.mesh)}, meshtype={repr(self.meshtype)}, meshname={repr(self.meshname)}, domain={repr(self.domain)}, host={repr(self.host)}, ip={repr(self.ip)}, "\
                f"tags={repr(self.tags)}, users={repr(self.users)}, details={repr(self.details)} created_at={repr(self.created_at)} lastaddr={repr(self.lastaddr)} lastconnect={repr(self.lastconnect)} "\
                f"connected={repr(self.connected)}, powered_on={repr(self.powered_on)}, os_description={repr(self.os_description)}, links={repr(self.links)}, **{repr(self._extra_props)})"
+
+
+class Device(_DeviceBase, metaclass=abc.ABCMeta):
+    '''
+    Object to represent a device. This object is a rough wrapper; it is not guarunteed to be up to date with the state on the server, for instance.
+
+    Args:
+        nodeid (str): id of the device on the server
+        session (~meshctrl.session.Session): Parent session used to run commands
+        agent (~meshctrl.types.Agent|dict|None): Information about the agent. Meshcentral returns this data in an unreadable way, so if the dict doesn't match :py:class:`~meshctrl.types.Agent`, we will attempt to convert to our format.
+        name (str|None): Device name as it is shown on the meshcentral server
+        description (str|None): Device description as it is shown on the meshcentral server. Also accepted as desc.
+        tags (list[str]|None): tags associated with device.
+        users (list[str]|None): latest known usernames which have logged in.
+        created_at (datetime.Datetime|int|None): Time at which device mas created. Also accepted as agct.
+        computer_name (str|None): Device name as reported from the agent. This may be different from name. Also accepted as rname.
+        icon (~meshctrl.constants.Icon): Icon displayed on the website
+        mesh (~meshctrl.mesh.Mesh|None): Mesh object under which this device exists. Is None for individual device access.
+        meshtype (~meshctrl.constants.MeshType|None): Type of mesh this device is connected to. Also accepted as mtype.
+        meshname (str|None): Name of the mesh to which this device is connected. Also accepted as groupname.
+        domain (str|None): Domain on server to which device is connected.
+        host (str): reachable hostname of device. Not meaningful for agent meshes.
+        ip (str): IP from which device connected.
+        connected: (bool): Whether the device is currently connected. Also accepted as conn.
+        powered_on (bool): Whether the device is currently powered on. Also accepted as pwr.
+        os_description (str|None): Description of the underlying OS. Also accepted as osdesc.
+        lastaddr (str|None): IP from which the agent most recently connected. This may be set even if ip is not.
+        lastconnect (datetime.Datetime|int|None): Last time at which the agent was connected to the server
+        links (dict[str, ~meshctrl.types.UserLink]|None): Collection of links for the device,
+        details (dict[str, dict]|None): Extra details about the device. These are not well defined, but are filled by calling :py:meth:`~meshctrl.session.Session.list_devices` with `details=True`.
+
+    Returns:
+        :py:class:`Device`: Object representing a device on the meshcentral server.
+
+    Attributes:
+        nodeid (str): id of the device on the server
+        agent (~meshctrl.types.Agent|dict|None): Information about the agent. Meshcentral returns this data in an unreadable way, so if the dict doesn't match :py:class:`~meshctrl.types.Agent`, we will attempt to convert to our format.
+        name (str|None): Device name as it is shown on the meshcentral server
+        description (str|None): Device description as it is shown on the meshcentral server.
+        tags (list[str]): tags associated with device.
+        users (list[str]): latest known usernames which have logged in.
+        computer_name (str|None): Device name as reported from the agent. This may be different from name. Also accepted as rname.
+        icon (~meshctrl.constants.Icon): Icon displayed on the website
+        mesh (~meshctrl.mesh.Mesh|None): Mesh object under which this device exists. Is None for individual device access.
+        meshtype (~meshctrl.constants.MeshType|None): Type of mesh this device is connected to. Also accepted as mtype.
+        meshname (str|None): Name of the mesh to which this device is connected. Also accepted as groupname.
+        domain (str|None): Domain on server to which device is connected.
+        host (str): reachable hostname of device. Not meaningful for agent meshes.
+        ip (str): IP from which device connected.
+        connected: (bool): Whether the device is currently connected. Also accepted as conn.
+        powered_on (bool): Whether the device is currently powered on. Also accepted as pwr.
+        os_description (str|None): Description of the underlying OS. Also accepted as osdesc.
+        lastaddr (str|None): IP from which the agent most recently connected. This may be set even if ip is not.
+        lastconnect (datetime.Datetime|None): Last time at which the agent was connected to the server
+        links (dict[str, ~meshctrl.types.UserLink]|None): Collection of links for the device
+        details (dict[str, dict]): Extra details about the device. These are not well defined, but are filled by calling :py:meth:`~meshctrl.session.Session.list_devices` with `details=True`.
+    '''
+
+
+class CompactDevice(_DeviceBase):
+    '''
+    Memory compact version of :py:class:`Device`, for holding large inventories. Passes isinstance checks for :py:class:`Device`. Takes the same arguments, including the aliases, and behaves the same.
+    Fields are stored in __slots__, empty links, tags, users and details are only allocated when they are read, and strings which repeat across a fleet are interned.
+    Use :py:class:`~meshctrl.session.Session` with `compact_models=True` to get these from the session.
+    '''
+    __slots__ = ("nodeid", "_session", "agent", "name", "computer_name", "icon", "mesh", "meshtype", "meshname", "domain", "host", "ip",
+                 "connected", "powered_on", "description", "os_description", "_created_at", "_lastconnect", "lastaddr",
+                 "_links", "_tags", "_users", "_details", "_extra")
+
+    links = util._EmptyOnDemand("_links", dict)
+    tags = util._EmptyOnDemand("_tags", list)
+    users = util._EmptyOnDemand("_users", list)
+    details = util._EmptyOnDemand("_details", dict)
+    _extra_props = util._EmptyOnDemand("_extra", dict)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.os_description = util._intern(self.os_description)
+        self.domain = util._intern(self.domain)
+        self.meshname = util._intern(self.meshname)
+        if self._extra is not None:
+            # Mostly meshid, which is the same for every device in a group
+            self._extra = {key: util._intern(val) for key, val in self._extra.items()}
+
+class DeviceList(collections.abc.Sequence):
+    '''
+    Read only sequence of devices which keeps the data returned from the server and only builds :py:class:`Device` objects as they are accessed. Returned by :py:meth:`~meshctrl.session.Session.list_devices` with `lazy=True`.
+
+    Args:
+        nodes (list[dict]): Node data as returned from the server
+        factory (function(node: dict)): Function used to build a :py:class:`Device` from a single node
+
+    Attributes:
+        nodes (list[dict]): Node data as returned from the server. Read this instead of the devices if you only need a few fields from a large server.
+    '''
+    def __init__(self, nodes, factory):
+        self.nodes = nodes
+        self._factory = factory
+        self._devices = [None]*len(nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("DeviceList index out of range")
+        d = self._devices[index]
+        if d is None:
+            d = self._devices[index] = self._factory(self.nodes[index])
+        return d
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __str__(self):
+        return f"<DeviceList: {len(self)} devices, {len(self) - self._devices.count(None)} built>"
+
+    def __repr__(self):
+        return f"DeviceList(nodes=<{len(self)} nodes>, factory={repr(self._factory)})"
+
+Device.register(CompactDevice)
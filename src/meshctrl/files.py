@@ -2,98 +2,132 @@ from . import tunnel
 from . import constants
 from . import exceptions
 from . import util
+from . import profiling
 import asyncio
+import inspect
+import io
 import json
-import importlib
-import importlib.util
-import shutil
-
-# import urllib
-# import urllib.request
+import os
 import urllib.parse
-old_parse = urllib.parse
-# Default proxy handler uses OS defined no_proxy in order to be helpful. This is unhelpful for our usecase. Monkey patch out proxy getting functions, but don't effect the user's urllib instance.
-spec = importlib.util.find_spec('urllib')
-urllib = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(urllib)
-spec = importlib.util.find_spec('urllib.request')
-urllib.request = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(urllib.request)
-urllib.parse = old_parse
-urllib.request.getproxies_environment = lambda: {}
-urllib.request.getproxies_registry = lambda: {}
-urllib.request.getproxies_macosx_sysconf = lambda: {}
-urllib.request.getproxies = lambda: {}
+
+# Bytes downloaded between checkpoint saves
+_CHECKPOINT_INTERVAL = 4 * 1024 * 1024
+
+class _Checkpoint(object):
+    # Progress of one transfer, kept in a JSON file so a later call, even from another process, can pick up where it stopped. With no path, progress is only counted.
+    def __init__(self, path, info):
+        self.path = path
+        self.info = info
+        self.start = 0
+        self.size = 0
+        self._saved = 0
+
+    def load(self):
+        # State saved by an earlier attempt at the same transfer, if any
+        if self.path is None:
+            return None
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(state, dict) or any(state.get(key, None) != value for key, value in self.info.items()):
+            return None
+        return state
+
+    def update(self, size):
+        self.size = size
+        if self.path is not None and size - self._saved >= _CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        # Write the whole file and swap it in, so a crash mid-write doesn't lose the last good checkpoint
+        temp = self.path + ".tmp"
+        with open(temp, "w") as f:
+            json.dump(dict(self.info, start=self.start, size=self.size), f)
+        os.replace(temp, self.path)
+        self._saved = self.size
+
+    def clear(self):
+        if self.path is None:
+            return
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
 
 class Files(tunnel.Tunnel):
-    def __init__(self, session, node):
-        super().__init__(session, node.nodeid, constants.Protocol.FILES)
+    # Requests which have to run one at a time, grouped by what they conflict with. The agent keeps a single upload and a single download per tunnel, and their binary frames carry no id.
+    # mkdir, rm and rename get no reply on the tunnel, only session events we can't tell apart. Anything else (ls) is answered with our reqid, so any number can be outstanding.
+    _exclusive = {"upload": "upload", "download": "download", "mkdir": "action", "rm": "action", "rename": "action"}
+
+    def __init__(self, session, node, codec=None):
+        super().__init__(session, node.nodeid, constants.Protocol.FILES, codec=codec)
         self.recorded = None
         self._node = node
         self._request_id = 0
-        self._request_queue = asyncio.Queue()
-        self._download_finished = asyncio.Event()
-        self._download_finished.set()
-        self._current_request = None
-        self._handle_requests_task = asyncio.create_task(self._handle_requests())
+        self._locks = {kind: asyncio.Lock() for kind in set(self._exclusive.values())}
+        # The request of each exclusive kind which is currently running
+        self._active = {kind: None for kind in self._locks}
+        # Requests answered by reqid, in the order they were sent
+        self._replies = {}
+        self._outstanding = {}
         self._chunk_size = 65564
-        proxies = {}
-        if self._session._proxy is not None:
-            # We don't know which protocol the user is going to use, but we only need support one at a time, so just assume both
-            proxies = {
-                "http": self._session._proxy,
-                "https": self._session._proxy,
-                "no": ""
-            }
-        self._proxy_handler = urllib.request.ProxyHandler(proxies=proxies)
-        self._http_opener = urllib.request.build_opener(self._proxy_handler, urllib.request.HTTPSHandler(context=self._session._ssl_context))
-
 
     def _get_request_id(self):
         self._request_id = (self._request_id+1)%(2**32-1)
         return self._request_id
 
     async def close(self):
-        self._handle_requests_task.cancel()
-        try:
-            await self._handle_requests_task
-        except asyncio.CancelledError:
-            pass
+        for request in list(self._outstanding.values()):
+            if not request["finished"].is_set():
+                request["error"] = exceptions.SocketError("Socket Closed")
+                request["errored"].set()
+                request["finished"].set()
         await super().close()
 
-    async def _handle_requests(self):
+    async def _run_request(self, request):
+        # Send a request and wait for it to finish, waiting first for any running request it conflicts with
+        kind = self._exclusive.get(request["type"], None)
+        self._outstanding[request["id"]] = request
         try:
-            while True:
-                request = await self._request_queue.get()
-                self._current_request = request
-                self._download_finished = request["finished"]
-                await self._message_queue.put(json.dumps(request["data"]))
+            if kind is None:
+                self._replies[request["id"]] = request
+                await self._message_queue.put(self._codec.dumps(request["data"]))
                 await request["finished"].wait()
-                self._current_request = None
-
-        except asyncio.CancelledError:
-            while True:
+                return
+            async with self._locks[kind]:
+                if request["finished"].is_set():
+                    # Failed while waiting its turn
+                    return
+                self._active[kind] = request
                 try:
-                    request = self._request_queue.get_nowait()
-                    request["error"] = exceptions.SocketError("Socket Closed")
-                    request["errored"].set()
-                    request["finished"].set()
-                except asyncio.QueueEmpty:
-                    break
-            raise
-            
-
-    @util._check_socket
-    async def _send_command(self, data, name, timeout=None):
+                    await self._message_queue.put(self._codec.dumps(request["data"]))
+                    await request["finished"].wait()
+                finally:
+                    self._active[kind] = None
+        finally:
+            self._outstanding.pop(request["id"], None)
+            self._replies.pop(request["id"], None)
+
+    def _new_request(self, data, name):
         request_id = f"meshctrl_{name}_{self._get_request_id()}"
-        request = {"id": request_id, "data": data, "return": None, "type": name, "finished": asyncio.Event(), "errored":asyncio.Event(), "error": None}
-        await self._request_queue.put(request)
+        if self._exclusive.get(name, None) is None:
+            data["reqid"] = request_id
+        return {"id": request_id, "data": data, "return": None, "type": name, "finished": asyncio.Event(), "errored":asyncio.Event(), "error": None}
 
-        await asyncio.wait_for(request["finished"].wait(), timeout=timeout)
+    @util._check_socket
+    async def _send_request(self, request, timeout=None):
+        await asyncio.wait_for(self._run_request(request), timeout=timeout)
         if request["error"] is not None:
             raise request["error"]
         return request["return"]
 
+    async def _send_command(self, data, name, timeout=None):
+        return await self._send_request(self._new_request(data, name), timeout=timeout)
+
     async def ls(self, directory, timeout=None):
         """
         Return a directory listing from the device
@@ -113,19 +147,24 @@ class Files(tunnel.Tunnel):
         data = await self._send_command({"action": "ls", "path": directory}, "ls", timeout=timeout)
         return data["dir"]
 
-    async def _listen_for_pass(self, tasks):
+    async def _listen_for_pass(self, request, tasks):
         async for event in self._session.events({"event": {"etype": "node", "action": "agentlog"}}):
+            # Until our request is sent, anything we see belongs to the one before it
+            if self._active["action"] is not request:
+                continue
             if not event["event"]["msg"].startswith("Started"):
-                self._current_request["return"] = event["event"]["msg"]
-                self._current_request["finished"].set()
+                request["return"] = event["event"]["msg"]
+                request["finished"].set()
                 tasks[1].cancel()
                 break
 
-    async def _listen_for_error(self, tasks):
+    async def _listen_for_error(self, request, tasks):
         async for event in self._session.events({"action":"msg", "type":"console"}):
-            self._current_request["error"] = exceptions.ServerError(event["value"])
-            self._current_request["errored"].set()
-            self._current_request["finished"].set()
+            if self._active["action"] is not request:
+                continue
+            request["error"] = exceptions.ServerError(event["value"])
+            request["errored"].set()
+            request["finished"].set()
             tasks[0].cancel()
             break
 
@@ -145,11 +184,12 @@ class Files(tunnel.Tunnel):
         Returns:
             bool: True if directory was created
         """
+        request = self._new_request({"action": "mkdir", "path": directory}, "mkdir")
         tasks = []
         async with asyncio.TaskGroup() as tg:
-            tasks.append(tg.create_task(asyncio.wait_for(self._listen_for_pass(tasks), timeout)))
-            tasks.append(tg.create_task(asyncio.wait_for(self._listen_for_error(tasks), timeout)))
-            tasks.append(tg.create_task(self._send_command({"action": "mkdir", "path": directory}, "mkdir", timeout=timeout)))
+            tasks.append(tg.create_task(asyncio.wait_for(self._listen_for_pass(request, tasks), timeout)))
+            tasks.append(tg.create_task(asyncio.wait_for(self._listen_for_error(request, tasks), timeout)))
+            tasks.append(tg.create_task(self._send_request(request, timeout=timeout)))
 
 
 
@@ -175,12 +215,13 @@ class Files(tunnel.Tunnel):
         """
         if isinstance(files, str):
             files = [files]
+        request = self._new_request({"action": "rm", "delfiles": files, "rec": recursive, "path": path}, "rm")
         tasks = []
 
         async with asyncio.TaskGroup() as tg:
-            tasks.append(tg.create_task(asyncio.wait_for(self._listen_for_pass(tasks), timeout)))
-            tasks.append(tg.create_task(asyncio.wait_for(self._listen_for_error(tasks), timeout)))
-            tasks.append(tg.create_task(self._send_command({"action": "rm", "delfiles": files, "rec": recursive, "path": path}, "rm", timeout=timeout)))
+            tasks.append(tg.create_task(asyncio.wait_for(self._listen_for_pass(request, tasks), timeout)))
+            tasks.append(tg.create_task(asyncio.wait_for(self._listen_for_error(request, tasks), timeout)))
+            tasks.append(tg.create_task(self._send_request(request, timeout=timeout)))
 
 
         return tasks[2].result()
@@ -203,26 +244,29 @@ class Files(tunnel.Tunnel):
         Returns:
             str: Info about file renamed. Something along the lines of 'Rename: "/path/to/file" to "newfile"'.
         """
+        request = self._new_request({"action": "rename", "path": path, "oldname": name, "newname": new_name}, "rename")
         tasks = []
 
         async with asyncio.TaskGroup() as tg:
-            tasks.append(tg.create_task(asyncio.wait_for(self._listen_for_pass(tasks), timeout)))
-            tasks.append(tg.create_task(asyncio.wait_for(self._listen_for_error(tasks), timeout)))
-            tasks.append(tg.create_task(self._send_command({"action": "rename", "path": path, "oldname": name, "newname": new_name}, "rename", timeout=timeout)))
+            tasks.append(tg.create_task(asyncio.wait_for(self._listen_for_pass(request, tasks), timeout)))
+            tasks.append(tg.create_task(asyncio.wait_for(self._listen_for_error(request, tasks), timeout)))
+            tasks.append(tg.create_task(self._send_request(request, timeout=timeout)))
 
 
         return tasks[2].result()
 
     @util._check_socket
-    async def upload(self, source, target, name=None, timeout=None):
+    async def upload(self, source, target, name=None, timeout=None, window=8, checkpoint=None):
         '''
         Upload a stream to a device.
 
         Args:
-            source (io.IOBase): An IO instance from which to read the data. Must be open for reading.
+            source (io.IOBase): An IO instance from which to read the data. Must be open for reading. Reads from anything but an in memory buffer are done in a worker thread, so a slow disk doesn't hold up the event loop. If `source.read` is a coroutine function, it is awaited instead.
             target (str): Path which to upload stream to on remote device
             name (str): Pass if target points at a directory instead of the file path. In that case, this will be the name of the file.
             timeout (int): duration in seconds to wait for a response before throwing an error
+            window (int): Most chunks sent but not yet acknowledged by the device. Larger windows keep a high latency link busy; each chunk held costs about 64 KB of memory.
+            checkpoint (str|None): Path of a file to note this upload in while it runs. If a previous upload to the same target left one behind, this upload resumes it: the file on the device is listed to see how much of it arrived, `source` is moved that far forward, and the rest is appended. `source` must be seekable for this, and positioned where it was for the first attempt. The checkpoint file is removed once the upload finishes.
 
         Raises:
             :py:class:`~meshctrl.exceptions.FileTransferError`: File transfer failed. Info available on the `stats` property
@@ -230,23 +274,47 @@ class Files(tunnel.Tunnel):
             asyncio.TimeoutError: Command timed out
 
         Returns:
-            dict: {result: bool whether upload succeeded, size: number of bytes uploaded}
+            dict: {result: bool whether upload succeeded, size: number of bytes uploaded, including any uploaded by an earlier attempt}
         '''
         request_id = f"upload_{self._get_request_id()}"
         data = { "action": 'upload', "reqid": request_id, "path": target, "name": name}
-        request = {"id": request_id, "data": data, "type": "upload", "source": source, "target": target, "name": name, "size": 0, "complete": False, "inflight": 0, "finished": asyncio.Event(), "errored":asyncio.Event(), "error": None}
-        await self._request_queue.put(request)
-        await asyncio.wait_for(request["finished"].wait(), timeout)
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        checkpoint = _Checkpoint(checkpoint, {"action": "upload", "nodeid": self._node.nodeid, "target": target, "name": name})
+        if checkpoint.load() is not None:
+            checkpoint.size = await self._remote_size(target, name, timeout)
+            if checkpoint.size:
+                source.seek(checkpoint.size, io.SEEK_CUR)
+                data["append"] = True
+        request = {"id": request_id, "data": data, "type": "upload", "source": source, "target": target, "name": name, "size": checkpoint.size, "checkpoint": checkpoint, "complete": False, "inflight": 0, "window": window, "acked": asyncio.Event(), "pump": None, "finished": asyncio.Event(), "errored":asyncio.Event(), "error": None}
+        try:
+            await asyncio.wait_for(self._run_request(request), timeout)
+        finally:
+            if request["pump"] is not None:
+                request["pump"].cancel()
         if request["error"] is not None:
             raise request["error"]
+        checkpoint.clear()
         return request["return"]
 
-    def _http_download(self, url, target, timeout):
-        response = self._http_opener.open(url, timeout=timeout)
-        shutil.copyfileobj(response, target)
+    async def _remote_size(self, target, name, timeout):
+        # Size of a file on the device, or 0 if it isn't there
+        if name is None:
+            split = max(target.rfind("/"), target.rfind("\\"))
+            # Keep the separator if it's the root
+            target, name = target[:split] if split > 0 else target[:split+1], target[split+1:]
+        try:
+            entries = await self.ls(target, timeout=timeout)
+        except KeyError:
+            # Directory isn't there either
+            return 0
+        for entry in entries or []:
+            if entry.get("n", None) == name and entry.get("t", None) == constants.FileType.FILE:
+                return entry.get("s", 0)
+        return 0
 
     @util._check_socket
-    async def download(self, source, target, skip_http_attempt=False, skip_ws_attempt=False, timeout=None):
+    async def download(self, source, target, skip_http_attempt=False, skip_ws_attempt=False, timeout=None, parallel=1, checkpoint=None):
         '''
         Download a file from a device into a writable stream.
 
@@ -256,6 +324,8 @@ class Files(tunnel.Tunnel):
             skip_http_attempt (bool): Meshcentral has a way to download files through http(s) instead of through the websocket. This method tends to be much faster than using the websocket, so we try it first. Setting this to True will skip that attempt and just use the established websocket connection.
             skip_ws_attempt (bool): Like skip_http_attempt, except just throw an error if the http attempt fails instead of trying with the websocket
             timeout (int): duration in seconds to wait for a response before throwing an error
+            parallel (int): Number of byte ranges to fetch at once over http(s), each on its own connection and written at its offset in `target`. `target` must be seekable for this, such as a file or a memory map already big enough for the file. Falls back to a single stream if the server doesn't honor Range requests. Has no effect on websocket downloads.
+            checkpoint (str|None): Path of a file to save progress to as the download runs. If a previous download of the same file left one behind, this download resumes it: `target` is moved to where that one stopped, and the rest is fetched over http(s) with a Range request. `target` must be seekable for this, and hold what the earlier attempt wrote, e.g. the same file opened with mode "r+b". Websocket downloads can't resume, since the agent always sends a file from its start, so they start over. The checkpoint file is removed once the download finishes. If the file on the device changed in between, the result is a mix of both versions.
 
         Raises:
             :py:class:`~meshctrl.exceptions.FileTransferError`: File transfer failed. Info available on the `stats` property
@@ -263,13 +333,21 @@ class Files(tunnel.Tunnel):
             asyncio.TimeoutError: Command timed out
 
         Returns:
-            dict: {result: bool whether download succeeded, size: number of bytes downloaded}
+            dict: {result: bool whether download succeeded, size: number of bytes downloaded, including any downloaded by an earlier attempt}
         '''
         request_id = f"download_{self._get_request_id()}"
         data = { "action": 'download', "sub": 'start', "id": request_id, "path": source }
-        request = {"id": request_id, "data": data, "type": "download", "source": source, "target": target, "size": 0, "finished": asyncio.Event(), "errored": asyncio.Event(), "error": None}
+        checkpoint = _Checkpoint(checkpoint, {"action": "download", "nodeid": self._node.nodeid, "source": source})
+        state = checkpoint.load()
+        if state is not None:
+            checkpoint.start = state["start"]
+            checkpoint.size = state["size"]
+            target.seek(checkpoint.start + checkpoint.size)
+        elif checkpoint.path is not None or not skip_http_attempt:
+            checkpoint.start = target.tell()
+        request = {"id": request_id, "data": data, "type": "download", "source": source, "target": target, "size": 0, "checkpoint": checkpoint, "finished": asyncio.Event(), "errored": asyncio.Event(), "error": None}
         if not skip_http_attempt:
-            start_pos = target.tell()
+            resumed = checkpoint.size
             try:
                 params = urllib.parse.urlencode({
                     "c": self._authcookie["cookie"],
@@ -280,99 +358,150 @@ class Files(tunnel.Tunnel):
                 url = self._session.url.replace('/control.ashx', f"/devicefile.ashx?{params}")
                 url = url.replace("wss://", "https://").replace("ws://", "http://")
 
-                loop = asyncio.get_event_loop()
-                await loop.run_in_executor(None, self._http_download, url, target, timeout)
-                size = target.tell() - start_pos
+                size = resumed + await self._session._http.download(url, target, parallel=parallel, timeout=timeout, offset=resumed, progress=lambda count: checkpoint.update(resumed + count))
+                checkpoint.clear()
                 return {"result": True, "size": size}
             except* Exception as eg:
+                checkpoint.save()
                 if skip_ws_attempt:
-                    size = target.tell() - start_pos
-                    excs = eg.exceptions + (exceptions.FileTransferError("Errored", {"result": False, "size": size}),)
+                    excs = eg.exceptions + (exceptions.FileTransferError("Errored", {"result": False, "size": checkpoint.size}),)
                     raise ExceptionGroup("File download failed", excs)
-                target.seek(start_pos)
+                target.seek(checkpoint.start)
+                checkpoint.size = 0
+        elif checkpoint.size:
+            # The agent only sends whole files, so start over
+            target.seek(checkpoint.start)
+            checkpoint.size = 0
 
-        await self._request_queue.put(request)
-        await asyncio.wait_for(request["finished"].wait(), timeout)
+        try:
+            await asyncio.wait_for(self._run_request(request), timeout)
+        except BaseException:
+            checkpoint.save()
+            raise
         if request["error"] is not None:
+            checkpoint.save()
             raise request["error"]
+        checkpoint.clear()
         return request["return"]
 
-    async def _handle_upload(self, data):
-        cmd = None
-        try:
-            cmd = json.loads(data)
-        except:
+    async def _handle_upload(self, request, cmd):
+        if cmd.get("reqid", None) != request["id"]:
             return
-        if cmd["reqid"] == self._current_request["id"]:
-            if cmd["action"] == "uploaddone":
-                self._current_request["return"] = {"result": True, "size": self._current_request["size"]}
-                self._current_request["finished"].set()
-            elif cmd["action"] == "uploadstart":
-                while True:
-                    data = self._current_request["source"].read(self._chunk_size)
+        if cmd["action"] == "uploaddone":
+            request["return"] = {"result": True, "size": request["size"]}
+            request["finished"].set()
+        elif cmd["action"] == "uploadstart":
+            # From here the file on the device is ours to resume
+            request["checkpoint"].save()
+            # Chunks are sent from their own task, so acks keep being read while we wait on the source
+            request["pump"] = asyncio.create_task(self._upload_pump(request))
+        elif cmd["action"] == "uploadack":
+            request["inflight"] -= 1
+            request["acked"].set()
+            if request["inflight"] == 0 and request["complete"]:
+                await self._message_queue.put(self._codec.dumps({ "action": 'uploaddone', "reqid": request["id"]}))
+        elif cmd["action"] == "uploaderror":
+            request["return"] = {"result": False, "size": request["size"]}
+            request["error"] = exceptions.FileTransferError("Errored", request["return"])
+            request["errored"].set()
+            request["finished"].set()
+
+    async def _read_chunk(self, source):
+        if inspect.iscoroutinefunction(source.read):
+            return await source.read(self._chunk_size)
+        if isinstance(source, io.BytesIO):
+            # Nothing to wait on, so not worth a thread
+            return source.read(self._chunk_size)
+        return await asyncio.to_thread(source.read, self._chunk_size)
+
+    async def _upload_pump(self, request):
+        # Keep up to request["window"] chunks unacknowledged. Each uploadack frees a slot, so we hold at most a window's worth of the file in memory.
+        profiler = self._session.profiler
+        try:
+            while True:
+                if request["inflight"] >= request["window"]:
+                    request["acked"].clear()
+                    await request["acked"].wait()
+                    continue
+                with profiling._span(profiler, "files.upload_chunk", {"size": self._chunk_size}):
+                    data = await self._read_chunk(request["source"])
                     if len(data) == 0:
-                        self._current_request["complete"] = True
-                        if self._current_request["inflight"] == 0:
-                            await self._message_queue.put(json.dumps({ "action": 'uploaddone', "reqid": self._current_request["id"]}))
+                        request["complete"] = True
+                        if request["inflight"] == 0:
+                            await self._message_queue.put(self._codec.dumps({ "action": 'uploaddone', "reqid": request["id"]}))
                         break
-                    else:
-                        self._current_request["size"] += len(data)
-                        if data[0] == 0 or data[0] == 123:
-                            data = b'\0' + data
-                        await self._message_queue.put(data)
-                        self._current_request["inflight"] += 1
-                    await asyncio.sleep(0)
-            elif cmd["action"] == "uploadack":
-                self._current_request["inflight"] -= 1
-                if self._current_request["inflight"] == 0 and self._current_request["complete"]:
-                    await self._message_queue.put(json.dumps({ "action": 'uploaddone', "reqid": self._current_request["id"]}))
-            elif cmd["action"] == "uploaderror":
-                self._current_request["return"] = {"result": False, "size": self._current_request["size"]}
-                self._current_request["error"] = exceptions.FileTransferError("Errored", self._current_request["return"])
-                self._current_request["errored"].set()
-                self._current_request["finished"].set()
-
-    async def _handle_download(self, data):
-        cmd = None
-        try:
-            cmd = json.loads(data)
-        except:
-            pass
+                    request["size"] += len(data)
+                    if data[0] == 0 or data[0] == 123:
+                        data = b'\0' + data
+                    await self._message_queue.put(data)
+                    request["inflight"] += 1
+        except Exception as e:
+            request["return"] = {"result": False, "size": request["size"]}
+            request["error"] = exceptions.FileTransferError("Errored", request["return"])
+            request["error"].__cause__ = e
+            request["errored"].set()
+            request["finished"].set()
+
+    async def _handle_download(self, request, data, cmd):
         if cmd is None:
             if len(data) > 4:
-                self._current_request["target"].write(data[4:])
-                self._current_request["size"] += len(data)-4
+                with profiling._span(self._session.profiler, "files.download_chunk", {"size": len(data)-4}):
+                    request["target"].write(data[4:])
+                request["size"] += len(data)-4
+                request["checkpoint"].update(request["size"])
             if (data[3] & 1) != 0:
-                self._current_request["return"] = {"result": True, "size": self._current_request["size"]}
-                self._current_request["finished"].set()
+                request["return"] = {"result": True, "size": request["size"]}
+                request["finished"].set()
             else:
-                await self._message_queue.put(json.dumps({ "action": 'download', "sub": 'ack', "id": self._current_request["id"] }))
+                await self._message_queue.put(self._codec.dumps({ "action": 'download', "sub": 'ack', "id": request["id"] }))
         else:
-            if cmd["action"] == "download":
-                if cmd["id"] != self._current_request["id"]:
-                    return
-                if cmd["sub"] == "start":
-                    await self._message_queue.put(json.dumps({ "action": 'download', "sub": 'startack', "id": self._current_request["id"] }))
-                elif cmd["sub"] == "cancel":
-                    self._current_request["return"] = {"result": False, "size": self._current_request["size"]}
-                    self._current_request["error"] = exceptions.FileTransferCancelled("Cancelled", self._current_request["return"])
-                    self._current_request["errored"].set()
-                    self._current_request["finished"].set()
-
-    async def _handle_action(self, data):
-        self._current_request["return"] = json.loads(data)
-        self._download_finished.set()
-
+            if cmd["id"] != request["id"]:
+                return
+            if cmd["sub"] == "start":
+                await self._message_queue.put(self._codec.dumps({ "action": 'download', "sub": 'startack', "id": request["id"] }))
+            elif cmd["sub"] == "cancel":
+                request["return"] = {"result": False, "size": request["size"]}
+                request["error"] = exceptions.FileTransferCancelled("Cancelled", request["return"])
+                request["errored"].set()
+                request["finished"].set()
+
+    def _handle_reply(self, cmd):
+        if "reqid" in cmd:
+            # An unknown reqid is a late reply to a request which already gave up, so nobody is waiting for it
+            request = self._replies.pop(cmd["reqid"], None)
+        else:
+            # Older agents don't echo reqid. They answer in order, so this is the oldest request of the same action we're waiting on. Replies which don't name their action can go to any.
+            action = cmd.get("action", None)
+            request = None
+            for id, pending in self._replies.items():
+                if action is None or pending["data"].get("action", None) == action:
+                    request = self._replies.pop(id)
+                    break
+        if request is not None:
+            request["return"] = cmd
+            request["finished"].set()
 
     async def _listen_data_task(self, websocket):
         async for message in websocket:
             if self.initialized.is_set():
-                if message[0] == 123 and self._current_request is not None and self._current_request["type"] not in ("upload", "download"):
-                    await self._handle_action(message)
-                elif self._current_request is not None and self._current_request["type"] == "upload":
-                    await self._handle_upload(message)
-                elif self._current_request is not None and self._current_request["type"] == "download":
-                    await self._handle_download(message)
+                cmd = None
+                # Download chunks start with a binary header, everything else is JSON
+                if message[:1] in (b"{", "{"):
+                    try:
+                        cmd = self._codec.loads(message)
+                    except ValueError:
+                        pass
+                if cmd is None:
+                    if self._active["download"] is not None:
+                        await self._handle_download(self._active["download"], message, None)
+                elif cmd.get("action", None) in ("uploadstart", "uploadack", "uploaddone", "uploaderror"):
+                    if self._active["upload"] is not None:
+                        await self._handle_upload(self._active["upload"], cmd)
+                elif cmd.get("action", None) == "download":
+                    if self._active["download"] is not None:
+                        await self._handle_download(self._active["download"], message, cmd)
+                elif "ctrlChannel" not in cmd:
+                    self._handle_reply(cmd)
             else:
                 self.recorded = False
                 if message == "cr":
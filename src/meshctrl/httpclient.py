@@ -0,0 +1,412 @@
+'''
+A small asyncio HTTP/1.1 client for the server's plain HTTP endpoints, such as the `devicefile.ashx` file download.
+
+Connections are kept alive and reused between requests, so many downloads don't each pay for a new TLS handshake, and nothing runs in a thread. Proxies are connected through python_socks, the same as the session's websockets, and proxy settings from the environment are never used.
+'''
+
+import asyncio
+import collections
+import functools
+import time
+import urllib.parse
+
+from python_socks.async_.asyncio import Proxy
+
+from . import exceptions
+from . import profiling
+
+_READ_SIZE = 65536
+# Statuses whose Location we follow, and how many times in a row
+_REDIRECTS = (301, 302, 303, 307, 308)
+_MAX_REDIRECTS = 5
+
+class HTTPPool(object):
+    '''
+    Keep-alive connections to the servers a session talks to, pooled per scheme, host and port. Every :py:class:`~meshctrl.session.Session` has one, shared by its file explorers.
+
+    Args:
+        ssl_context (ssl.SSLContext|None): Context for https connections. None verifies certificates as usual.
+        proxy (str|None): Proxy URL, such as "http://proxy:3128" or "socks5://proxy:1080"
+        user_agent (str|None): User-Agent header to send
+        max_connections (int): Most connections open to each server at once. Requests over this wait for a connection to free up.
+        idle_timeout (float): Seconds a connection may sit unused before it is closed instead of reused
+        profiler (~meshctrl.profiling.Profiler|None): Hooks to span each chunk written by :py:meth:`download` with, as `files.download_chunk`
+
+    Raises:
+        ValueError: max_connections is less than 1
+    '''
+
+    # Smallest byte range worth its own connection in a parallel download
+    min_part_size = 1024 * 1024
+
+    def __init__(self, ssl_context=None, proxy=None, user_agent=None, max_connections=16, idle_timeout=30, profiler=None):
+        if max_connections < 1:
+            raise ValueError("max_connections must be at least 1")
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self._ssl_context = ssl_context
+        self._proxy = proxy
+        self._user_agent = user_agent
+        self._profiler = profiler
+        # Idle connections by server, most recently used last
+        self._idle = {}
+        self._slots = {}
+        self._closed = False
+
+    def get(self, url, headers=None, timeout=None):
+        '''
+        Send a GET request
+
+        Args:
+            url (str): "http://" or "https://" URL to fetch
+            headers (dict[str, str]|None): Extra request headers, such as "Range"
+            timeout (float|None): Seconds to wait on any single read or write before giving up. The request as a whole may take longer.
+
+        Returns:
+            Async context manager giving an :py:class:`HTTPResponse`. Its connection goes back to the pool on exit if the body was read to the end, and is closed otherwise. Redirects are followed, so this is the response from wherever they lead.
+
+        Raises:
+            :py:class:`~meshctrl.exceptions.ServerError`: More than 5 redirects in a row
+        '''
+        return _Request(self, url, headers, timeout)
+
+    async def download(self, url, target, parallel=1, timeout=None, offset=0, progress=None):
+        '''
+        Download a URL into a writable stream, starting at the stream's current position
+
+        Args:
+            url (str): "http://" or "https://" URL to fetch
+            target (io.IOBase|mmap.mmap): Stream to write to. For a parallel download it must be seekable, such as a file opened for writing or a memory map already big enough for the body.
+            parallel (int): Number of byte ranges to fetch at once. Each range gets its own connection, and is written at its offset in `target`. Falls back to a single stream if the server doesn't honor Range requests, if `target` isn't seekable, or if the body is too small to be worth splitting.
+            timeout (float|None): Seconds to wait on any single read or write before giving up
+            offset (int): Byte of the body to start from, to pick up an earlier download where it stopped. It is written at the stream's current position. If the server doesn't honor Range requests, the bytes before it are read and thrown away.
+            progress (Callable[[int], None]|None): Called as bytes are written, with the number written so far. For a parallel download, only bytes with none missing before them are counted, so `offset` plus this is always a safe place to resume from.
+
+        Raises:
+            :py:class:`~meshctrl.exceptions.ServerError`: Server answered with an error status, didn't send the range asked for, or redirected too many times
+
+        Returns:
+            int: Number of bytes written. `target` is left positioned after the last of them.
+        '''
+        seekable = getattr(target, "seekable", None)
+        # Memory maps can seek, but don't say so
+        split = parallel > 1 and (seekable is None or seekable())
+        headers = {"Range": f"bytes={offset}-"} if split or offset else None
+        async with self.get(url, headers=headers, timeout=timeout) as response:
+            if response.status == 200:
+                return await self._write(response, target, skip=offset, progress=progress)
+            if response.status == 416 and offset and response.headers.get("content-range", None) == f"bytes */{offset}":
+                # An earlier download got all of it
+                return 0
+            content_range = response.content_range if response.status == 206 else None
+            if content_range is None or content_range[0] != offset:
+                raise exceptions.ServerError(f"HTTP {response.status} {response.reason}")
+            total = content_range[2]
+            parts = 1
+            if split and total is not None:
+                parts = min(parallel, -(-(total - offset) // self.min_part_size))
+            if parts < 2:
+                return await self._write(response, target, progress=progress)
+            start = target.tell()
+            part_size = -(-(total - offset) // parts)
+            sizes = [min(part_size, total - offset - first) for first in range(0, total - offset, part_size)]
+            done = [0] * len(sizes)
+
+            def advance(part, written):
+                done[part] = written
+                if progress is not None:
+                    contiguous = 0
+                    for count, size in zip(done, sizes):
+                        contiguous += count
+                        if count < size:
+                            break
+                    progress(contiguous)
+
+            ranges = [asyncio.create_task(self._download_range(url, target, offset + part * part_size, sizes[part], start + part * part_size, timeout, functools.partial(advance, part))) for part in range(1, len(sizes))]
+            try:
+                # This response carries the first range. The rest of it is left unread, and its connection closed, so it doesn't hold a place in the pool while the other ranges finish.
+                await self._write(response, target, start, sizes[0], progress=functools.partial(advance, 0))
+            except BaseException:
+                await self._cancel(ranges)
+                raise
+        try:
+            await asyncio.gather(*ranges)
+        except BaseException:
+            await self._cancel(ranges)
+            raise
+        target.seek(start + total - offset)
+        return total - offset
+
+    async def _cancel(self, tasks):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _download_range(self, url, target, first, size, position, timeout, progress):
+        last = first + size - 1
+        async with self.get(url, headers={"Range": f"bytes={first}-{last}"}, timeout=timeout) as response:
+            content_range = response.content_range if response.status == 206 else None
+            if content_range is None or content_range[0] != first:
+                raise exceptions.ServerError(f"Range {first}-{last} not honored: HTTP {response.status} {response.reason}")
+            if await self._write(response, target, position, size, progress=progress) != size:
+                raise exceptions.ServerError(f"Range {first}-{last} came back short")
+
+    async def _write(self, response, target, position=None, limit=None, skip=0, progress=None):
+        # Write the body at position, or at the current position if None, after dropping its first skip bytes, and stopping after limit bytes
+        written = 0
+        async for chunk in response.iter_chunks():
+            if skip:
+                if len(chunk) <= skip:
+                    skip -= len(chunk)
+                    continue
+                chunk = chunk[skip:]
+                skip = 0
+            if limit is not None and written + len(chunk) > limit:
+                chunk = chunk[:limit - written]
+            with profiling._span(self._profiler, "files.download_chunk", {"size": len(chunk)}):
+                if position is not None:
+                    target.seek(position + written)
+                target.write(chunk)
+            written += len(chunk)
+            if progress is not None:
+                progress(written)
+            if written == limit:
+                break
+        return written
+
+    async def close(self):
+        '''
+        Close every idle connection. Connections still in use are closed when their requests finish.
+        '''
+        self._closed = True
+        for connections in self._idle.values():
+            while connections:
+                connections.pop()[1].close()
+
+    async def _open(self, key):
+        scheme, host, port = key
+        ssl = None
+        if scheme == "https":
+            ssl = self._ssl_context if self._ssl_context is not None else True
+        if self._proxy is None:
+            return await asyncio.open_connection(host, port, ssl=ssl, limit=_READ_SIZE)
+        sock = await Proxy.from_url(self._proxy).connect(host, port)
+        return await asyncio.open_connection(sock=sock, ssl=ssl, server_hostname=host if ssl else None, limit=_READ_SIZE)
+
+    def _checkout(self, key):
+        connections = self._idle.get(key, None)
+        now = time.monotonic()
+        while connections:
+            idle_since, writer, reader = connections.pop()
+            if now - idle_since < self.idle_timeout and not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        return None
+
+    def _checkin(self, key, reader, writer):
+        if self._closed:
+            writer.close()
+            return
+        self._idle.setdefault(key, collections.deque()).append((time.monotonic(), writer, reader))
+
+    def _slot(self, key):
+        slot = self._slots.get(key, None)
+        if slot is None:
+            slot = self._slots[key] = asyncio.Semaphore(self.max_connections)
+        return slot
+
+class HTTPResponse(object):
+    '''
+    Response to a request made through :py:class:`HTTPPool`
+
+    Attributes:
+        status (int): HTTP status code
+        reason (str): HTTP reason phrase
+        headers (dict[str, str]): Response headers, with lower case names
+    '''
+
+    def __init__(self, reader, status, reason, headers, keep_alive, timeout):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._reader = reader
+        self._timeout = timeout
+        self._keep_alive = keep_alive
+        self._done = False
+        if status in (204, 304) or 100 <= status < 200:
+            self._remaining = 0
+            self._done = True
+        elif "chunked" in headers.get("transfer-encoding", "").lower():
+            self._remaining = None
+        elif "content-length" in headers:
+            self._remaining = int(headers["content-length"])
+            self._done = self._remaining == 0
+        else:
+            # Body runs until the server closes the connection
+            self._remaining = -1
+            self._keep_alive = False
+
+    @property
+    def content_range(self):
+        '''
+        First byte, last byte and total size from the Content-Range header. Total is None if the server didn't give it.
+
+        Returns:
+            tuple[int, int, int|None]|None: The range, or None if there's no usable Content-Range header
+        '''
+        value = self.headers.get("content-range", "")
+        unit, _, value = value.partition(" ")
+        span, _, total = value.partition("/")
+        first, _, last = span.partition("-")
+        if unit != "bytes" or not first.isdigit() or not last.isdigit():
+            return None
+        return int(first), int(last), int(total) if total.isdigit() else None
+
+    async def _read(self, read, *args):
+        async with asyncio.timeout(self._timeout):
+            return await read(*args)
+
+    async def iter_chunks(self):
+        '''
+        Read the body as it arrives
+
+        Yields:
+            bytes: Next piece of the body
+        '''
+        reader = self._reader
+        if self._remaining is None:
+            while True:
+                line = await self._read(reader.readuntil, b"\r\n")
+                size = int(line.split(b";", 1)[0], 16)
+                if size == 0:
+                    # Skip any trailers
+                    while await self._read(reader.readuntil, b"\r\n") != b"\r\n":
+                        pass
+                    break
+                while size:
+                    chunk = await self._read(reader.read, min(size, _READ_SIZE))
+                    if not chunk:
+                        raise asyncio.IncompleteReadError(b"", size)
+                    size -= len(chunk)
+                    yield chunk
+                await self._read(reader.readexactly, 2)
+        elif self._remaining < 0:
+            while True:
+                chunk = await self._read(reader.read, _READ_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        else:
+            while self._remaining:
+                chunk = await self._read(reader.read, min(self._remaining, _READ_SIZE))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b"", self._remaining)
+                self._remaining -= len(chunk)
+                yield chunk
+        self._done = True
+
+    async def read(self):
+        '''
+        Read the whole body
+
+        Returns:
+            bytes: Body of the response
+        '''
+        return b"".join([chunk async for chunk in self.iter_chunks()])
+
+class _Request(object):
+    __slots__ = ("_pool", "_url", "_headers", "_timeout", "_key", "_slot", "_reader", "_writer", "_response")
+
+    def __init__(self, pool, url, headers, timeout):
+        self._pool = pool
+        self._url = url
+        self._headers = headers
+        self._timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._response = None
+
+    def _request_bytes(self, parsed):
+        target = parsed.path or "/"
+        if parsed.query:
+            target += "?" + parsed.query
+        lines = [f"GET {target} HTTP/1.1", f"Host: {parsed.netloc}", "Accept-Encoding: identity", "Connection: keep-alive"]
+        if self._pool._user_agent:
+            lines.append(f"User-Agent: {self._pool._user_agent}")
+        for name, value in (self._headers or {}).items():
+            lines.append(f"{name}: {value}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def _exchange(self, data):
+        self._writer.write(data)
+        async with asyncio.timeout(self._timeout):
+            await self._writer.drain()
+            while True:
+                head = await self._reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                status_line = lines[0].split(" ", 2)
+                version, status = status_line[0], int(status_line[1])
+                # Interim responses, such as 100 Continue from a proxy, have no body and come before the real one
+                if not 100 <= status < 200 or status == 101:
+                    break
+        reason = status_line[2] if len(status_line) > 2 else ""
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+        return HTTPResponse(self._reader, status, reason, headers, keep_alive, self._timeout)
+
+    async def __aenter__(self):
+        url = self._url
+        for redirect in range(_MAX_REDIRECTS + 1):
+            response = await self._send(url)
+            location = response.headers.get("location", None)
+            if response.status not in _REDIRECTS or location is None:
+                return response
+            # The redirect's body isn't worth reading just to keep its connection, and the next request may go to another server anyway
+            self._writer.close()
+            self._slot.release()
+            url = urllib.parse.urljoin(url, location)
+        raise exceptions.ServerError(f"Too many redirects fetching {self._url}")
+
+    async def _send(self, url):
+        self._writer = None
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL scheme: {parsed.scheme}")
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self._key = (parsed.scheme, parsed.hostname, port)
+        data = self._request_bytes(parsed)
+        self._slot = self._pool._slot(self._key)
+        await self._slot.acquire()
+        try:
+            connection = self._pool._checkout(self._key)
+            if connection is not None:
+                self._reader, self._writer = connection
+                try:
+                    self._response = await self._exchange(data)
+                    return self._response
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    # The server closed it while it sat idle. Try again on a new one.
+                    self._writer.close()
+            async with asyncio.timeout(self._timeout):
+                self._reader, self._writer = await self._pool._open(self._key)
+            self._response = await self._exchange(data)
+            return self._response
+        except BaseException:
+            if self._writer is not None:
+                self._writer.close()
+            self._slot.release()
+            raise
+
+    async def __aexit__(self, exc_t, exc_v, exc_tb):
+        try:
+            if exc_t is None and self._response._done and self._response._keep_alive:
+                self._pool._checkin(self._key, self._reader, self._writer)
+            else:
+                self._writer.close()
+        finally:
+            self._slot.release()
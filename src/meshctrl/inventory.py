@@ -0,0 +1,176 @@
+'''
+Client side cache of the devices and device groups visible to a session, kept current with the events the server streams to us.
+'''
+
+import collections
+import time
+
+class InventoryCache(object):
+    '''
+    Cache of node and mesh data as returned by the server. Pass one to :py:class:`~meshctrl.session.Session` with `inventory_cache` to have the session answer device lookups from it instead of fetching the whole fleet.
+    The session seeds it from `nodes` and `meshes` the first time it is needed, then keeps it current from `node` and `mesh` events. It is cleared whenever the connection to the server is lost, since we may have missed events.
+
+    Args:
+        ttl (float|None): Seconds after which an entry is considered stale, counting from the last time the server told us about it. Stale entries are fetched again. None means entries never go stale, and we rely on events alone.
+        max_size (int|None): Maximum number of devices to keep. The least recently used devices are evicted first. None means no limit.
+
+    Attributes:
+        ttl (float|None): Seconds after which an entry is considered stale
+        max_size (int|None): Maximum number of devices to keep
+        hits (int): Number of lookups answered from the cache
+        misses (int): Number of lookups which were not in the cache, or were stale
+    '''
+
+    # Keys in mesh events which describe the event rather than the mesh
+    _event_keys = frozenset(("etype", "action", "msg", "msgid", "msgArgs", "username", "userid", "nolog", "h", "meshid", "nodeid", "node", "ids"))
+
+    def __init__(self, ttl=None, max_size=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._nodes = collections.OrderedDict()
+        self._meshes = {}
+        self._seeded_at = None
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, nodeid):
+        return nodeid in self._nodes
+
+    @property
+    def needs_seed(self):
+        '''
+        Whether the cache has never been filled, or was filled longer than `ttl` ago
+        '''
+        return self._seeded_at is None or (self.ttl is not None and time.monotonic() - self._seeded_at >= self.ttl)
+
+    def _stale(self, updated_at):
+        return self.ttl is not None and time.monotonic() - updated_at >= self.ttl
+
+    def clear(self):
+        '''
+        Drop everything. The next lookup will seed the cache again.
+        '''
+        self._nodes.clear()
+        self._meshes.clear()
+        self._seeded_at = None
+
+    def seed(self, meshes, nodes):
+        '''
+        Replace the contents of the cache
+
+        Args:
+            meshes (list[dict]): `meshes` field of a `meshes` reply
+            nodes (dict[str, list[dict]]): `nodes` field of a `nodes` reply
+        '''
+        self._nodes.clear()
+        self._meshes.clear()
+        for _mesh in meshes:
+            self.put_mesh(_mesh)
+        for meshid, node_list in nodes.items():
+            for node in node_list:
+                self.put_node(dict(node, meshid=meshid))
+        self._seeded_at = time.monotonic()
+
+    def put_node(self, node):
+        '''
+        Add or replace a device
+
+        Args:
+            node (dict): Node data as returned from the server. It must include "_id", and should include "meshid".
+        '''
+        nodeid = node["_id"]
+        self._nodes[nodeid] = (node, time.monotonic())
+        self._nodes.move_to_end(nodeid)
+        if self.max_size is not None:
+            while len(self._nodes) > self.max_size:
+                self._nodes.popitem(last=False)
+
+    def put_mesh(self, mesh):
+        '''
+        Add or replace a device group
+
+        Args:
+            mesh (dict): Mesh data as returned from the server. It must include "_id".
+        '''
+        self._meshes[mesh["_id"]] = (mesh, time.monotonic())
+
+    def get_node(self, nodeid):
+        '''
+        Look up a device
+
+        Args:
+            nodeid (str): Full id of the device ("node/domain/id")
+
+        Returns:
+            dict|None: Copy of the node data, or None if it isn't cached or is stale
+        '''
+        entry = self._nodes.get(nodeid, None)
+        if entry is None or self._stale(entry[1]):
+            if entry is not None:
+                del self._nodes[nodeid]
+            self.misses += 1
+            return None
+        self._nodes.move_to_end(nodeid)
+        self.hits += 1
+        return dict(entry[0])
+
+    def get_mesh(self, meshid):
+        '''
+        Look up a device group
+
+        Args:
+            meshid (str): Full id of the mesh ("mesh/domain/id")
+
+        Returns:
+            dict|None: Copy of the mesh data, or None if it isn't cached or is stale
+        '''
+        entry = self._meshes.get(meshid, None)
+        if entry is None or self._stale(entry[1]):
+            return None
+        return dict(entry[0])
+
+    def handle_event(self, event):
+        '''
+        Apply a server event to the cache. Events we don't understand are ignored.
+
+        Args:
+            event (dict): `event` field of a message with action "event"
+        '''
+        etype = event.get("etype", None)
+        action = event.get("action", None)
+        if etype == "node":
+            nodeid = event.get("nodeid", None)
+            if action == "removenode":
+                self._nodes.pop(nodeid, None)
+            elif action in ("addnode", "changenode", "nodemeshchange") and isinstance(event.get("node", None), dict):
+                node = event["node"]
+                nodeid = node.get("_id", nodeid)
+                entry = self._nodes.get(nodeid, None)
+                updated = dict(entry[0]) if entry is not None else {}
+                updated.update(node)
+                if action == "nodemeshchange" and event.get("newMeshId", None):
+                    updated["meshid"] = event["newMeshId"]
+                if "_id" in updated:
+                    self.put_node(updated)
+            elif action == "nodeconnect" and nodeid in self._nodes:
+                node = dict(self._nodes[nodeid][0])
+                for key in ("conn", "pwr"):
+                    if key in event:
+                        node[key] = event[key]
+                self.put_node(node)
+        elif etype == "mesh":
+            meshid = event.get("meshid", None)
+            if meshid is None:
+                return
+            if action == "deletemesh":
+                self._meshes.pop(meshid, None)
+                for nodeid in [nodeid for nodeid, (node, _) in self._nodes.items() if node.get("meshid", None) == meshid]:
+                    del self._nodes[nodeid]
+            elif action in ("createmesh", "meshchange"):
+                entry = self._meshes.get(meshid, None)
+                updated = dict(entry[0]) if entry is not None else {"_id": meshid}
+                updated.update({key: val for key, val in event.items() if key not in self._event_keys})
+                self.put_mesh(updated)
@@ -0,0 +1,282 @@
+'''
+Instrumentation of a session's traffic: request counts and latency, requests in flight, bytes in and out, message parse time and event fan-out.
+
+Pass a collector to :py:class:`~meshctrl.session.Session` with `metrics` to turn this on. :py:class:`InProcessMetrics` keeps everything in memory for you to read with :py:meth:`InProcessMetrics.snapshot`. :py:class:`PrometheusMetrics` and :py:class:`OpenTelemetryMetrics` export to those libraries, if they are installed. With no collector, the session skips measuring altogether.
+'''
+
+import bisect
+import collections
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+try:
+    import opentelemetry.metrics
+except ImportError:
+    opentelemetry = None
+
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class MetricsCollector(object):
+    '''
+    Base class for metrics collectors. Every method does nothing; subclass this and override the ones you care about. The session calls these from its send and receive loops, so they must not block.
+    '''
+
+    def request_started(self, action):
+        '''
+        A command was sent, and we are waiting for its reply
+
+        Args:
+            action (str): Action of the command
+        '''
+
+    def request_finished(self, action, seconds, error=None):
+        '''
+        A command got its reply, or failed
+
+        Args:
+            action (str): Action of the command
+            seconds (float): Time from sending the command until its reply was matched to it
+            error (BaseException|None): Why the command failed, if it did. Timeouts are included here.
+        '''
+
+    def bytes_sent(self, count):
+        '''
+        Messages were written to the server
+
+        Args:
+            count (int): Size of the messages. Text is counted in characters, which is the same as bytes for the ASCII JSON the server uses.
+        '''
+
+    def bytes_received(self, count):
+        '''
+        A message was received from the server
+
+        Args:
+            count (int): Size of the message, counted as in :py:meth:`bytes_sent`
+        '''
+
+    def message_parsed(self, seconds):
+        '''
+        A message from the server was decoded
+
+        Args:
+            seconds (float): Time taken to decode it
+        '''
+
+    def message_fanout(self, action, count):
+        '''
+        A message from the server was handed to :py:func:`~meshctrl.session.Session.events` listeners. Not called for messages no listener wanted.
+
+        Args:
+            action (str|None): Action of the message
+            count (int): Number of listeners it was handed to
+        '''
+
+class _Histogram(object):
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One count per bucket, and one for values over the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q):
+        # Upper bound of the bucket holding the q-th value. Values over the last bound are reported as infinite.
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip(self.buckets + (float("inf"),), self.counts)),
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+        }
+
+class InProcessMetrics(MetricsCollector):
+    '''
+    Collector which keeps its metrics in memory
+
+    Args:
+        buckets (tuple[float]): Upper bounds, in seconds, of the buckets used for latency and parse time histograms
+
+    Attributes:
+        requests (collections.Counter): Commands sent, by action
+        errors (collections.Counter): Commands which failed or timed out, by action
+        in_flight (collections.Counter): Commands awaiting a reply, by action
+        bytes_out (int): Size of all messages sent
+        bytes_in (int): Size of all messages received
+        messages_in (int): Number of messages received
+        deliveries (collections.Counter): Number of times a message was handed to an events() listener, by action of the message
+    '''
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = tuple(buckets)
+        self.requests = collections.Counter()
+        self.errors = collections.Counter()
+        self.in_flight = collections.Counter()
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.messages_in = 0
+        self.deliveries = collections.Counter()
+        self._latency = {}
+        self._parse = _Histogram(self._buckets)
+
+    def request_started(self, action):
+        self.requests[action] += 1
+        self.in_flight[action] += 1
+
+    def request_finished(self, action, seconds, error=None):
+        self.in_flight[action] -= 1
+        if not self.in_flight[action]:
+            del self.in_flight[action]
+        if error is not None:
+            self.errors[action] += 1
+        histogram = self._latency.get(action, None)
+        if histogram is None:
+            histogram = self._latency[action] = _Histogram(self._buckets)
+        histogram.observe(seconds)
+
+    def bytes_sent(self, count):
+        self.bytes_out += count
+
+    def bytes_received(self, count):
+        self.bytes_in += count
+        self.messages_in += 1
+
+    def message_parsed(self, seconds):
+        self._parse.observe(seconds)
+
+    def message_fanout(self, action, count):
+        self.deliveries[action] += count
+
+    def snapshot(self):
+        '''
+        Get a copy of everything collected so far
+
+        Returns:
+            ~meshctrl.types.MetricsSnapshot: Collected metrics
+        '''
+        return {
+            "requests": dict(self.requests),
+            "errors": dict(self.errors),
+            "in_flight": dict(self.in_flight),
+            "latency": {action: histogram.snapshot() for action, histogram in self._latency.items()},
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+            "messages_in": self.messages_in,
+            "parse_time": self._parse.snapshot(),
+            "deliveries": dict(self.deliveries),
+        }
+
+class PrometheusMetrics(MetricsCollector):
+    '''
+    Collector which exports to prometheus_client. Serve the registry however you already do, e.g. with `prometheus_client.start_http_server`.
+
+    Args:
+        registry (prometheus_client.CollectorRegistry|None): Registry to register the metrics with. Defaults to prometheus_client's global registry.
+        namespace (str): Prefix for the metric names
+        buckets (tuple[float]): Upper bounds, in seconds, of the histogram buckets
+
+    Raises:
+        ImportError: prometheus_client is not installed
+    '''
+
+    def __init__(self, registry=None, namespace="meshctrl", buckets=DEFAULT_BUCKETS):
+        if prometheus_client is None:
+            raise ImportError("prometheus_client is not installed")
+        if registry is None:
+            registry = prometheus_client.REGISTRY
+        options = {"namespace": namespace, "registry": registry}
+        self._requests = prometheus_client.Counter("requests", "Commands sent to the server", ["action", "outcome"], **options)
+        self._latency = prometheus_client.Histogram("request_latency_seconds", "Time from sending a command to matching its reply", ["action"], buckets=buckets, **options)
+        self._in_flight = prometheus_client.Gauge("requests_in_flight", "Commands awaiting a reply", ["action"], **options)
+        self._bytes = prometheus_client.Counter("message_bytes", "Size of messages sent and received", ["direction"], **options)
+        self._bytes_out = self._bytes.labels("out")
+        self._bytes_in = self._bytes.labels("in")
+        self._parse = prometheus_client.Histogram("message_parse_seconds", "Time taken to decode a message from the server", buckets=buckets, **options)
+        self._deliveries = prometheus_client.Counter("event_deliveries", "Messages handed to events() listeners", ["action"], **options)
+
+    def request_started(self, action):
+        self._in_flight.labels(action).inc()
+
+    def request_finished(self, action, seconds, error=None):
+        self._in_flight.labels(action).dec()
+        self._requests.labels(action, "ok" if error is None else "error").inc()
+        self._latency.labels(action).observe(seconds)
+
+    def bytes_sent(self, count):
+        self._bytes_out.inc(count)
+
+    def bytes_received(self, count):
+        self._bytes_in.inc(count)
+
+    def message_parsed(self, seconds):
+        self._parse.observe(seconds)
+
+    def message_fanout(self, action, count):
+        self._deliveries.labels(str(action)).inc(count)
+
+class OpenTelemetryMetrics(MetricsCollector):
+    '''
+    Collector which records to an OpenTelemetry meter. Configure a MeterProvider and exporter as usual; this only creates the instruments.
+
+    Args:
+        meter (opentelemetry.metrics.Meter|None): Meter to create the instruments from. Defaults to the "meshctrl" meter of the global MeterProvider.
+
+    Raises:
+        ImportError: opentelemetry-api is not installed
+    '''
+
+    def __init__(self, meter=None):
+        if opentelemetry is None:
+            raise ImportError("opentelemetry-api is not installed")
+        if meter is None:
+            meter = opentelemetry.metrics.get_meter("meshctrl")
+        self._requests = meter.create_counter("meshctrl.requests", unit="{request}", description="Commands sent to the server")
+        self._latency = meter.create_histogram("meshctrl.request.duration", unit="s", description="Time from sending a command to matching its reply")
+        self._in_flight = meter.create_up_down_counter("meshctrl.requests.in_flight", unit="{request}", description="Commands awaiting a reply")
+        self._bytes = meter.create_counter("meshctrl.message.size", unit="By", description="Size of messages sent and received")
+        self._parse = meter.create_histogram("meshctrl.message.parse.duration", unit="s", description="Time taken to decode a message from the server")
+        self._deliveries = meter.create_counter("meshctrl.event.deliveries", unit="{message}", description="Messages handed to events() listeners")
+
+    def request_started(self, action):
+        self._in_flight.add(1, {"action": action})
+
+    def request_finished(self, action, seconds, error=None):
+        attributes = {"action": action}
+        self._in_flight.add(-1, attributes)
+        self._requests.add(1, {"action": action, "outcome": "ok" if error is None else "error"})
+        self._latency.record(seconds, attributes)
+
+    def bytes_sent(self, count):
+        self._bytes.add(count, {"direction": "out"})
+
+    def bytes_received(self, count):
+        self._bytes.add(count, {"direction": "in"})
+
+    def message_parsed(self, seconds):
+        self._parse.record(seconds)
+
+    def message_fanout(self, action, count):
+        self._deliveries.add(count, {"action": str(action)})
@@ -0,0 +1,145 @@
+'''
+Opt-in hooks around the library's busiest code, to find where time goes under load without patching it.
+
+Pass a :py:class:`Profiler` to :py:class:`~meshctrl.session.Session` with `profiler`. The session, and the shells and file explorers opened from it, then wrap their work in spans:
+
+- `session.message`: handling one message from the server, on the primary or a pooled connection. Attributes: `size`.
+- `session.command`: one command, from queueing it until its reply. Attributes: `action`.
+- `files.upload_chunk`: reading one chunk of an upload and queueing it. Attributes: `size`.
+- `files.download_chunk`: writing one chunk of a download to its target. Attributes: `size`.
+- `shell.write`: buffering one piece of shell output. Attributes: `size`.
+
+While a span is open, :py:data:`current_span` holds its name, so a sampling profiler running in the event loop's thread (a signal based sampler, for instance) can tell which of these it interrupted.
+'''
+
+import contextlib
+import contextvars
+import time
+
+try:
+    import opentelemetry.trace
+except ImportError:
+    opentelemetry = None
+
+#: Name of the innermost open span in the current context, or None
+current_span = contextvars.ContextVar("meshctrl_current_span", default=None)
+
+_no_span = contextlib.nullcontext()
+
+def _span(profiler, name, attributes=None):
+    # For call sites which aren't hot enough to need their own `profiler is None` check
+    if profiler is None:
+        return _no_span
+    return profiler.span(name, attributes)
+
+class Profiler(object):
+    '''
+    Base class for profiling hooks. On its own it only keeps :py:data:`current_span` up to date. Override :py:meth:`span_started` and :py:meth:`span_finished` to record spans, or :py:meth:`span` to hand them to something else entirely.
+    Hooks are called inline from the library's send and receive loops, so they must be quick and must not block.
+    '''
+
+    def span(self, name, attributes=None):
+        '''
+        Get a context manager spanning a piece of work
+
+        Args:
+            name (str): Name of the span, such as "session.message"
+            attributes (dict|None): Details of this piece of work
+
+        Returns:
+            Context manager
+        '''
+        return _Span(self, name, attributes)
+
+    def span_started(self, name, attributes):
+        '''
+        Called as a span opens
+
+        Args:
+            name (str): Name of the span
+            attributes (dict|None): Details of the work
+        '''
+
+    def span_finished(self, name, attributes, seconds, error):
+        '''
+        Called as a span closes
+
+        Args:
+            name (str): Name of the span
+            attributes (dict|None): Details of the work
+            seconds (float): Wall time the span was open for. For spans around awaits, this includes time spent on other tasks.
+            error (BaseException|None): Exception which ended the span, if any
+        '''
+
+class _Span(object):
+    __slots__ = ("_profiler", "_name", "_attributes", "_token", "_start")
+
+    def __init__(self, profiler, name, attributes):
+        self._profiler = profiler
+        self._name = name
+        self._attributes = attributes
+
+    def __enter__(self):
+        self._token = current_span.set(self._name)
+        self._profiler.span_started(self._name, self._attributes)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_t, exc_v, exc_tb):
+        seconds = time.perf_counter() - self._start
+        current_span.reset(self._token)
+        self._profiler.span_finished(self._name, self._attributes, seconds, exc_v)
+
+class SpanTimer(Profiler):
+    '''
+    Profiler which totals up the time spent in each kind of span
+
+    Attributes:
+        spans (dict[str, dict]): For each span name, "count", "total" and "max" seconds, and "errors"
+    '''
+
+    def __init__(self):
+        self.spans = {}
+
+    def span_finished(self, name, attributes, seconds, error):
+        stats = self.spans.get(name, None)
+        if stats is None:
+            stats = self.spans[name] = {"count": 0, "total": 0.0, "max": 0.0, "errors": 0}
+        stats["count"] += 1
+        stats["total"] += seconds
+        if seconds > stats["max"]:
+            stats["max"] = seconds
+        if error is not None:
+            stats["errors"] += 1
+
+    def report(self):
+        '''
+        Get a summary of the spans recorded so far, slowest total first
+
+        Returns:
+            str: One line per span name
+        '''
+        lines = []
+        for name, stats in sorted(self.spans.items(), key=lambda item: item[1]["total"], reverse=True):
+            mean = stats["total"] / stats["count"]
+            lines.append(f"{name}: {stats['count']} spans, {stats['total']:.3f}s total, {mean*1000:.3f}ms mean, {stats['max']*1000:.3f}ms max, {stats['errors']} errors")
+        return "\n".join(lines)
+
+class OpenTelemetryProfiler(Profiler):
+    '''
+    Profiler which turns spans into OpenTelemetry spans
+
+    Args:
+        tracer (opentelemetry.trace.Tracer|None): Tracer to start spans with. Defaults to the "meshctrl" tracer of the global TracerProvider.
+
+    Raises:
+        ImportError: opentelemetry-api is not installed
+    '''
+
+    def __init__(self, tracer=None):
+        if opentelemetry is None:
+            raise ImportError("opentelemetry-api is not installed")
+        self._tracer = tracer if tracer is not None else opentelemetry.trace.get_tracer("meshctrl")
+
+    def span(self, name, attributes=None):
+        return self._tracer.start_as_current_span(name, attributes=attributes)
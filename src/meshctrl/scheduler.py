@@ -0,0 +1,198 @@
+'''
+Flow control for commands sent over a session, so a burst of requests doesn't flood the server.
+'''
+
+import asyncio
+import collections
+import time
+
+def _percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return {
+        "p50": ordered[round(last * 0.5)],
+        "p90": ordered[round(last * 0.9)],
+        "p99": ordered[round(last * 0.99)],
+        "max": ordered[last],
+    }
+
+class CommandScheduler(object):
+    '''
+    Limits how many commands may be awaiting a reply at once, across the session and per action. Commands over the limit wait their turn. Waiting commands are let through round robin by action, so a flood of one kind of command doesn't hold up every other kind.
+    Every :py:class:`~meshctrl.session.Session` has one as :py:attr:`~meshctrl.session.Session.scheduler`. With no limits set, commands are never held back, and the scheduler only keeps metrics.
+
+    Args:
+        max_in_flight (int|None): Most commands awaiting a reply at once. None means no limit.
+        action_limits (dict[str, int]|None): Most commands of each action awaiting a reply at once, for example `{"getsysinfo": 50}`. Actions not listed are only bound by `max_in_flight`.
+        history (int): Number of recent commands kept for the latency percentiles
+
+    Attributes:
+        max_in_flight (int|None): Most commands awaiting a reply at once
+        action_limits (dict[str, int]): Most commands of each action awaiting a reply at once
+        completed (int): Number of commands which have finished, whether they succeeded or not
+    '''
+
+    def __init__(self, max_in_flight=None, action_limits=None, history=1024):
+        if max_in_flight is not None and max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        self.max_in_flight = max_in_flight
+        self.action_limits = dict(action_limits or {})
+        for action, limit in self.action_limits.items():
+            if limit < 1:
+                raise ValueError(f"Limit for {action} must be at least 1")
+        self.completed = 0
+        self._in_flight = 0
+        self._in_flight_by_action = collections.Counter()
+        # Insertion order is the round robin order. An action moves to the back each time one of its commands is let through.
+        self._waiting = collections.OrderedDict()
+        self._queued = 0
+        self._waits = collections.deque(maxlen=history)
+        self._latencies = collections.deque(maxlen=history)
+
+    @property
+    def in_flight(self):
+        '''
+        Number of commands currently awaiting a reply
+        '''
+        return self._in_flight
+
+    @property
+    def queued(self):
+        '''
+        Number of commands waiting for their turn to be sent
+        '''
+        return self._queued
+
+    def _global_full(self):
+        return self.max_in_flight is not None and self._in_flight >= self.max_in_flight
+
+    def _can_start(self, action):
+        if self._global_full():
+            return False
+        limit = self.action_limits.get(action, None)
+        return limit is None or self._in_flight_by_action[action] < limit
+
+    def _start(self, action):
+        self._in_flight += 1
+        self._in_flight_by_action[action] += 1
+
+    def _release(self, action):
+        self._in_flight -= 1
+        self._in_flight_by_action[action] -= 1
+        if not self._in_flight_by_action[action]:
+            del self._in_flight_by_action[action]
+        if self._waiting:
+            self._wake()
+
+    def _wake(self):
+        progressed = True
+        while progressed and self._waiting and not self._global_full():
+            progressed = False
+            for action in list(self._waiting):
+                if self._global_full():
+                    return
+                if not self._can_start(action):
+                    continue
+                waiters = self._waiting[action]
+                waiter = waiters.popleft()
+                self._queued -= 1
+                if waiters:
+                    self._waiting.move_to_end(action)
+                else:
+                    del self._waiting[action]
+                progressed = True
+                if waiter.done():
+                    # Its command timed out or was cancelled while waiting
+                    continue
+                self._start(action)
+                waiter.set_result(None)
+
+    async def acquire(self, action):
+        '''
+        Wait until a command with the given action may be sent, and count it as in flight. Every call must be paired with a call to :py:meth:`release`. Prefer :py:meth:`slot`, which does both.
+
+        Args:
+            action (str): Action of the command
+        '''
+        # Commands already waiting on this action go first
+        if action not in self._waiting and self._can_start(action):
+            self._start(action)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(action, collections.deque()).append(waiter)
+        self._queued += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # We were let through, but were cancelled before we could use it
+                self._release(action)
+            else:
+                waiters = self._waiting.get(action, None)
+                if waiters is not None and waiter in waiters:
+                    waiters.remove(waiter)
+                    self._queued -= 1
+                    if not waiters:
+                        del self._waiting[action]
+            raise
+
+    def release(self, action):
+        '''
+        Mark a command acquired with :py:meth:`acquire` as finished, letting the next waiting command through
+
+        Args:
+            action (str): Action of the command
+        '''
+        self.completed += 1
+        self._release(action)
+
+    def slot(self, action):
+        '''
+        Async context manager which holds a place in flight for one command, and records how long it waited and how long it took
+
+        Args:
+            action (str): Action of the command
+
+        Returns:
+            Async context manager
+        '''
+        return _Slot(self, action)
+
+    def stats(self):
+        '''
+        Get the scheduler's current state, and percentiles of recent wait and reply times
+
+        Returns:
+            ~meshctrl.types.SchedulerStats: Scheduler metrics
+        '''
+        return {
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "queued_by_action": {action: len(waiters) for action, waiters in self._waiting.items()},
+            "in_flight_by_action": dict(self._in_flight_by_action),
+            "max_in_flight": self.max_in_flight,
+            "completed": self.completed,
+            "wait": _percentiles(self._waits),
+            "latency": _percentiles(self._latencies),
+        }
+
+class _Slot(object):
+    __slots__ = ("_scheduler", "_action", "_started")
+
+    def __init__(self, scheduler, action):
+        self._scheduler = scheduler
+        self._action = action
+        self._started = None
+
+    async def __aenter__(self):
+        queued_at = time.perf_counter()
+        await self._scheduler.acquire(self._action)
+        self._started = time.perf_counter()
+        self._scheduler._waits.append(self._started - queued_at)
+        return self
+
+    async def __aexit__(self, exc_t, exc_v, exc_tb):
+        self._scheduler._latencies.append(time.perf_counter() - self._started)
+        self._scheduler.release(self._action)
@@ -4,22 +4,29 @@ import websockets.asyncio
 import websockets.asyncio.client
 import asyncio
 import base64
-import json
+import collections
 import datetime
 import io
+import os
 import ssl
+import time
 import urllib
 from python_socks.async_.asyncio import Proxy
 from platform import python_version
 from . import __version__
+from . import codec
 from . import constants
 from . import exceptions
 from . import util
 from . import shell
 from . import files
+from . import httpclient
 from . import mesh
 from . import device
 from . import user_group
+from . import inventory
+from . import scheduler
+from . import profiling
 
 class Session(object):
 
@@ -36,6 +43,17 @@ class Session(object):
         token (str): Login token. This appears to be superfluous
         ignore_ssl (bool): Ignore SSL errors
         auto_reconnect (bool): In case of server failure, attempt to auto reconnect. All outstanding requests will be killed.
+        compact_models (bool): Build :py:class:`~meshctrl.device.CompactDevice`, :py:class:`~meshctrl.mesh.CompactMesh` and :py:class:`~meshctrl.user_group.CompactUserGroup` instead of the regular models. Use this if you hold on to large inventories.
+        json_codec (str|~meshctrl.codec.JSONCodec|None): Codec used to encode and decode messages, or the name of one ("orjson", "msgspec", "json"). Defaults to the fastest one installed. Tunnels created from this session use the same codec.
+        inventory_cache (bool|~meshctrl.inventory.InventoryCache): Keep a cache of devices and device groups, kept current from server events, and use it to look up devices instead of fetching every device from the server. Pass True for a cache with no expiry or size limit, or an :py:class:`~meshctrl.inventory.InventoryCache` to configure it.
+        send_batch_size (int): Most queued messages to send back to back before letting other tasks run, and queue anything more urgent. Each message is still written to the socket on its own. Set to 1 to yield after every message.
+        max_in_flight (int|None): Most commands awaiting a reply from the server at once. Further commands wait their turn, and their timeout includes that wait. None means no limit.
+        action_limits (dict[str, int]|None): Most commands of each action awaiting a reply at once, for example `{"getsysinfo": 50}`. See :py:class:`~meshctrl.scheduler.CommandScheduler`.
+        starvation_limit (int): Messages are sent by :py:class:`~meshctrl.constants.Priority`, so interactive calls like :py:func:`ping` aren't stuck behind bulk fetches. This is the most messages sent from higher priorities while a lower one waits, before the lower one gets a turn.
+        metrics (~meshctrl.metrics.MetricsCollector|None): Collector to report request counts and latency, bytes in and out, parse time and event fan-out to, such as :py:class:`~meshctrl.metrics.InProcessMetrics`. None measures nothing.
+        profiler (~meshctrl.profiling.Profiler|None): Hooks to wrap message handling, commands, and shell and file transfer work in spans, such as :py:class:`~meshctrl.profiling.SpanTimer`. See :py:mod:`meshctrl.profiling`. None adds no overhead.
+        connections (int): Number of control websockets to open to the server. With more than one, commands which get a tagged reply are spread across them, so a large reply on one doesn't hold up the rest. Events and commands answered only by action still go over the first connection, and events from the others are ignored, so each is seen once. The extra connections use the same credentials. If one can't connect, the others carry on without it.
+        http_connections (int): Most HTTP connections open to the server at once, for file downloads which don't go through the websocket. Idle ones are kept alive and reused.
 
     Returns:
         :py:class:`Session`: Session connected to url
@@ -45,9 +63,13 @@ class Session(object):
         initialized (asyncio.Event): Event marking if the Session initialization has finished. Wait on this to wait for a connection.
         alive (bool): Whether the session connection is currently alive
         closed (asyncio.Event): Event that occurs when the session closes permanently
+        inventory (~meshctrl.inventory.InventoryCache|None): The inventory cache, if enabled
+        metrics (~meshctrl.metrics.MetricsCollector|None): The metrics collector, if any
+        profiler (~meshctrl.profiling.Profiler|None): The profiling hooks, if any
+        scheduler (~meshctrl.scheduler.CommandScheduler): Flow control for commands sent by this session. Use :py:meth:`~meshctrl.scheduler.CommandScheduler.stats` to see queue depth and latency.
     '''
 
-    def __init__(self, url, user=None, domain=None, password=None, loginkey=None, proxy=None, token=None, ignore_ssl=False, auto_reconnect=False, user_agent_header=None):
+    def __init__(self, url, user=None, domain=None, password=None, loginkey=None, proxy=None, token=None, ignore_ssl=False, auto_reconnect=False, user_agent_header=None, compact_models=False, json_codec=None, inventory_cache=False, send_batch_size=64, max_in_flight=None, action_limits=None, starvation_limit=8, connections=1, metrics=None, profiler=None, http_connections=16):
         default_user_agent_header = f"Python/{python_version()} websockets/{websockets.__version__} pylibmeshctrl/{__version__}" 
         parsed = urllib.parse.urlparse(url)
 
@@ -105,7 +127,12 @@ class Session(object):
         self._token = token
         self._loginkey = loginkey
         self._socket_open = asyncio.Event()
-        self._inflight = set()
+        # Outstanding requests, keyed by responseid for _send_command and by action for _send_command_no_response_id
+        self._pending = {}
+        self._pending_actions = {}
+        # run_command jobs waiting for output, keyed by node id for console output and by responseid for runcommands results
+        self._console_jobs = {}
+        self._command_jobs = {}
         self._file_tunnels = {}
         self._ignore_ssl = ignore_ssl
         self.auto_reconnect = auto_reconnect
@@ -115,6 +142,21 @@ class Session(object):
             self.user_agent_header = default_user_agent_header
 
         self._eventer = util.Eventer()
+        self._subscribers = util._SubscriberIndex()
+        self._subscriber_queues = {}
+        self._codec = codec.get_codec(json_codec)
+        self._device_cls = device.CompactDevice if compact_models else device.Device
+        self._mesh_cls = mesh.CompactMesh if compact_models else mesh.Mesh
+        self._user_group_cls = user_group.CompactUserGroup if compact_models else user_group.UserGroup
+        if inventory_cache is True:
+            inventory_cache = inventory.InventoryCache()
+        elif inventory_cache is False:
+            inventory_cache = None
+        self.inventory = inventory_cache
+        self._inventory_lock = asyncio.Lock()
+        self.scheduler = scheduler.CommandScheduler(max_in_flight=max_in_flight, action_limits=action_limits)
+        self.metrics = metrics
+        self.profiler = profiler
 
         self.initialized = asyncio.Event()
         self._initialization_err = None
@@ -128,7 +170,14 @@ class Session(object):
         self.alive = False
         self.closed = asyncio.Event()
 
-        self._message_queue = asyncio.Queue()
+        self._message_queue = util.PriorityLanes(starvation_limit)
+        if connections < 1:
+            raise ValueError("connections must be at least 1")
+        self._primary = _ControlConnection(self._message_queue)
+        self._pool = [_ControlConnection(util.PriorityLanes(starvation_limit)) for i in range(connections - 1)]
+        if send_batch_size < 1:
+            raise ValueError("send_batch_size must be at least 1")
+        self._send_batch_size = send_batch_size
         self._send_task = None
         self._listen_task = None
         self._ssl_context = None
@@ -136,32 +185,44 @@ class Session(object):
             self._ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
             self._ssl_context.check_hostname = False
             self._ssl_context.verify_mode = ssl.CERT_NONE
+        self._http = httpclient.HTTPPool(ssl_context=self._ssl_context, proxy=self._proxy, user_agent=self.user_agent_header, max_connections=http_connections, profiler=self.profiler)
 
-    async def _main_loop(self):
-        try:
-            options = {}
-            if self._ssl_context is not None:
-                options["ssl"] = self._ssl_context
+    def _connect(self):
+        options = {}
+        if self._ssl_context is not None:
+            options["ssl"] = self._ssl_context
+
+        headers = websockets.datastructures.Headers()
 
-            headers = websockets.datastructures.Headers()
+        if (self._password):
+            token = self._token if self._token else b""
+            headers['x-meshauth'] = (base64.b64encode(self._user.encode()) + b',' + base64.b64encode(self._password.encode()) + token).decode()
 
-            if (self._password):
-                token = self._token if self._token else b""
-                headers['x-meshauth'] = (base64.b64encode(self._user.encode()) + b',' + base64.b64encode(self._password.encode()) + token).decode()
 
+        options["additional_headers"] = headers
+        return websockets.asyncio.client.connect(self.url, proxy=self._proxy, process_exception=util._process_websocket_exception, max_size=None, user_agent_header=self.user_agent_header, **options)
 
-            options["additional_headers"] = headers
-            async for websocket in websockets.asyncio.client.connect(self.url, proxy=self._proxy, process_exception=util._process_websocket_exception, max_size=None, user_agent_header=self.user_agent_header, **options):
+    async def _main_loop(self):
+        try:
+            async for websocket in self._connect():
                 self.alive = True
+                if self.inventory is not None:
+                    # We may have missed events while disconnected
+                    self.inventory.clear()
                 self._socket_open.set()
+                self._primary.open = True
                 try:
                     async with asyncio.TaskGroup() as tg:
                         tg.create_task(self._listen_data_task(websocket))
                         tg.create_task(self._send_data_task(websocket))
+                        for connection in self._pool:
+                            tg.create_task(self._pool_connection_task(connection))
                 except* websockets.ConnectionClosed as e:
                     self._socket_open.clear()
                     if not self.auto_reconnect:
                         raise
+                finally:
+                    self._primary.open = False
 
         except* Exception as eg:
             self.alive = False
@@ -176,48 +237,200 @@ class Session(object):
         await s.initialized.wait()
         return s
 
-    async def _send_data_task(self, websocket):
+    async def _pool_connection_task(self, connection):
+        # Runs for as long as the primary connection is up, which cancels us when it goes down
+        try:
+            async for websocket in self._connect():
+                connection.open = True
+                try:
+                    async with asyncio.TaskGroup() as tg:
+                        sender = tg.create_task(self._send_data_task(websocket, connection.queue))
+                        # A clean close from the server just ends the listener, so stop sending there too
+                        await self._listen_pool_task(websocket)
+                        sender.cancel()
+                except* websockets.ConnectionClosed:
+                    pass
+                finally:
+                    connection.open = False
+                    connection.fail_in_flight(self._pending)
+        except* Exception as eg:
+            # Not worth taking the session down for. The rest of the pool carries on.
+            connection.error = eg
+        finally:
+            connection.open = False
+            connection.fail_in_flight(self._pending)
+
+    async def _listen_pool_task(self, websocket):
+        # Extra connections only carry tagged replies for us. Everything else the server sends them, the primary connection gets too.
+        listening = self._eventer.listening
+        subscribers = self._subscribers
+        pending = self._pending
+        metrics = self.metrics
+        loads = self._codec.loads if metrics is None else self._measured_loads(metrics)
+        profiler = self.profiler
+        async for message in websocket:
+            with profiling._no_span if profiler is None else profiler.span("session.message", {"size": len(message)}):
+                try:
+                    data = loads(message)
+                except ValueError:
+                    continue
+                action = data.get("action", None)
+                if action == "close":
+                    if data.get("cause", None) == "noauth":
+                        raise exceptions.ServerError("Invalid Auth")
+                    continue
+                id = data.get("responseid", None)
+                if id is None:
+                    id = data.get("tag", None)
+                if not id:
+                    continue
+                if listening and "raw" in listening:
+                    await self._eventer.emit("raw", message)
+                if listening and "server_event" in listening:
+                    await self._eventer.emit("server_event", data)
+                if subscribers._count:
+                    delivered = subscribers.delivered
+                    waiters = subscribers.dispatch(data)
+                    if metrics is not None and subscribers.delivered != delivered:
+                        metrics.message_fanout(action, subscribers.delivered - delivered)
+                    for waiter in waiters:
+                        await waiter
+                response = pending.pop(id, None)
+                if response is not None and not response.done():
+                    response.set_result(data)
+
+    def _pick_connection(self):
+        # Least loaded open connection. The primary is always a candidate, so there's somewhere to send if the rest of the pool is down.
+        best = self._primary
+        for connection in self._pool:
+            if connection.open and len(connection.in_flight) < len(best.in_flight):
+                best = connection
+        return best
+
+    async def _send_data_task(self, websocket, queue=None):
+        if queue is None:
+            queue = self._message_queue
         while True:
-            message = await self._message_queue.get()
-            await websocket.send(message)
+            message = await queue.get()
+            batch = [message]
+            while len(batch) < self._send_batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            if self.metrics is not None:
+                self.metrics.bytes_sent(sum(map(len, batch)))
+            for message in batch:
+                await websocket.send(message)
+            if not queue.empty():
+                # Neither get() nor an uncongested send() yields, so without this a backlog would be sent in one go, before anything more urgent could be queued
+                await asyncio.sleep(0)
 
     async def _listen_data_task(self, websocket):
+        # Looked up once, since this runs for every message. `listening` is updated in place as listeners come and go.
+        listening = self._eventer.listening
+        subscribers = self._subscribers
+        pending = self._pending
+        pending_actions = self._pending_actions
+        metrics = self.metrics
+        loads = self._codec.loads if metrics is None else self._measured_loads(metrics)
+        profiler = self.profiler
         async for message in websocket:
-            await self._eventer.emit("raw", message)
-            # Meshcentral does pong wrong and breaks our parsing, so fix it here. This is fixed now, but we want compatibility with old versions.
-            if message == '{action:"pong"}':
-                message = '{"action":"pong"}'
-
-            # Can't process non-json data, don't even try
+            with profiling._no_span if profiler is None else profiler.span("session.message", {"size": len(message)}):
+                if listening and "raw" in listening:
+                    await self._eventer.emit("raw", message)
+                # Meshcentral does pong wrong and breaks our parsing, so fix it here. This is fixed now, but we want compatibility with old versions.
+                if message == '{action:"pong"}':
+                    message = '{"action":"pong"}'
+
+                # Can't process non-json data, don't even try
+                try:
+                    data = loads(message)
+                except ValueError:
+                    continue
+                action = data.get("action", None)
+                if listening and "server_event" in listening:
+                    await self._eventer.emit("server_event", data)
+                if subscribers._count:
+                    delivered = subscribers.delivered
+                    waiters = subscribers.dispatch(data)
+                    if metrics is not None and subscribers.delivered != delivered:
+                        metrics.message_fanout(action, subscribers.delivered - delivered)
+                    for waiter in waiters:
+                        await waiter
+                if action == "msg":
+                    if self._console_jobs or self._command_jobs:
+                        self._route_command_output(data)
+                elif action == "event":
+                    if self.inventory is not None:
+                        self.inventory.handle_event(data.get("event", {}))
+                elif action == "close":
+                    if data.get("cause", None) == "noauth":
+                        raise exceptions.ServerError("Invalid Auth")
+                elif action == "userinfo":
+                    self._user_info = data["userinfo"]
+                    self.initialized.set()
+                elif action == "serverinfo":
+                    self._currentDomain = data["serverinfo"]["domain"]
+                    self._server_info = data["serverinfo"]
+                id = data.get("responseid", None)
+                if id is None:
+                    id = data.get("tag", None)
+                if id:
+                    response = pending.pop(id, None)
+                    if response is not None and not response.done():
+                        response.set_result(data)
+                elif pending_actions:
+                    # Some events don't user their response id, they just have the action. This should be fixed eventually.
+                    # Broken commands include:
+                    #      meshes
+                    #      nodes
+                    #      getnetworkinfo
+                    #      lastconnect
+                    #      getsysinfo
+                    # console.log(`emitting ${data.action}`)
+                    for response in pending_actions.pop(action, ()):
+                        if not response.done():
+                            response.set_result(data)
+                    if "nodeid" in data and pending_actions:
+                        for response in pending_actions.pop((action, data["nodeid"]), ()):
+                            if not response.done():
+                                response.set_result(data)
+
+    def _measured_loads(self, metrics):
+        # Stands in for the codec's loads when metrics are on, so the receive loop pays nothing for them when they're off
+        loads = self._codec.loads
+        perf_counter = time.perf_counter
+        def measured(message):
+            metrics.bytes_received(len(message))
+            start = perf_counter()
             try:
-                data = json.loads(message)
-            except SyntaxError:
-                continue
-            action = data.get("action", None)
-            await self._eventer.emit("server_event", data)
-            if action == "close":
-                if data.get("cause", None) == "noauth":
-                    raise exceptions.ServerError("Invalid Auth")
-            if action == "userinfo":
-                self._user_info = data["userinfo"]
-                self.initialized.set()
-
-            if action == "serverinfo":
-                self._currentDomain = data["serverinfo"]["domain"]
-                self._server_info = data["serverinfo"]
-            id = data.get("responseid", data.get("tag", None))
-            if id:
-                await self._eventer.emit(id, data)
-            else:
-                # Some events don't user their response id, they just have the action. This should be fixed eventually.
-                # Broken commands include:
-                #      meshes
-                #      nodes
-                #      getnetworkinfo
-                #      lastconnect
-                #      getsysinfo
-                # console.log(`emitting ${data.action}`)
-                await self._eventer.emit(action, data)
+                return loads(message)
+            finally:
+                metrics.message_parsed(perf_counter() - start)
+        return measured
+
+    async def _request(self, queue, data, priority, response):
+        if self.profiler is None:
+            return await self._measured_request(queue, data, priority, response)
+        with self.profiler.span("session.command", {"action": data["action"]}):
+            return await self._measured_request(queue, data, priority, response)
+
+    async def _measured_request(self, queue, data, priority, response):
+        # Queue a command and wait for its reply, reporting to the metrics collector if there is one
+        metrics = self.metrics
+        if metrics is None:
+            await queue.put(self._codec.dumps(data), priority)
+            return await response
+        action = data["action"]
+        metrics.request_started(action)
+        start = time.perf_counter()
+        error = None
+        try:
+            await queue.put(self._codec.dumps(data), priority)
+            return await response
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            metrics.request_finished(action, time.perf_counter() - start, error)
 
     def _get_command_id(self):
         self._command_id = (self._command_id+1)%(2**32-1)
@@ -226,6 +439,7 @@ class Session(object):
     async def close(self):
         try:
             await asyncio.gather(*[tunnel.close() for name, tunnel in self._file_tunnels.items()])
+            await self._http.close()
         finally:
             self._main_loop_task.cancel()
             try:
@@ -241,41 +455,55 @@ class Session(object):
         await self.close()
 
     @util._check_socket
-    async def _send_command(self, data, name, timeout=None):
+    async def _send_command(self, data, name, job=None, timeout=None, priority=constants.Priority.normal):
         id = f"meshctrl_{name}_{self._get_command_id()}"
         # This fixes a very theoretical bug with hash colisions in the case of an infinite int of requests. Now the bug will only happen if there are currently 2**32-1 of the same type of request going out at the same time
-        while id in self._inflight:
+        while id in self._pending:
             id = f"meshctrl_{name}_{self._get_command_id()}"
 
-        self._inflight.add(id)
-        responded = asyncio.Event()
-        response = None
-        async def _(data):
-            self._inflight.remove(id)
-            nonlocal response
-            response = data
-            responded.set()
-        self._eventer.once(id, _)
-        await self._message_queue.put(json.dumps(data | {"tag": id, "responseid": id}))
-        await asyncio.wait_for(responded.wait(), timeout=timeout)
-        if isinstance(response, Exception):
-            raise response
-        return response
+        response = self._pending[id] = asyncio.get_running_loop().create_future()
+        try:
+            # Tag the request in place rather than merging into a copy; callers always build a fresh dict for each command.
+            data["tag"] = data["responseid"] = id
+            if job is not None:
+                # Every later message with this response id is routed to the job, not only the first
+                job.responseid = id
+                self._command_jobs[id] = job
+            async with asyncio.timeout(timeout):
+                async with self.scheduler.slot(data["action"]):
+                    if not self._pool or job is not None:
+                        # Job output isn't all tagged, so it has to come back over the primary connection
+                        return await self._request(self._message_queue, data, priority, response)
+                    connection = self._pick_connection()
+                    connection.in_flight.add(id)
+                    try:
+                        return await self._request(connection.queue, data, priority, response)
+                    finally:
+                        connection.in_flight.discard(id)
+        finally:
+            self._pending.pop(id, None)
 
     @util._check_socket
-    async def _send_command_no_response_id(self, data, action_override=None, timeout=None):
-        responded = asyncio.Event()
-        response = None
-        async def _(data):
-            nonlocal response
-            response = data
-            responded.set()
-        self._eventer.once(action_override if action_override is not None else data["action"], _)
-        await self._message_queue.put(json.dumps(data))
-        await asyncio.wait_for(responded.wait(), timeout=timeout)
-        if isinstance(response, Exception):
-            raise response
-        return response
+    async def _send_command_no_response_id(self, data, action_override=None, by_nodeid=False, timeout=None, priority=constants.Priority.normal):
+        action = action_override if action_override is not None else data["action"]
+        response = asyncio.get_running_loop().create_future()
+        # Every caller waiting on the same action gets the next message with that action, same as it always has.
+        # Replies which echo the nodeid can be told apart, so those callers only get the reply for their own node.
+        key = (action, data["nodeid"]) if by_nodeid else action
+        async with asyncio.timeout(timeout):
+            async with self.scheduler.slot(action):
+                # Only start listening once we're let through, so a reply to someone else's command can't answer one we haven't sent yet
+                waiting = self._pending_actions.setdefault(key, [])
+                waiting.append(response)
+                try:
+                    return await self._request(self._message_queue, data, priority, response)
+                finally:
+                    try:
+                        waiting.remove(response)
+                    except ValueError:
+                        pass
+                    if not waiting and self._pending_actions.get(key) is waiting:
+                        del self._pending_actions[key]
 
     @util._check_socket
     async def server_info(self):
@@ -312,7 +540,7 @@ class Session(object):
             :py:class:`~meshctrl.exceptions.SocketError`: Info about socket closure
             asyncio.TimeoutError: Command timed out
         '''
-        data = await self._send_command_no_response_id({"action": "ping"}, action_override="pong", timeout=timeout)
+        data = await self._send_command_no_response_id({"action": "ping"}, action_override="pong", timeout=timeout, priority=constants.Priority.interactive)
         return data
 
     async def list_device_groups(self, timeout=None):
@@ -331,7 +559,7 @@ class Session(object):
             asyncio.TimeoutError: Command timed out
         '''
         data = await self._send_command({"action": "meshes"}, "list_device_groups", timeout=timeout)
-        return [mesh.Mesh(m["_id"], self, **m) for m in data["meshes"]]
+        return [self._mesh_cls(m["_id"], self, **m) for m in data["meshes"]]
 
 
     async def send_invite_email(self, group, email, name=None, message=None, meshid=None, timeout=None):
@@ -450,7 +678,73 @@ class Session(object):
         return (await self._send_command({"action": "wssessioncount"}, "list_user_sessions", timeout=timeout))["wssessions"]
 
     
-    async def list_devices(self, details=False, group=None, meshid=None, timeout=None):
+    def _shared_mesh(self, meshes, meshid):
+        # Devices in the same group share one Mesh object instead of building one each
+        _mesh = meshes.get(meshid, None)
+        if _mesh is None:
+            _mesh = meshes[meshid] = self._mesh_cls(meshid, self)
+        return _mesh
+
+    def _device_from_details(self, node, meshes):
+        _node = node["node"]
+        if _node.get("meshid", None):
+            _node["mesh"] = self._shared_mesh(meshes, _node["meshid"])
+        details = {}
+        for key, val in node.items():
+            if key == "node":
+                continue
+            if key == "lastConnect" and isinstance(val, dict):
+                _node["lastconnect"] = val.get("time")
+                _node["lastaddr"] = val.get("addr")
+                continue
+            details[key] = val
+        _node["details"] = details
+        return self._device_cls(_node["_id"], self, **_node)
+
+    def _device_from_node(self, node):
+        return self._device_cls(node["_id"], self, **node)
+
+    def _full_nodeid(self, nodeid):
+        if nodeid.startswith("node/"):
+            return nodeid
+        return f"node/{self._currentDomain or ''}/{nodeid}"
+
+    async def _seed_inventory(self, timeout=None):
+        async with self._inventory_lock:
+            if not self.inventory.needs_seed:
+                return
+            async with asyncio.TaskGroup() as tg:
+                meshes = tg.create_task(self._send_command({"action": "meshes"}, "inventory", timeout=timeout, priority=constants.Priority.bulk))
+                nodes = tg.create_task(self._send_command({"action": "nodes"}, "inventory", timeout=timeout, priority=constants.Priority.bulk))
+            self.inventory.seed(meshes.result().get("meshes", []), nodes.result().get("nodes", {}))
+
+    async def _inventory_node(self, nodeid, timeout=None):
+        if self.inventory.needs_seed:
+            await self._seed_inventory(timeout=timeout)
+        return self.inventory.get_node(self._full_nodeid(nodeid))
+
+    def _mesh_from_raw(self, meshid, raw):
+        if raw is None:
+            return self._mesh_cls(meshid, self)
+        return self._mesh_cls(meshid, self, **raw)
+
+    def _device_from_inventory(self, node):
+        meshid = node.get("meshid", None)
+        if meshid:
+            node["mesh"] = self._mesh_from_raw(meshid, self.inventory.get_mesh(meshid))
+        return self._device_cls(node["_id"], self, **node)
+
+    async def _resolve_device(self, node, timeout=None):
+        # Devices passed by id only need what the inventory has, so don't bother with the extra requests in device_info
+        if isinstance(node, device.Device):
+            return node
+        if self.inventory is not None:
+            _node = await self._inventory_node(node, timeout=timeout)
+            if _node is not None:
+                return self._device_from_inventory(_node)
+        return await self.device_info(node, timeout=timeout)
+
+    async def list_devices(self, details=False, group=None, meshid=None, lazy=False, timeout=None):
         '''
         Get devices to which the user has access.
         Different options will fill different properties in the resultant device objects, based on what is returned from meshcentral. Documenting these changes is beyond the scope of this documentation.
@@ -459,10 +753,11 @@ class Session(object):
             details (bool): Get device details, overrides group and meshid
             group (str): Get devices from specific group by name. Overrides meshid
             meshid (str): Get devices from specific group by id
+            lazy (bool): Return a :py:class:`~meshctrl.device.DeviceList`, which keeps the data from the server and only builds each :py:class:`~meshctrl.device.Device` when it is accessed. Much cheaper for large servers if you don't look at every device.
             timeout (int): duration in seconds to wait for a response before throwing an error
 
         Returns:
-            list[~meshctrl.device.Device]: List of nodes
+            list[~meshctrl.device.Device]|~meshctrl.device.DeviceList: List of nodes
 
         Raises:
             :py:class:`~meshctrl.exceptions.ServerError`: Error text from server if there is a failure
@@ -472,109 +767,219 @@ class Session(object):
         tasks = []
         async with asyncio.TaskGroup() as tg:
             if details:
-                tasks.append(tg.create_task(self._send_command_no_response_id({"action": "getDeviceDetails", "type":"json"}, timeout=timeout)))
+                tasks.append(tg.create_task(self._send_command_no_response_id({"action": "getDeviceDetails", "type":"json"}, timeout=timeout, priority=constants.Priority.bulk)))
             elif group:
-                tasks.append(tg.create_task(self._send_command({ "action": 'nodes', "meshname": group}, "list_devices", timeout=timeout)))
+                tasks.append(tg.create_task(self._send_command({ "action": 'nodes', "meshname": group}, "list_devices", timeout=timeout, priority=constants.Priority.bulk)))
             elif meshid:
-                tasks.append(tg.create_task(self._send_command({ "action": 'nodes', "meshid": meshid}, "list_devices", timeout=timeout)))
+                tasks.append(tg.create_task(self._send_command({ "action": 'nodes', "meshid": meshid}, "list_devices", timeout=timeout, priority=constants.Priority.bulk)))
             else:
-                tasks.append(tg.create_task(self._send_command({ "action": 'meshes' }, "list_devices", timeout=timeout)))
-                tasks.append(tg.create_task(self._send_command({ "action": 'nodes' }, "list_devices", timeout=timeout)))
+                tasks.append(tg.create_task(self._send_command({ "action": 'meshes' }, "list_devices", timeout=timeout, priority=constants.Priority.bulk)))
+                tasks.append(tg.create_task(self._send_command({ "action": 'nodes' }, "list_devices", timeout=timeout, priority=constants.Priority.bulk)))
 
         res0 = tasks[0].result()
         if "result" in res0:
             raise exceptions.ServerError(res0["result"])
+        meshes = {}
         if details:
             nodes = res0["data"]
             # Accept any number of nested strings, meshcentral is odd
-            while True:
-                try:
-                    nodes = json.loads(nodes)
-                except TypeError:
-                    break
-
-            for node in nodes:
-                if node["node"].get("meshid", None):
-                    node["node"]["mesh"] = mesh.Mesh(node["node"].get("meshid"), self)
-                if "lastConnect" in node and isinstance(node["lastConnect"], dict):
-                    node["node"]["lastconnect"] = node["lastConnect"].get("time")
-                    node["node"]["lastaddr"] = node["lastConnect"].get("addr")
-                    del node["lastConnect"]
-                details = {}
-                for key, val in node.items():
-                    if key != "node":
-                        details[key] = val
-                node["node"]["details"] = details
-            return [device.Device(n["node"]["_id"], self, **n["node"]) for n in nodes]
-        if group or meshid:
+            while isinstance(nodes, (str, bytes)):
+                nodes = self._codec.loads(nodes)
+            devices = device.DeviceList(nodes, lambda node: self._device_from_details(node, meshes))
+        elif group or meshid:
             nodes = []
             for _meshid, node_list in res0["nodes"].items():
                 for node in node_list:
                     node["meshid"] = meshid
                     if meshid:
-                        node["mesh"] = mesh.Mesh(_meshid, self)
+                        node["mesh"] = self._shared_mesh(meshes, _meshid)
                     if group:
                         node["groupname"] = group
                     nodes.append(node)
-            return [device.Device(n["_id"] , self, **n) for n in nodes]
-        # if "meshes" not in res0 or not res0["meshes"]:
-        #     return tasks[1].result()["nodes"]
-
-        xmeshes = {}
-        nodes = []
-        for _mesh in res0["meshes"]:
-            xmeshes[_mesh["_id"]] = _mesh
-        for meshid, devicesInMesh in tasks[1].result()["nodes"].items():
-            for _device in devicesInMesh:
-                _device["meshid"] = meshid; # Add device group id
-                if xmeshes and meshid in xmeshes and "name" in xmeshes[meshid]:
-                    _device["groupname"] = xmeshes[meshid]["name"] # Add device group name
-                nodes.append(_device);
-        for node in nodes:
-            if node.get("meshid", None):
-                node["mesh"] = mesh.Mesh(node.get("meshid"), self)
-        return [device.Device(n["_id"], self, **n) for n in nodes]
-
-    async def raw_messages(self):
+            devices = device.DeviceList(nodes, self._device_from_node)
+        else:
+            # if "meshes" not in res0 or not res0["meshes"]:
+            #     return tasks[1].result()["nodes"]
+
+            xmeshes = {}
+            nodes = []
+            for _mesh in res0["meshes"]:
+                xmeshes[_mesh["_id"]] = _mesh
+            for meshid, devicesInMesh in tasks[1].result()["nodes"].items():
+                groupname = xmeshes.get(meshid, {}).get("name", None)
+                _mesh = self._shared_mesh(meshes, meshid) if meshid else None
+                for _device in devicesInMesh:
+                    _device["meshid"] = meshid; # Add device group id
+                    if groupname is not None:
+                        _device["groupname"] = groupname # Add device group name
+                    if _mesh is not None:
+                        _device["mesh"] = _mesh
+                    nodes.append(_device);
+            devices = device.DeviceList(nodes, self._device_from_node)
+        if lazy:
+            return devices
+        return list(devices)
+
+    async def iter_devices(self, details=False, group=None, meshid=None, by_group=False, concurrency=4, timeout=None):
+        '''
+        Get devices to which the user has access, as an async generator. Devices are built and handed over one group at a time instead of all at once, so work on the first devices can start before the whole inventory has been built, and the library never holds the whole list.
+        Takes the same options as :py:meth:`list_devices`, and the devices are filled the same way.
+
+        Args:
+            details (bool): Get device details, overrides group and meshid. The details reply is decoded one device at a time.
+            group (str): Get devices from specific group by name. Overrides meshid
+            meshid (str): Get devices from specific group by id
+            by_group (bool): Request the devices of each device group separately instead of in one reply, so the first results arrive sooner and only `concurrency` groups are held in memory at once. Devices which the user only has individual device rights to are not included in this mode.
+            concurrency (int): Number of device groups to request at once when `by_group` is True
+            timeout (int): duration in seconds to wait for each response before throwing an error
+
+        Returns:
+            generator(~meshctrl.device.Device): A generator which will generate every device
+
+        Raises:
+            :py:class:`~meshctrl.exceptions.ServerError`: Error text from server if there is a failure
+            :py:class:`~meshctrl.exceptions.SocketError`: Info about socket closure
+            asyncio.TimeoutError: Command timed out
+        '''
+        meshes = {}
+        if details:
+            res = await self._send_command_no_response_id({"action": "getDeviceDetails", "type":"json"}, timeout=timeout, priority=constants.Priority.bulk)
+            if "result" in res:
+                raise exceptions.ServerError(res["result"])
+            for i, node in enumerate(util._iter_json_array(res.pop("data"), self._codec)):
+                yield self._device_from_details(node, meshes)
+                if i % 1000 == 999:
+                    # Decoding is synchronous, let the rest of the program breathe
+                    await asyncio.sleep(0)
+            return
+
+        if group or meshid:
+            op = { "action": 'nodes', "meshname": group} if group else { "action": 'nodes', "meshid": meshid}
+            res = await self._send_command(op, "iter_devices", timeout=timeout, priority=constants.Priority.bulk)
+            if "result" in res:
+                raise exceptions.ServerError(res["result"])
+            nodes = res["nodes"]
+            while nodes:
+                _meshid, node_list = nodes.popitem()
+                for node in node_list:
+                    node["meshid"] = meshid
+                    if meshid:
+                        node["mesh"] = self._shared_mesh(meshes, _meshid)
+                    if group:
+                        node["groupname"] = group
+                    yield self._device_from_node(node)
+                await asyncio.sleep(0)
+            return
+
+        res = await self._send_command({ "action": 'meshes' }, "iter_devices", timeout=timeout, priority=constants.Priority.bulk)
+        if "result" in res:
+            raise exceptions.ServerError(res["result"])
+        groupnames = {_mesh["_id"]: _mesh.get("name", None) for _mesh in res["meshes"]}
+
+        def _devices(_meshid, node_list):
+            groupname = groupnames.get(_meshid, None)
+            _mesh = self._shared_mesh(meshes, _meshid) if _meshid else None
+            for node in node_list:
+                node["meshid"] = _meshid
+                if groupname is not None:
+                    node["groupname"] = groupname
+                if _mesh is not None:
+                    node["mesh"] = _mesh
+                yield self._device_from_node(node)
+
+        if not by_group:
+            res = await self._send_command({ "action": 'nodes' }, "iter_devices", timeout=timeout, priority=constants.Priority.bulk)
+            if "result" in res:
+                raise exceptions.ServerError(res["result"])
+            nodes = res["nodes"]
+            # Pop each group as we go so the raw data shrinks along with what is left to hand out
+            while nodes:
+                for d in _devices(*nodes.popitem()):
+                    yield d
+                await asyncio.sleep(0)
+            return
+
+        limit = asyncio.Semaphore(concurrency)
+        async def _fetch(_meshid):
+            async with limit:
+                return await self._send_command({ "action": 'nodes', "meshid": _meshid }, "iter_devices", timeout=timeout, priority=constants.Priority.bulk)
+
+        tasks = [asyncio.create_task(_fetch(_meshid)) for _meshid in groupnames]
+        try:
+            for next_reply in asyncio.as_completed(tasks):
+                res = await next_reply
+                if "result" in res:
+                    raise exceptions.ServerError(res["result"])
+                nodes = res["nodes"]
+                while nodes:
+                    for d in _devices(*nodes.popitem()):
+                        yield d
+                    await asyncio.sleep(0)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def raw_messages(self, max_size=None, overflow=constants.OverflowPolicy.drop_oldest, coalesce_key=None):
         '''
         Listen to raw messages from the server. These will be strings that have not been parsed at all. Consider this an emergency fallback if meshcentral sends something odd. You will get every message from the websocket.
 
+        Args:
+            max_size (int): Most messages to hold for this listener if it falls behind. None means no limit.
+            overflow (~meshctrl.constants.OverflowPolicy): What to do with new messages once `max_size` are held
+            coalesce_key (function(data: str) -> object): Key to coalesce messages by, for the `coalesce` overflow policy
+
         Returns:
             generator(data): A generator which will generate every message the server sends
         '''
-        event_queue = asyncio.Queue()
+        event_queue = util.SubscriberQueue(max_size, overflow, coalesce_key)
         async def _(data):
-            await event_queue.put(data)
+            waiter = event_queue.offer(data)
+            if waiter is not None:
+                await waiter
         self._eventer.on("raw", _)
+        self._subscriber_queues[event_queue] = ("raw", None)
         try:
             while True:
-                data = await event_queue.get()
-                yield data
+                yield await event_queue.get()
         finally:
             self._eventer.off("raw", _)
+            del self._subscriber_queues[event_queue]
 
-    async def events(self, filter=None):
+    async def events(self, filter=None, max_size=None, overflow=constants.OverflowPolicy.drop_oldest, coalesce_key=None):
         '''
         Listen to events from the server
 
         Args:
             filter (dict): dict to filter events with. Only trigger for events that deep-match this dict. Use sets for "array.contains" and arrays for equality of lists.
+            max_size (int): Most events to hold for this listener if it falls behind. None means no limit.
+            overflow (~meshctrl.constants.OverflowPolicy): What to do with new events once `max_size` are held. Drop counts are available from :py:func:`subscriber_stats`.
+            coalesce_key (function(data: dict) -> object): Key to coalesce events by, for the `coalesce` overflow policy. For instance, `lambda e: e.get("nodeid")` keeps only the latest queued event per device.
 
         Returns:
             generator(data): A generator with the events that match the given filter, or all events if no filter is given
+
+        Raises:
+            ValueError: `coalesce` policy without a `coalesce_key`
          '''
-        event_queue = asyncio.Queue()
-        async def _(data):
-            await event_queue.put(data)
-        self._eventer.on("server_event", _)
+        event_queue = util.SubscriberQueue(max_size, overflow, coalesce_key)
+        # The filter is checked as messages come in, and only for subscribers indexed under a matching action, nodeid, etc.
+        subscription = self._subscribers.add(filter, event_queue.offer)
+        self._subscriber_queues[event_queue] = ("events", filter)
         try:
             while True:
-                data = await event_queue.get()
-                if filter and not util.compare_dict(filter, data):
-                    continue
-                yield data
+                yield await event_queue.get()
         finally:
-            self._eventer.off("server_event", _)
+            self._subscribers.remove(subscription)
+            del self._subscriber_queues[event_queue]
+
+    def subscriber_stats(self):
+        '''
+        Get the queue state of every active :py:func:`events` and :py:func:`raw_messages` listener. Use this to see which consumers are falling behind.
+
+        Returns:
+            list[~meshctrl.types.SubscriberStats]: Stats for each listener
+        '''
+        return [queue.stats() | {"kind": kind, "filter": filter} for queue, (kind, filter) in self._subscriber_queues.items()]
 
     async def list_events(self, userid=None, nodeid=None, limit=None, timeout=None):
         '''
@@ -844,7 +1249,7 @@ class Session(object):
         del data["result"]
         ugrpid = data["ugrpid"]
         del data["ugrpid"]
-        return user_group.UserGroup(ugrpid, self, name=name, description=description, domain=domain, **data)
+        return self._user_group_cls(ugrpid, self, name=name, description=description, domain=domain, **data)
 
     async def remove_user_group(self, groupid, domain=None, timeout=None):
         '''
@@ -893,7 +1298,7 @@ class Session(object):
         groups = []
         for key, val in r["ugroups"].items():
             val["_id"] = key
-            groups.append(user_group.UserGroup(key, self, **val))
+            groups.append(self._user_group_cls(key, self, **val))
         return groups
 
     async def add_users_to_user_group(self, usernames, groupid, domain=None, timeout=None):
@@ -1128,7 +1533,7 @@ class Session(object):
         del data["meshid"]
         data["name"] = name
         data["description"] = description
-        return mesh.Mesh(meshid, self, **data)
+        return self._mesh_cls(meshid, self, **data)
 
     async def remove_device_group(self, meshid, isname=False, timeout=None):
         '''
@@ -1352,12 +1757,28 @@ class Session(object):
             raise exceptions.ServerError(data["result"])
         return True
 
-    async def device_info(self, nodeid, timeout=None):
+    def _index_nodes(self, nodes):
+        # Flatten a `nodes` reply into a dict keyed by node id, so lookups don't scan every group
+        index = {}
+        for meshid, node_list in nodes.items():
+            for node in node_list:
+                node["meshid"] = meshid
+                index[node["_id"]] = node
+        return index
+
+    def _add_lastconnect(self, node, lastconnect):
+        if lastconnect is not None and "time" in lastconnect:
+            node["lastconnect"] = lastconnect["time"]
+            node["lastaddr"] = lastconnect.get("addr", None)
+
+    async def device_info(self, nodeid, meshid=None, timeout=None):
         '''
-        Get all info for a given device. WARNING: Non namespaced call. Calling this function again before it returns may cause unintended consequences.
+        Get all info for a given device. Only the device and its group are fetched, unless the server has no system information for the device, in which case its group (or every group, if `meshid` isn't given) is listed to find it.
+        If the inventory cache is enabled and has the device, only the last connection info is fetched from the server.
 
         Args:
             nodeid (str): Unique id of desired node
+            meshid (str): Id of the group the device is in, if known. Limits the device list we fetch if the server has no system information for the device.
             timeout (int): duration in seconds to wait for a response before throwing an error
 
         Returns:
@@ -1368,56 +1789,126 @@ class Session(object):
             :py:class:`~meshctrl.exceptions.SocketError`: Info about socket closure
             asyncio.TimeoutError: Command timed out
         '''
-        tasks = []
-        async with asyncio.TaskGroup() as tg:
-            tasks.append(tg.create_task(self._send_command({ "action": 'nodes' }, "device_info", timeout=timeout)))
-            tasks.append(tg.create_task(self._send_command_no_response_id({ "action": 'getnetworkinfo', "nodeid": nodeid }, timeout=timeout)))
-            tasks.append(tg.create_task(self._send_command_no_response_id({ "action": 'lastconnect', "nodeid": nodeid }, timeout=timeout)))
-            tasks.append(tg.create_task(self._send_command({ "action": 'getsysinfo', "nodeid": nodeid, "nodeinfo": True }, "device_info", timeout=timeout)))
-            tasks.append(tg.create_task(self.list_device_groups(timeout=timeout)))
+        nodeid = self._full_nodeid(nodeid)
+        if self.inventory is not None:
+            node = await self._inventory_node(nodeid, timeout=timeout)
+            if node is not None:
+                self._add_lastconnect(node, await self._send_command_no_response_id({ "action": 'lastconnect', "nodeid": nodeid }, by_nodeid=True, timeout=timeout))
+                return self._device_from_inventory(node)
 
-        nodes, network, lastconnect, sysinfo, meshes = (_.result() for _ in tasks)
-
-        
-        node = None
-        if sysinfo is not None and sysinfo.get("node", None):
-            # Node information came with system information
-            node = sysinfo.get("node", None)
-            for meshid, _nodes in nodes["nodes"].items():
-                for _mesh in meshes:
-                    if _mesh.meshid == meshid:
-                        break
-                else:
-                    break
-                if meshid == node["meshid"]:
-                    node["mesh"] = _mesh
-        else:
+        nodes = None
+        async with asyncio.TaskGroup() as tg:
+            lastconnect = tg.create_task(self._send_command_no_response_id({ "action": 'lastconnect', "nodeid": nodeid }, by_nodeid=True, timeout=timeout))
+            sysinfo = tg.create_task(self._send_command({ "action": 'getsysinfo', "nodeid": nodeid, "nodeinfo": True }, "device_info", timeout=timeout))
+            meshes = tg.create_task(self._send_command({ "action": 'meshes' }, "device_info", timeout=timeout))
+            if meshid is not None:
+                nodes = tg.create_task(self._send_command({ "action": 'nodes', "meshid": meshid }, "device_info", timeout=timeout))
+
+        # Node information comes with system information, if the server has any for this device
+        node = sysinfo.result().get("node", None)
+        if not node:
             # This device does not have system information, get node information from the nodes list.
-            for meshid, _nodes in nodes["nodes"].items():
-                for _mesh in meshes:
-                    if _mesh.meshid == meshid:
-                        break
-                else:
-                    _mesh = None
-                for _node in _nodes:
-                    if nodeid in _node["_id"]:
-                        node = _node
-                        node["meshid"] = meshid
-                        if _mesh is not None:
-                            node["mesh"] = _mesh
-                        break
-                else:
-                    continue
-                break
+            if nodes is None:
+                nodes = await self._send_command({ "action": 'nodes' }, "device_info", timeout=timeout)
+            else:
+                nodes = nodes.result()
+            node = self._index_nodes(nodes.get("nodes", {})).get(nodeid, None)
         if node is None:
             raise ValueError("Invalid device id")
-        if lastconnect is not None:
-            node["lastconnect"] = lastconnect["time"]
-            node["lastaddr"] = lastconnect["addr"]
-        if node.get("meshid", None) and "mesh" not in node:
-            node["mesh"] = mesh.Mesh(node["meshid"], self)
-        return device.Device(node["_id"], self, **node)
-        
+        if self.inventory is not None and node.get("meshid", None):
+            self.inventory.put_node(dict(node))
+        self._add_lastconnect(node, lastconnect.result())
+        if node.get("meshid", None):
+            _mesh = None
+            for m in meshes.result().get("meshes", []):
+                if m["_id"] == node["meshid"]:
+                    _mesh = m
+                    break
+            node["mesh"] = self._mesh_from_raw(node["meshid"], _mesh)
+        return self._device_cls(node["_id"], self, **node)
+
+    async def device_infos(self, nodeids, timeout=None):
+        '''
+        Get all info for many devices. The device list and groups are fetched once for all of them, instead of once per device as calling :py:meth:`device_info` in a loop would. Last connection info is still fetched per device, but all at once.
+
+        Args:
+            nodeids (list[str]): Unique ids of desired nodes
+            timeout (int): duration in seconds to wait for a response before throwing an error
+
+        Returns:
+            dict[str, ~meshctrl.device.Device]: Devices, keyed by the ids passed in
+
+        Raises:    
+            ValueError: `Invalid device id` if any device is not found
+            :py:class:`~meshctrl.exceptions.SocketError`: Info about socket closure
+            asyncio.TimeoutError: Command timed out
+        '''
+        fullids = {nodeid: self._full_nodeid(nodeid) for nodeid in nodeids}
+        async with asyncio.TaskGroup() as tg:
+            lastconnects = {fullid: tg.create_task(self._send_command_no_response_id({ "action": 'lastconnect', "nodeid": fullid }, by_nodeid=True, timeout=timeout)) for fullid in set(fullids.values())}
+            snapshot = tg.create_task(self._node_snapshot(lastconnects, timeout=timeout))
+        nodes, meshes = snapshot.result()
+        if len(nodes) < len(lastconnects):
+            raise ValueError("Invalid device id")
+
+        # Devices in the same group share one Mesh object
+        built_meshes = {}
+        devices = {}
+        for fullid, node in nodes.items():
+            self._add_lastconnect(node, lastconnects[fullid].result())
+            meshid = node.get("meshid", None)
+            if meshid:
+                if meshid not in built_meshes:
+                    built_meshes[meshid] = self._mesh_from_raw(meshid, meshes.get(meshid, None))
+                node["mesh"] = built_meshes[meshid]
+            devices[fullid] = self._device_cls(node["_id"], self, **node)
+        return {nodeid: devices[fullid] for nodeid, fullid in fullids.items()}
+
+    async def _node_snapshot(self, fullids, timeout=None):
+        # Raw node and mesh data for many devices, from the inventory cache where we can and one nodes/meshes fetch for the rest.
+        # Devices which can't be found are left out.
+        nodes = {}
+        meshes = {}
+        if self.inventory is not None:
+            if self.inventory.needs_seed:
+                await self._seed_inventory(timeout=timeout)
+            for fullid in fullids:
+                node = self.inventory.get_node(fullid)
+                if node is not None:
+                    nodes[fullid] = node
+                    meshid = node.get("meshid", None)
+                    if meshid and meshid not in meshes:
+                        meshes[meshid] = self.inventory.get_mesh(meshid)
+
+        if len(nodes) < len(fullids):
+            async with asyncio.TaskGroup() as tg:
+                _nodes = tg.create_task(self._send_command({ "action": 'nodes' }, "node_snapshot", timeout=timeout, priority=constants.Priority.bulk))
+                _meshes = tg.create_task(self._send_command({ "action": 'meshes' }, "node_snapshot", timeout=timeout, priority=constants.Priority.bulk))
+            index = self._index_nodes(_nodes.result().get("nodes", {}))
+            for fullid in fullids:
+                if fullid not in nodes and fullid in index:
+                    nodes[fullid] = index[fullid]
+                    if self.inventory is not None:
+                        self.inventory.put_node(dict(index[fullid]))
+            for m in _meshes.result().get("meshes", []):
+                meshes[m["_id"]] = m
+        return nodes, meshes
+
+    async def _console_rights(self, nodeids, timeout=None):
+        # Rights the logged in user has over the group of each device, all resolved from one snapshot
+        userid = (await self.user_info())["_id"]
+        fullids = {nodeid: self._full_nodeid(nodeid) for nodeid in nodeids}
+        nodes, meshes = await self._node_snapshot(set(fullids.values()), timeout=timeout)
+        rights = {}
+        for nodeid, fullid in fullids.items():
+            if fullid not in nodes:
+                raise ValueError("Invalid device id")
+            _mesh = meshes.get(nodes[fullid].get("meshid", None), None) or {}
+            # This should work for device rights, but it only seems to work for mesh rights. Not sure why, but I can't get the events to show up when the user only has individual device rights
+            # |node.get("links", {}).get(userid, {}).get("rights", constants.DeviceRights.norights)
+            rights[nodeid] = (_mesh.get("links", None) or {}).get(userid, {}).get("rights", constants.DeviceRights.norights)
+        return rights
+
     async def edit_device(self, nodeid, name=None, description=None, tags=None, icon=None, consent=None, timeout=None):
         '''
         Edit properties of an existing device
@@ -1459,7 +1950,7 @@ class Session(object):
 
     async def run_command(self, nodeids, command, powershell=False, runasuser=False, runasuseronly=False, ignore_output=False, timeout=None):
         '''
-        Run a command on any number of nodes. WARNING: Non namespaced call. Calling this function again before it returns may cause unintended consequences.
+        Run a command on any number of nodes. Calls may overlap, but the server doesn't say which command console output belongs to, so if two calls run on the same device at once, that device's output is handed out in the order the calls were made.
 
         Args:
             nodeids (str|list[str]): Unique ids of nodes on which to run the command
@@ -1487,82 +1978,62 @@ class Session(object):
         if isinstance(nodeids, str):
             nodeids = [nodeids]
 
-        def match_nodeid(id, ids):
-            for nid in ids:
-                if (nid == id):
-                    return nid
-                if (nid[6:] == id):
-                    return nid
-                if (f"node//{nid}" == id):
-                    return nid
-
-        result = {n: {"complete": False, "result": [], "command": command} for n in nodeids}
-        async def _console():
-            async for event in self.events({"action": "msg", "type": "console"}):
-                node = match_nodeid(event["nodeid"], nodeids)
-                if node:
-                    if event["value"] == "Run commands completed.":
-                        result.setdefault(node, {})["complete"] = True
-                        if all(_["complete"] for key, _ in result.items()):
-                            break
-                        continue
-                    elif (event["value"].startswith("Run commands")):
-                        continue
-                    result[node]["result"].append(event["value"])
-            
-
-        async def __(command, tg, tasks):
-            data = await self._send_command(command, "run_command", timeout=timeout)
-
-            if data.get("type", None) != "runcommands" and data.get("result", "ok").lower() != "ok":
-                raise exceptions.ServerError(data["result"])
-            elif data.get("type", None) != "runcommands" and data.get("result", "ok").lower() == "ok":
-                expect_response = False
-                console_task = tg.create_task(asyncio.wait_for(_console(), timeout=timeout))
-                if not ignore_output:
-                    userid = (await self.user_info())["_id"]
-                    for n in nodeids:
-                        device_info = await self.device_info(n, timeout=timeout)
-                        try:
-                            permissions = device_info.mesh.links.get(userid, {}).get("rights",constants.DeviceRights.norights)\
-                            # This should work for device rights, but it only seems to work for mesh rights. Not sure why, but I can't get the events to show up when the user only has individual device rights
-                            # |device_info.get("links", {}).get(userid, {}).get("rights", constants.DeviceRights.norights)
-                            # If we don't have agentconsole rights, we won't be able te read the output, so fill in blanks on this node
-                            if not permissions&constants.DeviceRights.agentconsole:
-                                result[n]["complete"] = True
-                            else:
-                                expect_response = True
-                        except AttributeError:
-                            result[n]["complete"] = True
-                if expect_response:
-                    tasks.append(console_task)
-                else:
-                    console_task.cancel()
-            elif data.get("type", None) == "runcommands" and not ignore_output:
-                # Returns True when all results are in, Falsey otherwise
-                def _parse_event(event):
-                    node = match_nodeid(event["nodeid"], nodeids)
-                    if node:
-                        result.setdefault(node, {})["complete"] = True
-                        result[node]["result"].append(event["result"])
-                        if all(_["complete"] for key, _ in result.items()):
-                            return True
-                if data is not None:
-                    if _parse_event(data):
-                        return
-                async for event in self.events({"action": "msg", "type": "runcommands", "responseid": data["responseid"]}):
-                    if _parse_event(event):
-                        break
+        job = _CommandJob(self, nodeids, command)
+        await self._run_command_job(job, { "action": 'runcommands', "nodeids": nodeids, "type": (2 if powershell else 0), "cmds": command, "runAsUser": runAsUser, "reply": not ignore_output}, "run_command", ignore_output, timeout)
+        return job.results()
 
-        tasks = []
-        async with asyncio.TaskGroup() as tg:
-            tasks.append(tg.create_task(__({ "action": 'runcommands', "nodeids": nodeids, "type": (2 if powershell else 0), "cmds": command, "runAsUser": runAsUser, "reply": not ignore_output}, tg, tasks)))
+    async def run_command_stream(self, nodeids, command, powershell=False, runasuser=False, runasuseronly=False, node_timeout=None, timeout=None):
+        '''
+        Run a command on any number of nodes, yielding output as it arrives instead of waiting for every node to finish. A record is yielded for each chunk of output, then one when the node completes or is given up on.
+
+        Args:
+            nodeids (str|list[str]): Unique ids of nodes on which to run the command
+            command (str): Command to run
+            powershell (bool): Use powershell to run command. Only available on Windows.
+            runasuser (bool): Attempt to run as a user instead of the root permissions given to the agent. Fall back to root if we cannot.
+            runasuseronly (bool): Error if we cannot run the command as the logged in user.
+            node_timeout (float): Give up on a node if it goes this many seconds without sending any output. A record with `timed_out` set is yielded for it, and the other nodes carry on.
+            timeout (int): duration in seconds to wait for a response before throwing an error, and for all nodes to finish
 
-        return {n: v | {"result": "".join(v["result"])} for n,v in result.items()}
+        Returns:
+            collections.abc.AsyncIterator[~meshctrl.types.RunCommandChunk]: Output and completion records, in the order they arrive
+
+        Raises:    
+            :py:class:`~meshctrl.exceptions.ServerError`: Error text from server if there is a failure
+            :py:class:`~meshctrl.exceptions.SocketError`: Info about socket closure
+            ValueError: `Invalid device id` if device is not found
+            asyncio.TimeoutError: Command timed out
+         '''
+        runAsUser = 0
+        if runasuser:
+            runAsUser = 1
+        if runasuseronly:
+            runAsUser = 2
+        if isinstance(nodeids, str):
+            nodeids = [nodeids]
+
+        job = _CommandJob(self, nodeids, command, stream=True, node_timeout=node_timeout)
+        async def _run():
+            try:
+                await self._run_command_job(job, { "action": 'runcommands', "nodeids": nodeids, "type": (2 if powershell else 0), "cmds": command, "runAsUser": runAsUser, "reply": True}, "run_command", False, timeout)
+            finally:
+                job.stream.put_nowait(None)
+
+        runner = asyncio.create_task(_run())
+        try:
+            while True:
+                record = await job.stream.get()
+                if record is None:
+                    break
+                yield record
+            await runner
+        finally:
+            runner.cancel()
+            job.close()
 
     async def run_console_command(self, nodeids, command, powershell=False, runasuser=False, runasuseronly=False, ignore_output=False, timeout=None):
         '''
-        Run a mesh console command on any number of nodes. WARNING: Non namespaced call. Calling this function again before it returns may cause unintended consequences.
+        Run a mesh console command on any number of nodes. Calls may overlap, but the server doesn't say which command console output belongs to, so if two calls run on the same device at once, that device's output is handed out in the order the calls were made.
 
         Args:
             nodeids (str|list[str]): Unique ids of nodes on which to run the command
@@ -1582,59 +2053,52 @@ class Session(object):
         if isinstance(nodeids, str):
             nodeids = [nodeids]
 
-        def match_nodeid(id, ids):
-            for nid in ids:
-                if (nid == id):
-                    return nid
-                if (nid[6:] == id):
-                    return nid
-                if (f"node//{nid}" == id):
-                    return nid
-
-        result = {n: {"complete": False, "result": [], "command": command} for n in nodeids}
-        async def _console():
-            async for event in self.events({"action": "msg", "type": "console"}):
-                # We can pick up run commands here sometimes if they are run in quick succession. Try to avoid that.
-                if (not event["value"].startswith("Run commands")):
-                    node = match_nodeid(event["nodeid"], nodeids)
-                    if node:
-                        result[node]["result"].append(event["value"])
-                        result.setdefault(node, {})["complete"] = True
-                        if all(_["complete"] for key, _ in result.items()):
-                            break
-        async def __(command, tg, tasks):
-            data = await self._send_command(command, "run_console_command", timeout=timeout)
-
-            if data.get("type", None) != "runcommands" and data.get("result", "ok").lower() != "ok":
-                raise exceptions.ServerError(data["result"])
-            elif data.get("type", None) != "runcommands" and data.get("result", "ok").lower() == "ok":
-                expect_response = False
-                console_task = tg.create_task(asyncio.wait_for(_console(), timeout=timeout))
-                if not ignore_output:
-                    userid = (await self.user_info())["_id"]
-                    for n in nodeids:
-                        device_info = await self.device_info(n, timeout=timeout)
-                        try:
-                            permissions = device_info.mesh.links.get(userid, {}).get("rights",constants.DeviceRights.norights)\
-                            # This should work for device rights, but it only seems to work for mesh rights. Not sure why, but I can't get the events to show up when the user only has individual device rights
-                            # |device_info.get("links", {}).get(userid, {}).get("rights", constants.DeviceRights.norights)
-                            # If we don't have agentconsole rights, we won't be able te read the output, so fill in blanks on this node
-                            if not permissions&constants.DeviceRights.agentconsole:
-                                result[n]["complete"] = True
-                            else:
-                                expect_response = True
-                        except AttributeError:
-                            result[n]["complete"] = True
-                if expect_response:
-                    tasks.append(console_task)
-                else:
-                    console_task.cancel()
-
-        tasks = []
-        async with asyncio.TaskGroup() as tg:
-            tasks.append(tg.create_task(__({ "action": 'runcommands', "nodeids": nodeids, "type": 4, "cmds": command}, tg, tasks)))
+        job = _CommandJob(self, nodeids, command, console_command=True)
+        await self._run_command_job(job, { "action": 'runcommands', "nodeids": nodeids, "type": 4, "cmds": command}, "run_console_command", ignore_output, timeout)
+        return job.results()
+
+    async def _run_command_job(self, job, command, name, ignore_output, timeout):
+        async def _run():
+            if not ignore_output:
+                # Console output can arrive before we know what kind of reply we'll get, so route it to this job from the start
+                job.listen_console()
+                job.start_timers()
+            data = await self._send_command(command, name, job=None if ignore_output else job, timeout=timeout)
+
+            if data.get("type", None) != "runcommands":
+                if data.get("result", "ok").lower() != "ok":
+                    raise exceptions.ServerError(data["result"])
+                if ignore_output:
+                    return
+                for n, permissions in (await self._console_rights(job.nodeids, timeout=timeout)).items():
+                    # If we don't have agentconsole rights, we won't be able te read the output, so fill in blanks on this node
+                    if not permissions&constants.DeviceRights.agentconsole:
+                        job.complete(self._full_nodeid(n))
+            else:
+                # Results come back as runcommands messages carrying our response id, including this one
+                job.stop_console()
+                if ignore_output:
+                    return
+            await asyncio.wait_for(job.done.wait(), timeout=timeout)
 
-        return {n: v | {"result": "".join(v["result"])} for n,v in result.items()}
+        try:
+            # Errors from here have always been raised in an ExceptionGroup, keep it that way
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(_run())
+        finally:
+            job.close()
+
+    def _route_command_output(self, data):
+        mtype = data.get("type", None)
+        if mtype == "console" and "nodeid" in data:
+            jobs = self._console_jobs.get(self._full_nodeid(data["nodeid"]), None)
+            if jobs:
+                # Console output doesn't say which command it is for. Jobs on the same device get it in the order they were started.
+                jobs[0].console(data)
+        elif mtype == "runcommands":
+            job = self._command_jobs.get(data.get("responseid", None), None)
+            if job is not None:
+                job.runcommands(data)
 
     def shell(self, nodeid):
         '''
@@ -1683,7 +2147,7 @@ class Session(object):
         if isinstance(nodeids, str):
             nodeids = [nodeids]
 
-        return await self._send_command({ "action": 'wakedevices', "nodeids": nodeids }, "wake_devices", timeout=timeout)
+        return await self._send_command({ "action": 'wakedevices', "nodeids": nodeids }, "wake_devices", timeout=timeout, priority=constants.Priority.interactive)
 
     async def reset_devices(self, nodeids, timeout=None):
         '''
@@ -1704,7 +2168,7 @@ class Session(object):
         if isinstance(nodeids, str):
             nodeids = [nodeids]
 
-        return await self._send_command({ "action": 'poweraction', "nodeids": nodeids, "actiontype": 3 }, "reset_devices", timeout=timeout)
+        return await self._send_command({ "action": 'poweraction', "nodeids": nodeids, "actiontype": 3 }, "reset_devices", timeout=timeout, priority=constants.Priority.interactive)
 
     async def sleep_devices(self, nodeids, timeout=None):
         '''
@@ -1725,7 +2189,7 @@ class Session(object):
         if isinstance(nodeids, str):
             nodeids = [nodeids]
 
-        return await self._send_command({ "action": 'poweraction', "nodeids": nodeids, "actiontype": 4 }, "sleep_devices", timeout=timeout)
+        return await self._send_command({ "action": 'poweraction', "nodeids": nodeids, "actiontype": 4 }, "sleep_devices", timeout=timeout, priority=constants.Priority.interactive)
 
     async def power_off_devices(self, nodeids, timeout=None):
         ''' 
@@ -1746,7 +2210,7 @@ class Session(object):
         if isinstance(nodeids, str):
             nodeids = [nodeids]
 
-        return await self._send_command({ "action": 'poweraction', "nodeids": nodeids, "actiontype": 2 }, "power_off_devices", timeout=timeout)
+        return await self._send_command({ "action": 'poweraction', "nodeids": nodeids, "actiontype": 2 }, "power_off_devices", timeout=timeout, priority=constants.Priority.interactive)
 
     async def list_device_shares(self, nodeid, timeout=None):
         '''
@@ -1906,7 +2370,7 @@ class Session(object):
             :py:class:`~meshctrl.exceptions.SocketError`: Info about socket closure
             asyncio.TimeoutError: Command timed out
          '''
-        data = await self._send_command({ "action": 'msg', "type": 'messagebox', "nodeid": nodeid, "title": title, "msg": message }, "device_message", timeout=timeout)
+        data = await self._send_command({ "action": 'msg', "type": 'messagebox', "nodeid": nodeid, "title": title, "msg": message }, "device_message", timeout=timeout, priority=constants.Priority.interactive)
 
         if data.get("result", "ok").lower() != "ok":
             raise exceptions.ServerError(data["result"])
@@ -1936,7 +2400,7 @@ class Session(object):
         if isinstance(nodeids, str):
             nodeids = [nodeids]
 
-        data = self._send_command({ "action": 'toast', "nodeids": nodeids, "title": "MeshCentral", "msg": message }, "device_toast", timeout=timeout)
+        data = self._send_command({ "action": 'toast', "nodeids": nodeids, "title": "MeshCentral", "msg": message }, "device_toast", timeout=timeout, priority=constants.Priority.interactive)
 
         if data.get("result", "ok").lower() != "ok":
             raise exceptions.ServerError(data["result"])
@@ -1960,9 +2424,9 @@ class Session(object):
          '''
         if session is None and user is None:
             raise ValueError("No user or session given")
-        await self._message_queue.put(json.dumps({"action": "interuser", "data": data, "sessionid": session, "userid": user}))
+        await self._message_queue.put(self._codec.dumps({"action": "interuser", "data": data, "sessionid": session, "userid": user}))
 
-    async def upload(self, node, source, target, unique_file_tunnel=False, timeout=None):
+    async def upload(self, node, source, target, unique_file_tunnel=False, timeout=None, window=8, checkpoint=None):
         '''
         Upload a stream to a device.
 
@@ -1972,6 +2436,8 @@ class Session(object):
             target (str): Path which to upload stream to on remote device
             unique_file_tunnel (bool): True: Create a unique :py:class:`~meshctrl.files.Files` for this call, which will be cleaned up on return, else use cached or cache :py:class:`~meshctrl.files.Files`
             timeout (int): duration in seconds to wait for a response before throwing an error
+            window (int): Most chunks sent but not yet acknowledged by the device. See :py:func:`~meshctrl.files.Files.upload`.
+            checkpoint (str|None): Path of a file which lets a failed upload be resumed by calling again with the same arguments. See :py:func:`~meshctrl.files.Files.upload`.
 
         Raises:
             :py:class:`~meshctrl.exceptions.FileTransferError`: File transfer failed. Info available on the `stats` property
@@ -1980,17 +2446,16 @@ class Session(object):
         Returns:
             dict: {result: bool whether upload succeeded, size: number of bytes uploaded}
         '''
-        if not isinstance(node, device.Device):
-            node = await self.device_info(node)
+        node = await self._resolve_device(node, timeout=timeout)
         if unique_file_tunnel:
             async with self.file_explorer(node) as files:
-                return await files.upload(source, target, timeout=timeout)
+                return await files.upload(source, target, timeout=timeout, window=window, checkpoint=checkpoint)
         else:
             files = await self._cached_file_explorer(node, node.nodeid)
-            return await files.upload(source, target, timeout=timeout)
+            return await files.upload(source, target, timeout=timeout, window=window, checkpoint=checkpoint)
 
 
-    async def upload_file(self, node, filepath, target, unique_file_tunnel=False, timeout=None):
+    async def upload_file(self, node, filepath, target, unique_file_tunnel=False, timeout=None, window=8, checkpoint=None):
         '''
         Friendly wrapper around :py:class:`~meshctrl.session.Session.upload` to upload from a filepath. Creates a ReadableStream and calls upload.
 
@@ -2000,6 +2465,8 @@ class Session(object):
             target (str): Path which to upload file to on remote device
             unique_file_tunnel (bool): True: Create a unique :py:class:`~meshctrl.files.Files` for this call, which will be cleaned up on return, else use cached or cache :py:class:`~meshctrl.files.Files`
             timeout (int): duration in seconds to wait for a response before throwing an error
+            window (int): Most chunks sent but not yet acknowledged by the device. See :py:func:`~meshctrl.files.Files.upload`.
+            checkpoint (str|None): Path of a file which lets a failed upload be resumed by calling again with the same arguments. See :py:func:`~meshctrl.files.Files.upload`.
 
         Raises:
             :py:class:`~meshctrl.exceptions.FileTransferError`: File transfer failed. Info available on the `stats` property
@@ -2009,9 +2476,9 @@ class Session(object):
             dict: {result: bool whether upload succeeded, size: number of bytes uploaded}
          '''
         with open(filepath, "rb") as f:
-            return await self.upload(node, f, target, unique_file_tunnel, timeout=timeout)
+            return await self.upload(node, f, target, unique_file_tunnel, timeout=timeout, window=window, checkpoint=checkpoint)
 
-    async def download(self, node, source, target=None, skip_http_attempt=False, skip_ws_attempt=False, unique_file_tunnel=False, timeout=None):
+    async def download(self, node, source, target=None, skip_http_attempt=False, skip_ws_attempt=False, unique_file_tunnel=False, timeout=None, parallel=1, checkpoint=None):
         '''
         Download a file from a device into a writable stream. This creates an :py:class:`~meshctrl.files.Files` and destroys it every call. If you need to upload multiple files, use :py:class:`~meshctrl.session.Session.file_explorer` instead.
 
@@ -2023,6 +2490,8 @@ class Session(object):
             skip_ws_attempt (bool): Like skip_http_attempt, except just throw an error if the http attempt fails instead of trying with the websocket
             unique_file_tunnel (bool): True: Create a unique :py:class:`~meshctrl.files.Files` for this call, which will be cleaned up on return, else use cached or cache :py:class:`~meshctrl.files.Files`
             timeout (int): duration in seconds to wait for a response before throwing an error
+            parallel (int): Number of byte ranges to fetch at once over http(s). See :py:func:`~meshctrl.files.Files.download`.
+            checkpoint (str|None): Path of a file which lets a failed download be resumed by calling again with the same arguments. See :py:func:`~meshctrl.files.Files.download`.
 
         Raises:
             :py:class:`~meshctrl.exceptions.FileTransferError`: File transfer failed. Info available on the `stats` property
@@ -2031,23 +2500,22 @@ class Session(object):
         Returns:
             io.IOBase: The stream which has been downloaded into. Cursor will be at the beginning of where the file is downloaded.
         '''
-        if not isinstance(node, device.Device):
-            node = await self.device_info(node)
+        node = await self._resolve_device(node, timeout=timeout)
         if target is None:
             target = io.BytesIO()
         start = target.tell()
         if unique_file_tunnel:
             async with self.file_explorer(node) as files:
-                await files.download(source, target, skip_http_attempt=skip_http_attempt, skip_ws_attempt=skip_ws_attempt, timeout=timeout)
+                await files.download(source, target, skip_http_attempt=skip_http_attempt, skip_ws_attempt=skip_ws_attempt, timeout=timeout, parallel=parallel, checkpoint=checkpoint)
                 target.seek(start)
                 return target
         else:
             files = await self._cached_file_explorer(node, node.nodeid)
-            await files.download(source, target, skip_http_attempt=skip_http_attempt, skip_ws_attempt=skip_ws_attempt, timeout=timeout)
+            await files.download(source, target, skip_http_attempt=skip_http_attempt, skip_ws_attempt=skip_ws_attempt, timeout=timeout, parallel=parallel, checkpoint=checkpoint)
             target.seek(start)
             return target
 
-    async def download_file(self, node, source, filepath, skip_http_attempt=False, skip_ws_attempt=False, unique_file_tunnel=False, timeout=None):
+    async def download_file(self, node, source, filepath, skip_http_attempt=False, skip_ws_attempt=False, unique_file_tunnel=False, timeout=None, parallel=1, checkpoint=None):
         '''
         Friendly wrapper around :py:class:`~meshctrl.session.Session.download` to download to a filepath. Creates a WritableStream and calls download.
 
@@ -2059,6 +2527,8 @@ class Session(object):
             skip_ws_attempt (bool): Like skip_http_attempt, except just throw an error if the http attempt fails instead of trying with the websocket
             unique_file_tunnel (bool): True: Create a unique :py:class:`~meshctrl.files.Files` for this call, which will be cleaned up on return, else use cached or cache :py:class:`~meshctrl.files.Files`
             timeout (int): duration in seconds to wait for a response before throwing an error
+            parallel (int): Number of byte ranges to fetch at once over http(s). See :py:func:`~meshctrl.files.Files.download`.
+            checkpoint (str|None): Path of a file which lets a failed download be resumed by calling again with the same arguments. See :py:func:`~meshctrl.files.Files.download`.
 
         Raises:
             :py:class:`~meshctrl.exceptions.FileTransferError`: File transfer failed. Info available on the `stats` property
@@ -2067,8 +2537,10 @@ class Session(object):
         Returns:
             None
          '''
-        with open(filepath, "wb") as f:
-            await self.download(node, source, f, skip_http_attempt=skip_http_attempt, skip_ws_attempt=skip_ws_attempt, unique_file_tunnel=unique_file_tunnel, timeout=timeout)
+        # Keep what an earlier attempt wrote, if it left a checkpoint to resume from
+        mode = "r+b" if checkpoint is not None and os.path.exists(checkpoint) and os.path.exists(filepath) else "wb"
+        with open(filepath, mode) as f:
+            await self.download(node, source, f, skip_http_attempt=skip_http_attempt, skip_ws_attempt=skip_ws_attempt, unique_file_tunnel=unique_file_tunnel, timeout=timeout, parallel=parallel, checkpoint=checkpoint)
 
     async def _cached_file_explorer(self, node, _id):
         if (_id not in self._file_tunnels or not self._file_tunnels[_id].alive):
@@ -2089,6 +2561,25 @@ class Session(object):
         return _FileExplorerWrapper(self, node)
 
 
+class _ControlConnection(object):
+    # Send queue and outstanding requests of one control websocket. The primary connection's queue is Session._message_queue.
+    def __init__(self, queue):
+        self.queue = queue
+        self.in_flight = set()
+        self.open = False
+        self.error = None
+
+    def fail_in_flight(self, pending):
+        # Replies to these will never come, so don't leave their callers waiting for a timeout
+        for id in self.in_flight:
+            response = pending.get(id, None)
+            if response is not None and not response.done():
+                response.set_exception(exceptions.SocketError("Socket Closed"))
+        self.in_flight.clear()
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+
 # This is a little yucky, but I can't get a good API otherwise. Since Tunnel objects are only useable as context managers anyway, this should be fine.
 class _FileExplorerWrapper:
     def __init__(self, session, node):
@@ -2097,10 +2588,123 @@ class _FileExplorerWrapper:
         self._files = None
 
     async def __aenter__(self):
-        if not isinstance(self.node, device.Device):
-            self.node = await self.session.device_info(self.node)
+        self.node = await self.session._resolve_device(self.node)
         self._files = files.Files(self.session, self.node)
         return await self._files.__aenter__()
 
     async def __aexit__(self, exc_t, exc_v, exc_tb):
         return await self._files.__aexit__(exc_t, exc_v, exc_tb)
+
+
+class _CommandJob(object):
+    # Output of one run_command or run_console_command call, filled in as the session routes messages to it.
+    # When streaming, output is handed to `stream` as it arrives instead of being collected, and nodes which go quiet for `node_timeout` seconds are given up on.
+    def __init__(self, session, nodeids, command, console_command=False, stream=False, node_timeout=None):
+        self.session = session
+        self.nodeids = nodeids
+        self.console_command = console_command
+        self.responseid = None
+        self.done = asyncio.Event()
+        self.stream = asyncio.Queue() if stream else None
+        self.node_timeout = node_timeout
+        self._result = {n: {"complete": False, "result": [], "command": command} for n in nodeids}
+        self._nodes = {session._full_nodeid(n): n for n in nodeids}
+        self._finished = set()
+        self._listening = set()
+        self._timers = {}
+
+    def results(self):
+        return {n: v | {"result": "".join(v["result"])} for n,v in self._result.items()}
+
+    def listen_console(self):
+        for fullid in self._nodes:
+            self.session._console_jobs.setdefault(fullid, collections.deque()).append(self)
+            self._listening.add(fullid)
+
+    def start_timers(self):
+        if self.node_timeout is not None:
+            for fullid in self._nodes:
+                self._touch(fullid)
+
+    def _touch(self, fullid):
+        if self.node_timeout is None or fullid in self._finished:
+            return
+        timer = self._timers.get(fullid, None)
+        if timer is not None:
+            timer.cancel()
+        self._timers[fullid] = asyncio.get_running_loop().call_later(self.node_timeout, self.expire, fullid)
+
+    def stop_console(self, fullid=None):
+        for _id in ([fullid] if fullid is not None else list(self._listening)):
+            if _id not in self._listening:
+                continue
+            self._listening.discard(_id)
+            jobs = self.session._console_jobs.get(_id, None)
+            if jobs is None:
+                continue
+            try:
+                jobs.remove(self)
+            except ValueError:
+                pass
+            if not jobs:
+                del self.session._console_jobs[_id]
+
+    def _emit(self, fullid, output=None, complete=False, timed_out=False):
+        if self.stream is not None:
+            self.stream.put_nowait({"nodeid": self._nodes[fullid], "output": output, "complete": complete, "timed_out": timed_out})
+
+    def _finish(self, fullid):
+        self.stop_console(fullid)
+        self._finished.add(fullid)
+        timer = self._timers.pop(fullid, None)
+        if timer is not None:
+            timer.cancel()
+        if len(self._finished) == len(self._nodes):
+            self.done.set()
+
+    def complete(self, fullid):
+        if fullid in self._finished:
+            return
+        self._result[self._nodes[fullid]]["complete"] = True
+        self._finish(fullid)
+        self._emit(fullid, complete=True)
+
+    def expire(self, fullid):
+        if fullid in self._finished:
+            return
+        self._finish(fullid)
+        self._emit(fullid, timed_out=True)
+
+    def _output(self, fullid, value):
+        if self.stream is not None:
+            self._emit(fullid, output=value)
+            self._touch(fullid)
+        else:
+            self._result[self._nodes[fullid]]["result"].append(value)
+
+    def console(self, data):
+        fullid = self.session._full_nodeid(data["nodeid"])
+        value = data.get("value", "")
+        if value == "Run commands completed." and not self.console_command:
+            self.complete(fullid)
+        elif value.startswith("Run commands"):
+            # Progress messages from runcommands. A console command might pick these up if they are run in quick succession, so skip them.
+            return
+        else:
+            self._output(fullid, value)
+            if self.console_command:
+                self.complete(fullid)
+
+    def runcommands(self, data):
+        fullid = self.session._full_nodeid(data.get("nodeid", ""))
+        if fullid in self._nodes and fullid not in self._finished:
+            self._output(fullid, data.get("result", ""))
+            self.complete(fullid)
+
+    def close(self):
+        self.stop_console()
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        if self.responseid is not None:
+            self.session._command_jobs.pop(self.responseid, None)
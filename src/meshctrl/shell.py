@@ -1,9 +1,9 @@
 from . import tunnel
 from . import constants
 from . import util
+from . import profiling
 import io
 import time
-import json
 import re
 import asyncio
 
@@ -41,8 +41,8 @@ class _BufferPipe(io.BufferedRandom):
         return d
 
 class Shell(tunnel.Tunnel):
-    def __init__(self, session, nodeid):
-        super().__init__(session, nodeid, constants.Protocol.TERMINAL)
+    def __init__(self, session, nodeid, codec=None):
+        super().__init__(session, nodeid, constants.Protocol.TERMINAL, codec=codec)
         self.recorded = None
         self._buffer = _BufferPipe()
 
@@ -124,13 +124,14 @@ class Shell(tunnel.Tunnel):
             if self.initialized.is_set():
                 if message.startswith(b'{"ctrlChannel":"102938","type":"'):
                     try:
-                        ctrl_cmd = json.loads(message)
+                        ctrl_cmd = self._codec.loads(message)
                         # Skip control commands, like ping/pong
                         if ctrl_cmd.get("type", None) is not None:
                             return
                     except:
                         pass
-                self._buffer.write(message)
+                with profiling._span(self._session.profiler, "shell.write", {"size": len(message)}):
+                    self._buffer.write(message)
             else:
                 self.recorded = False
                 if message == "cr":
@@ -11,8 +11,10 @@ from . import util
 from . import constants
 
 class Tunnel(object):
-    def __init__(self, session, node_id, protocol):
+    def __init__(self, session, node_id, protocol, codec=None):
         self._session = session
+        # Share the session's codec unless we are told otherwise
+        self._codec = codec if codec is not None else session._codec
         self.node_id = node_id
         self._protocol = protocol
         self._tunnel_id = None
@@ -102,6 +102,23 @@ class RunCommandResponse(typing.TypedDict):
     result: str
     '''Output of command'''
 
+class RunCommandChunk(typing.TypedDict):
+    '''
+    Record yielded from :py:func:`~meshctrl.session.Session.run_command_stream`
+    '''
+
+    nodeid: str
+    '''Device this record is for, as it was passed in'''
+
+    output: str|None
+    '''Chunk of output from the command, or None if this record marks the end of the device's output'''
+
+    complete: bool
+    '''Whether the device finished running the command'''
+
+    timed_out: bool
+    '''Whether we gave up waiting on the device'''
+
 class AddUsersToUserGroupResponse(typing.TypedDict):
     '''
     Response item from add_users_to_user_group execution
@@ -188,4 +205,127 @@ class FilesLSItem(typing.TypedDict):
     '''Size of the file if t == :py:const:`~meshctrl.constants.FileType.FILE`'''
 
     f: typing.Optional[int]
-    '''Free bytes on the drive, if t == :py:const:`~meshctrl.constants.FileType.DRIVE`'''
\ No newline at end of file
+    '''Free bytes on the drive, if t == :py:const:`~meshctrl.constants.FileType.DRIVE`'''
+
+class SubscriberStats(typing.TypedDict):
+    '''
+    Queue state of one listener, from :py:func:`~meshctrl.session.Session.subscriber_stats`
+    '''
+
+    kind: str
+    '''"events" or "raw"'''
+
+    filter: dict|None
+    '''Filter the listener was created with'''
+
+    size: int
+    '''Messages currently queued'''
+
+    max_size: int|None
+    '''Most messages the queue will hold. None if unbounded.'''
+
+    overflow: constants.OverflowPolicy
+    '''What happens when the queue is full'''
+
+    dropped: int
+    '''Messages thrown away because the queue was full'''
+
+    coalesced: int
+    '''Messages which replaced a queued message with the same key'''
+
+    high_water: int
+    '''Most messages queued at once'''
+
+class LatencyPercentiles(typing.TypedDict):
+    '''
+    Percentiles of recent durations, in seconds
+    '''
+
+    p50: float
+    p90: float
+    p99: float
+    max: float
+
+class SchedulerStats(typing.TypedDict):
+    '''
+    State of a session's command scheduler, from :py:func:`~meshctrl.scheduler.CommandScheduler.stats`
+    '''
+
+    in_flight: int
+    '''Commands currently awaiting a reply'''
+
+    queued: int
+    '''Commands waiting for their turn to be sent'''
+
+    queued_by_action: dict[str, int]
+    '''Waiting commands, by action'''
+
+    in_flight_by_action: dict[str, int]
+    '''Commands awaiting a reply, by action'''
+
+    max_in_flight: int|None
+    '''Most commands awaiting a reply at once. None if unlimited.'''
+
+    completed: int
+    '''Commands which have finished, whether they succeeded or not'''
+
+    wait: LatencyPercentiles|None
+    '''Time recent commands spent waiting for their turn. None if no commands have been sent.'''
+
+    latency: LatencyPercentiles|None
+    '''Time from sending recent commands to their reply, or their failure. None if no commands have been sent.'''
+
+class HistogramSnapshot(typing.TypedDict):
+    '''
+    Histogram of durations, in seconds, from :py:meth:`~meshctrl.metrics.InProcessMetrics.snapshot`
+    '''
+
+    count: int
+    '''Number of values recorded'''
+
+    sum: float
+    '''Sum of the values recorded'''
+
+    buckets: dict[float, int]
+    '''Number of values in each bucket, keyed by the bucket's upper bound. Not cumulative.'''
+
+    p50: float|None
+    '''Upper bound of the bucket holding the median. None if nothing was recorded.'''
+
+    p90: float|None
+    '''Upper bound of the bucket holding the 90th percentile'''
+
+    p99: float|None
+    '''Upper bound of the bucket holding the 99th percentile'''
+
+class MetricsSnapshot(typing.TypedDict):
+    '''
+    Metrics collected by :py:class:`~meshctrl.metrics.InProcessMetrics`
+    '''
+
+    requests: dict[str, int]
+    '''Commands sent, by action'''
+
+    errors: dict[str, int]
+    '''Commands which failed or timed out, by action'''
+
+    in_flight: dict[str, int]
+    '''Commands awaiting a reply, by action'''
+
+    latency: dict[str, HistogramSnapshot]
+    '''Time from sending a command to matching its reply, by action'''
+
+    bytes_out: int
+    '''Size of all messages sent'''
+
+    bytes_in: int
+    '''Size of all messages received'''
+
+    messages_in: int
+    '''Number of messages received'''
+
+    parse_time: HistogramSnapshot
+    '''Time taken to decode messages from the server'''
+
+    deliveries: dict[str|None, int]
+    '''Number of times a message was handed to an events() listener, by action of the message'''
@@ -1,28 +1,14 @@
 from . import constants
+from . import util
+import abc
 import datetime
 
-class UserGroup(object):
+class _UserGroupBase(object):
     '''
-    Object to represent a user group. This object is a rough wrapper; it is not guarunteed to be up to date with the state on the server, for instance.
-
-    Args:
-        ugrpid (str): id of the user group on the server
-        session (~meshctrl.session.Session): Parent session used to run commands
-        name (str|None): Mesh name as it is shown on the meshcentral server
-        description (str|None): Mesh description as it is shown on the meshcentral server. Also accepted as desc.
-        domain (str|None): Domain on server to which device is connected.
-        links (dict[str, ~meshctrl.types.UserLink]|None): Collection of links for the device group
-
-    Returns:
-        :py:class:`Mesh`: Object representing a device group on the meshcentral server.
-
-    Attributes:
-        ugrpid (str): id of the device mesh on the server
-        name (str|None): Mesh name as it is shown on the meshcentral server
-        description (str|None):  Mesh description as it is shown on the meshcentral server
-        domain (str|None): Domain on server to which device is connected.
-        links (dict[str, ~meshctrl.types.UserLink]|None): Collection of links for the device group
+    Implementation of :py:class:`UserGroup`, shared with :py:class:`CompactUserGroup`.
     '''
+    __slots__ = ()
+
     def __init__(self, ugrpid, session, name=None, 
                        desc=None, description=None,
                        domain=None, links=None, **kwargs):
@@ -70,8 +56,48 @@ class UserGroup(object):
         return await self._session.add_users_to_user_group(userids, self.groupid, isname=False, domain=self.domain, timeout=timeout)
 
     def __str__(self):
-        return f"<UserGroup: ugrpid={self.ugrpid} name={self.name} description={self.description} "\
+        return f"<{type(self).__name__}: ugrpid={self.ugrpid} name={self.name} description={self.description} "\
                f"domain={self.domain} links={self.links}>"
     def __repr__(self):
-        return f"UserGroup(ugrpid={repr(self.ugrpid)}, session={repr(self._session)}, name={repr(self.name)}, description={repr(self.description)}, "\
-               f"domain={repr(self.domain)}, links={repr(self.links)}, **{repr(self._extra_props)})"
\ No newline at end of file
+        return f"{type(self).__name__}(ugrpid={repr(self.ugrpid)}, session={repr(self._session)}, name={repr(self.name)}, description={repr(self.description)}, "\
+               f"domain={repr(self.domain)}, links={repr(self.links)}, **{repr(self._extra_props)})"
+
+class UserGroup(_UserGroupBase, metaclass=abc.ABCMeta):
+    '''
+    Object to represent a user group. This object is a rough wrapper; it is not guarunteed to be up to date with the state on the server, for instance.
+
+    Args:
+        ugrpid (str): id of the user group on the server
+        session (~meshctrl.session.Session): Parent session used to run commands
+        name (str|None): Mesh name as it is shown on the meshcentral server
+        description (str|None): Mesh description as it is shown on the meshcentral server. Also accepted as desc.
+        domain (str|None): Domain on server to which device is connected.
+        links (dict[str, ~meshctrl.types.UserLink]|None): Collection of links for the device group
+
+    Returns:
+        :py:class:`Mesh`: Object representing a device group on the meshcentral server.
+
+    Attributes:
+        ugrpid (str): id of the device mesh on the server
+        name (str|None): Mesh name as it is shown on the meshcentral server
+        description (str|None):  Mesh description as it is shown on the meshcentral server
+        domain (str|None): Domain on server to which device is connected.
+        links (dict[str, ~meshctrl.types.UserLink]|None): Collection of links for the device group
+    '''
+
+
+class CompactUserGroup(_UserGroupBase):
+    '''
+    Memory compact version of :py:class:`UserGroup`, which passes isinstance checks for it. Takes the same arguments, including the aliases, and behaves the same.
+    Fields are stored in __slots__ and empty links are only allocated when they are read.
+    '''
+    __slots__ = ("ugrpid", "_session", "name", "description", "domain", "_links", "_extra")
+
+    links = util._EmptyOnDemand("_links", dict)
+    _extra_props = util._EmptyOnDemand("_extra", dict)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.domain = util._intern(self.domain)
+
+UserGroup.register(CompactUserGroup)
@@ -1,5 +1,7 @@
 import secrets
+import sys
 import time
+import datetime
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import json
 import base64
@@ -12,6 +14,7 @@ import functools
 import urllib
 import python_socks
 from . import exceptions
+from . import constants
 
 def _encode_cookie(o, key):
     o["time"] = int(time.time()); # Add the cookie creation time
@@ -20,6 +23,85 @@ def _encode_cookie(o, key):
     crypted = key.encrypt(iv, json.dumps(o), None)
     return base64.b64encode(crypted).replace(b"+", b'@').replace(b"/", b'$').decode("utf-8")
 
+def _parse_timestamp(value):
+    if isinstance(value, datetime.datetime) or value is None:
+        return value
+    try:
+        return datetime.datetime.fromtimestamp(value)
+    except (OSError, ValueError):
+        # Meshcentral returns in miliseconds, while fromtimestamp, and most of python, expects the argument in seconds. Try seconds frist, then translate from ms if it fails.
+        # This doesn't work for really early timestamps, but I don't expect that to be a problem here.
+        return datetime.datetime.fromtimestamp(value/1000.0)
+
+def _intern(value):
+    # Values like OS descriptions and domains repeat across a whole fleet. Keep one copy of each.
+    return sys.intern(value) if type(value) is str else value
+
+class _EmptyOnDemand(object):
+    """
+    Descriptor for collection attributes of the compact models. Stores None instead of an empty collection, and creates the collection the first time it is read.
+    """
+    def __init__(self, slot, factory):
+        self._slot = slot
+        self._factory = factory
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = getattr(obj, self._slot)
+        if value is None:
+            value = self._factory()
+            setattr(obj, self._slot, value)
+        return value
+
+    def __set__(self, obj, value):
+        setattr(obj, self._slot, value if value else None)
+
+_json_decoder = json.JSONDecoder()
+_json_whitespace = re.compile(r"[ \t\n\r]*")
+
+def _iter_json_array(data, codec=None):
+    """
+    Decode a JSON array one element at a time, so large replies don't need to be turned into python objects all at once.
+    Meshcentral sometimes wraps the array in any number of JSON strings, so those are unwrapped first.
+
+    Args:
+        data (str|bytes|list): JSON text of an array, possibly wrapped in strings, or an already decoded list
+        codec (~meshctrl.codec.JSONCodec): Codec used to unwrap nested strings
+
+    Returns:
+        generator(object): Elements of the array
+
+    Raises:
+        ValueError: data is not a JSON array
+    """
+    while True:
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        if not isinstance(data, str):
+            yield from data
+            return
+        idx = _json_whitespace.match(data).end()
+        if data[idx:idx+1] != '"':
+            break
+        data = codec.loads(data) if codec is not None else json.loads(data)
+
+    if data[idx:idx+1] != "[":
+        raise ValueError(f"Expecting JSON array: char {idx}")
+    idx = _json_whitespace.match(data, idx+1).end()
+    if data[idx:idx+1] == "]":
+        return
+    while True:
+        value, idx = _json_decoder.raw_decode(data, idx)
+        yield value
+        idx = _json_whitespace.match(data, idx).end()
+        c = data[idx:idx+1]
+        if c == "]":
+            return
+        if c != ",":
+            raise ValueError(f"Expecting ',' delimiter: char {idx}")
+        idx = _json_whitespace.match(data, idx+1).end()
+
 def _check_amt_password(p):
         return (len(p) > 7) and\
                (re.search(r"\d",p) is not None) and\
@@ -39,10 +121,20 @@ def _get_random_hex(count):
 class Eventer(object):
     """
     Eventer object to allow pub/sub interactions with a Session object
+
+    Attributes:
+        listening (set[str]): Names of events which currently have subscribers. This is the same set object for the life of the Eventer, so hot loops can hold on to it and check it without a method call.
     """
     def __init__(self):
         self._ons = {}
         self._onces = {}
+        self.listening = set()
+
+    def _update_listening(self, event):
+        if self._ons.get(event) or self._onces.get(event):
+            self.listening.add(event)
+        else:
+            self.listening.discard(event)
 
     def on(self, event, func):
         """
@@ -53,6 +145,7 @@ class Eventer(object):
             func (function(data: object)): Function to call when event is emitted. `data` could be of any type. Also used as a key to remove this subscription.
         """
         self._ons.setdefault(event, set()).add(func)
+        self.listening.add(event)
 
     def once(self, event, func):
         """
@@ -63,6 +156,7 @@ class Eventer(object):
             func (function(data: object)): Function to call when event is emitted. `data` could be of any type. Also used as a key to remove this subscription.
         """
         self._onces.setdefault(event, set()).add(func)
+        self.listening.add(event)
 
     def off(self, event, func):
         """
@@ -80,6 +174,19 @@ class Eventer(object):
             self._ons.setdefault(event, set()).remove(func)
         except KeyError:
             pass
+        self._update_listening(event)
+
+    def has_listeners(self, event):
+        """
+        Check whether anything is subscribed to `event`. Cheap enough to call for every message, so hot paths can skip building and emitting data nobody will read.
+
+        Args:
+            event (str): Event name to check
+
+        Returns:
+            bool: True if at least one function is bound to `event`
+        """
+        return event in self.listening
 
     async def emit(self, event, data):
         """
@@ -95,9 +202,282 @@ class Eventer(object):
             del self._onces[event]
         except KeyError:
             pass
+        self._update_listening(event)
         for f in self._ons.get(event, []):
             await f(data)
         
+class _SubscriberIndex(object):
+    """
+    Subscribers to server messages, indexed by one top level field of their filter, so each message is only checked against the subscribers which could match it.
+    """
+    # Fields to index on, most selective first. Any other top level scalar in a filter is used if none of these are present.
+    _preferred_fields = ("responseid", "tag", "nodeid", "action", "type")
+
+    def __init__(self):
+        self._index = {}
+        self._unindexed = set()
+        self._count = 0
+        # Total messages handed to subscribers, for fan-out metrics
+        self.delivered = 0
+
+    def __len__(self):
+        return self._count
+
+    def _index_key(self, filter):
+        if not filter:
+            return None
+        for field in self._preferred_fields:
+            if isinstance(filter.get(field, None), (str, int, float)):
+                return field, filter[field]
+        for field, value in filter.items():
+            if isinstance(value, (str, int, float)):
+                return field, value
+        return None
+
+    def add(self, filter, func):
+        """
+        Subscribe to messages matching `filter`
+
+        Args:
+            filter (dict|None): Filter as accepted by :py:func:`compare_dict`. None matches every message.
+            func (function(data: object)): Function to call with each matching message. This is called from the receive loop, so it must not block. It may return an awaitable, which the receive loop will wait on before handling the next message.
+
+        Returns:
+            object: Handle to pass to :py:meth:`remove`
+        """
+        key = self._index_key(filter)
+        match = (lambda data: True) if not filter else compile_filter(filter)
+        handle = (key, match, func)
+        if key is None:
+            self._unindexed.add(handle)
+        else:
+            self._index.setdefault(key[0], {}).setdefault(key[1], set()).add(handle)
+        self._count += 1
+        return handle
+
+    def remove(self, handle):
+        """
+        Unsubscribe
+
+        Args:
+            handle (object): Handle returned from :py:meth:`add`
+        """
+        key = handle[0]
+        if key is None:
+            subscribers = self._unindexed
+        else:
+            subscribers = self._index.get(key[0], {}).get(key[1], set())
+        if handle not in subscribers:
+            return
+        subscribers.remove(handle)
+        self._count -= 1
+        if key is not None and not subscribers:
+            del self._index[key[0]][key[1]]
+            if not self._index[key[0]]:
+                del self._index[key[0]]
+
+    def dispatch(self, data):
+        """
+        Hand `data` to every subscriber whose filter matches it
+
+        Args:
+            data (dict): Message from the server
+
+        Returns:
+            list[collections.abc.Awaitable]: Awaitables returned by subscribers, to be waited on before the next message is handled
+        """
+        candidates = list(self._unindexed)
+        for field, by_value in self._index.items():
+            value = data.get(field, None)
+            if value is None:
+                continue
+            try:
+                subscribers = by_value.get(value, None)
+            except TypeError:
+                # Unhashable value in the message, which can't equal the scalar we indexed on
+                continue
+            if subscribers:
+                candidates.extend(subscribers)
+        waiters = []
+        for key, match, func in candidates:
+            if match(data):
+                self.delivered += 1
+                waiter = func(data)
+                if waiter is not None:
+                    waiters.append(waiter)
+        return waiters
+
+class SubscriberQueue(asyncio.Queue):
+    """
+    Queue feeding messages to one subscriber, with a bound on how many it holds and a policy for what to do when it fills up
+
+    Args:
+        max_size (int|None): Maximum number of messages to hold. None means no limit.
+        overflow (~meshctrl.constants.OverflowPolicy|str): What to do when the queue is full
+        coalesce_key (function(data: object) -> object|None): For :py:attr:`~meshctrl.constants.OverflowPolicy.coalesce`, get the key messages are coalesced by (a nodeid, for instance). Messages for which this returns None are never coalesced.
+
+    Attributes:
+        max_size (int|None): Maximum number of messages held
+        overflow (~meshctrl.constants.OverflowPolicy): What happens when the queue is full
+        dropped (int): Number of messages thrown away because the queue was full
+        coalesced (int): Number of messages which replaced a queued message with the same key
+        high_water (int): Most messages held at once
+
+    Raises:
+        ValueError: `coalesce` policy without a `coalesce_key`
+    """
+    def __init__(self, max_size=None, overflow=constants.OverflowPolicy.drop_oldest, coalesce_key=None):
+        self.overflow = constants.OverflowPolicy(overflow)
+        if self.overflow is constants.OverflowPolicy.coalesce and coalesce_key is None:
+            raise ValueError("coalesce overflow policy needs a coalesce_key")
+        self.max_size = max_size
+        self.dropped = 0
+        self.coalesced = 0
+        self.high_water = 0
+        self._coalesce_key = coalesce_key if self.overflow is constants.OverflowPolicy.coalesce else None
+        super().__init__(maxsize=max_size or 0)
+
+    def _init(self, maxsize):
+        self._queue = collections.deque()
+        # Queued [key, message] cells by key, when coalescing
+        self._latest = {}
+
+    def _put(self, item):
+        if self._coalesce_key is not None:
+            key = self._coalesce_key(item)
+            item = [key, item]
+            if key is not None:
+                self._latest[key] = item
+        self._queue.append(item)
+        if len(self._queue) > self.high_water:
+            self.high_water = len(self._queue)
+
+    def _get(self):
+        item = self._queue.popleft()
+        if self._coalesce_key is not None:
+            key, item = item
+            if key is not None:
+                del self._latest[key]
+        return item
+
+    def offer(self, data):
+        """
+        Add a message, applying the overflow policy if the queue is full
+
+        Args:
+            data (object): Message to add
+
+        Returns:
+            collections.abc.Awaitable|None: With the block policy on a full queue, an awaitable which completes once the message is added. Otherwise None.
+        """
+        if self._coalesce_key is not None:
+            key = self._coalesce_key(data)
+            cell = self._latest.get(key, None) if key is not None else None
+            if cell is not None:
+                cell[1] = data
+                self.coalesced += 1
+                return None
+        if self.full():
+            if self.overflow is constants.OverflowPolicy.block:
+                return self.put(data)
+            if self.overflow is constants.OverflowPolicy.drop_newest:
+                self.dropped += 1
+                return None
+            self.get_nowait()
+            self.dropped += 1
+        self.put_nowait(data)
+        return None
+
+    def stats(self):
+        """
+        Get the state of this queue
+
+        Returns:
+            ~meshctrl.types.SubscriberStats: Current size, limits and counters
+        """
+        return {"size": self.qsize(), "max_size": self.max_size, "overflow": self.overflow, "dropped": self.dropped, "coalesced": self.coalesced, "high_water": self.high_water}
+
+class PriorityLanes(asyncio.Queue):
+    """
+    Unbounded queue of outgoing messages with one lane per :py:class:`~meshctrl.constants.Priority`. The highest priority waiting message comes out first, but a lower lane which has been passed over `starvation_limit` times in a row gets the next turn, so bulk work still makes progress under a steady stream of interactive messages.
+
+    Args:
+        starvation_limit (int): Most messages taken from higher lanes while a lower lane waits
+
+    Attributes:
+        starvation_limit (int): Most messages taken from higher lanes while a lower lane waits
+    """
+    def __init__(self, starvation_limit=8):
+        if starvation_limit < 1:
+            raise ValueError("starvation_limit must be at least 1")
+        self.starvation_limit = starvation_limit
+        super().__init__()
+
+    def _init(self, maxsize):
+        self._lanes = [collections.deque() for priority in constants.Priority]
+        self._skipped = [0] * len(self._lanes)
+        self._size = 0
+
+    def qsize(self):
+        return self._size
+
+    def empty(self):
+        return not self._size
+
+    def _put(self, item):
+        priority, message = item
+        self._lanes[priority].append(message)
+        self._size += 1
+
+    def _get(self):
+        lanes = self._lanes
+        skipped = self._skipped
+        chosen = None
+        for priority, lane in enumerate(lanes):
+            if lane:
+                chosen = priority
+                break
+        # The lowest lane that has waited too long goes ahead of everything else
+        for priority in range(len(lanes) - 1, chosen, -1):
+            if lanes[priority] and skipped[priority] >= self.starvation_limit:
+                chosen = priority
+                break
+        for priority in range(chosen + 1, len(lanes)):
+            if lanes[priority]:
+                skipped[priority] += 1
+        skipped[chosen] = 0
+        self._size -= 1
+        return lanes[chosen].popleft()
+
+    async def put(self, item, priority=constants.Priority.normal):
+        """
+        Add a message. Never waits, since the queue is unbounded.
+
+        Args:
+            item (object): Message to add
+            priority (~meshctrl.constants.Priority): Lane to add it to
+        """
+        self.put_nowait(item, priority)
+
+    def put_nowait(self, item, priority=constants.Priority.normal):
+        """
+        Add a message
+
+        Args:
+            item (object): Message to add
+            priority (~meshctrl.constants.Priority): Lane to add it to
+        """
+        super().put_nowait((priority, item))
+
+    def depths(self):
+        """
+        Get the number of messages waiting in each lane
+
+        Returns:
+            dict[~meshctrl.constants.Priority, int]: Messages waiting, by priority
+        """
+        return {priority: len(lane) for priority, lane in zip(constants.Priority, self._lanes)}
+
 def compare_dict(dict1, dict2):
     try:
         if dict1 == dict2:
@@ -138,6 +518,115 @@ def compare_dict(dict1, dict2):
     except Exception:
         return False
 
+def compile_filter(filter):
+    """
+    Compile a filter into a function which matches data the same way :py:func:`compare_dict` does. The filter is walked once here rather than on every call, set membership is checked by hashing where the data allows it, and matching doesn't rely on catching exceptions.
+
+    Args:
+        filter (dict): Filter to match against. Only keys in the filter are checked. Use sets for "array.contains" and lists for equality of lists.
+
+    Returns:
+        function(data: object) -> bool: Function returning whether `data` matches `filter`
+    """
+    return _compile_dict(filter)
+
+def _is_scalar(val):
+    return isinstance(val, str) or not (type(val) in (dict, set) or isinstance(val, collections.abc.Iterable))
+
+def _compile_dict(filter):
+    if not filter:
+        return lambda data: True
+    # Plain values are compared inline, since they are most of what filters hold. Everything else gets a compiled check.
+    scalars = tuple((key, val) for key, val in filter.items() if _is_scalar(val))
+    checks = tuple((key, _compile_value(val)) for key, val in filter.items() if not _is_scalar(val))
+
+    def match(data):
+        if data == filter:
+            return True
+        if type(data) is not dict and not isinstance(data, collections.abc.Mapping):
+            return False
+        for key, val in scalars:
+            if key not in data:
+                return False
+            target = data[key]
+            if target != val:
+                return False
+            # We don't want strings to match other iterables
+            if type(val) is str and type(target) is not str and not isinstance(val, type(target)):
+                return False
+        for key, check in checks:
+            if key not in data or not check(data[key]):
+                return False
+        return True
+    return match
+
+def _compile_value(val):
+    if type(val) is dict:
+        return _compile_dict(val)
+    if type(val) is set:
+        return _compile_set(val)
+    if isinstance(val, str):
+        # We don't want strings to match other iterables
+        return lambda target: isinstance(val, type(target)) and val == target
+    if isinstance(val, collections.abc.Iterable):
+        if not isinstance(val, collections.abc.Sized):
+            return lambda target: False
+        return _compile_sequence(val)
+    return lambda target: target == val
+
+def _compile_element(val):
+    # Items of lists are matched as whole filters if they are dicts, and by equality otherwise
+    if isinstance(val, dict):
+        return _compile_dict(val)
+    return lambda target: val == target
+
+def _compile_sequence(val):
+    checks = tuple(_compile_element(v) for v in val)
+    length = len(checks)
+
+    def match(target):
+        if isinstance(target, str) or not isinstance(target, collections.abc.Sized) or len(target) != length:
+            return False
+        if isinstance(target, collections.abc.Sequence):
+            for check, item in zip(checks, target):
+                if not check(item):
+                    return False
+            return True
+        if isinstance(target, collections.abc.Mapping):
+            # Indexed by position, like compare_dict does
+            for i, check in enumerate(checks):
+                if i not in target or not check(target[i]):
+                    return False
+            return True
+        return not length
+    return match
+
+def _compile_set(val):
+    needed = frozenset(val)
+    if not needed:
+        return lambda target: True
+
+    def scan(target):
+        # Items may not be hashable, so scan for each value instead of building a set
+        for v in needed:
+            if v not in target:
+                return False
+        return True
+
+    def match(target):
+        if type(target) is list:
+            return scan(target)
+        if isinstance(target, (set, frozenset)):
+            return needed <= target
+        if isinstance(target, collections.abc.Mapping):
+            return target.keys() >= needed
+        if isinstance(target, str):
+            return needed <= set(target)
+        if isinstance(target, collections.abc.Iterable):
+            return scan(target)
+        return False
+    return match
+
 def _check_socket(f):
     async def _check_errs(self):
         if not self.alive and self._main_loop_error is not None:
@@ -0,0 +1,33 @@
+import pytest
+import meshctrl
+
+def codecs():
+    available = []
+    for name in ("json", "orjson", "msgspec"):
+        try:
+            available.append(meshctrl.codec.get_codec(name))
+        except ImportError:
+            pass
+    return available
+
+@pytest.mark.parametrize("codec", codecs(), ids=lambda c: c.name)
+def test_codec_round_trip(codec):
+    data = {"action": "nodes", "nodes": {"mesh//abc": [{"_id": "node//abc", "conn": 1, "tags": ["a", "b"], "name": "üñí"}]}, "rights": meshctrl.constants.MeshRights.fullrights}
+    encoded = codec.dumps(data)
+    assert isinstance(encoded, str), "Codec must encode to str so we send text frames"
+    assert codec.loads(encoded) == data, "Round trip gave different data"
+    assert codec.loads(encoded.encode()) == data, "Codec could not decode bytes"
+
+@pytest.mark.parametrize("codec", codecs(), ids=lambda c: c.name)
+def test_codec_errors(codec):
+    with pytest.raises(ValueError):
+        codec.loads("{action:\"pong\"")
+    # Things the standard library can encode shouldn't fail just because we use a faster codec
+    assert codec.loads(codec.dumps({"big": 2**70})) == {"big": 2**70}
+
+def test_codec_selection():
+    assert isinstance(meshctrl.codec.get_codec("json"), meshctrl.codec.JSONCodec)
+    codec = meshctrl.codec.JSONCodec()
+    assert meshctrl.codec.get_codec(codec) is codec
+    with pytest.raises(ValueError):
+        meshctrl.codec.get_codec("yaml")
@@ -0,0 +1,53 @@
+import datetime
+import meshctrl
+
+def test_device_list_lazy():
+    built = []
+    def factory(node):
+        built.append(node["_id"])
+        return meshctrl.device.Device(node["_id"], None, **node)
+
+    nodes = [{"_id": f"node//{i}", "name": f"device{i}", "agct": 1700000000000} for i in range(5)]
+    devices = meshctrl.device.DeviceList(nodes, factory)
+    assert len(devices) == 5, "Wrong number of devices"
+    assert not built, "Devices were built before they were accessed"
+    assert devices[1].name == "device1"
+    assert devices[-1].nodeid == "node//4"
+    assert devices[1] is devices[1], "Device was built twice"
+    assert built == ["node//1", "node//4"], "Built devices which weren't accessed"
+    assert [d.nodeid for d in devices[1:3]] == ["node//1", "node//2"]
+    assert [d.name for d in devices] == [n["name"] for n in nodes]
+    assert devices.nodes is nodes, "Server data was copied"
+    try:
+        devices[5]
+    except IndexError:
+        pass
+    else:
+        raise Exception("Out of range index didn't raise")
+
+def test_device_timestamps():
+    d = meshctrl.device.Device("node//1", None, agct=1700000000000, lastconnect=1700000000)
+    assert d._created_at == 1700000000000, "Timestamp converted before it was read"
+    assert d.created_at == datetime.datetime.fromtimestamp(1700000000), "Millisecond timestamp converted incorrectly"
+    assert d.lastconnect == datetime.datetime.fromtimestamp(1700000000), "Second timestamp converted incorrectly"
+    now = datetime.datetime.now()
+    d.lastconnect = now
+    assert d.lastconnect is now
+    assert meshctrl.device.Device("node//1", None).created_at is None
+    assert meshctrl.mesh.Mesh("mesh//1", None, creation=1700000000000).created_at == datetime.datetime.fromtimestamp(1700000000)
+
+def test_compact_device():
+    kwargs = {"desc": "description", "conn": 1, "pwr": 0, "agct": 1700000000000, "rname": "computer", "mtype": 2, "groupname": "group", "osdesc": "os", "meshid": "mesh//1", "agent": {"ver": 1, "id": 4, "caps": 15}}
+    d = meshctrl.device.CompactDevice("node//1", None, name="name", **kwargs)
+    regular = meshctrl.device.Device("node//1", None, name="name", **kwargs)
+    assert isinstance(d, meshctrl.device.Device), "Compact device isn't a device"
+    assert not hasattr(d, "__dict__"), "Compact device has a __dict__"
+    for attr in ("nodeid", "name", "description", "connected", "powered_on", "created_at", "computer_name", "meshtype", "meshname", "os_description", "agent", "links", "tags", "users", "details", "_extra_props"):
+        assert getattr(d, attr) == getattr(regular, attr), f"Compact device has wrong {attr}"
+
+    d = meshctrl.device.CompactDevice("node//2", None)
+    assert d._links is None and d._tags is None, "Empty collections allocated before they were read"
+    d.tags.append("tag")
+    d.links["user//admin"] = {"rights": 0}
+    assert d.tags == ["tag"] and d.links == {"user//admin": {"rights": 0}}, "Lazily created collections aren't kept"
+    assert str(d) and repr(d)
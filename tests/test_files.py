@@ -6,6 +6,7 @@ import requests
 import io
 import random
 import time
+import pytest
 
 async def test_commands(env):
     async with meshctrl.Session("wss://" + env.dockerurl, user="admin", password=env.users["admin"], ignore_ssl=True, proxy=env.proxyurl) as admin_session:
@@ -54,18 +55,52 @@ async def test_commands(env):
             assert (await admin_session.remove_device_group(mesh.meshid, timeout=10)), "Failed to remove device group"
 
 async def test_os_proxy_bypass():
+    saved = {name: os.environ.get(name, None) for name in ("no_proxy", "http_proxy")}
     os.environ["no_proxy"] = "*"
-    import urllib
-    import urllib.request
-    os_proxies = urllib.request.getproxies()
-    meshctrl_proxies = meshctrl.files.urllib.request.getproxies()
-    print(f"os_proxies: {os_proxies}")
-    print(f"meshctrl_proxies: {meshctrl_proxies}")
-    assert meshctrl_proxies.get("no", None) == None, "Meshctrl is using system proxies"
-    assert os_proxies.get("no", None) == "*", "System is using meshctrl proxies"
-    assert os_proxies != meshctrl_proxies, "Override didn't work"
-
-async def test_upload_download(env):
+    os.environ["http_proxy"] = "http://127.0.0.1:9"
+    try:
+        import urllib
+        import urllib.request
+        os_proxies = urllib.request.getproxies()
+        pool = meshctrl.httpclient.HTTPPool()
+        print(f"os_proxies: {os_proxies}")
+        print(f"meshctrl_proxy: {pool._proxy}")
+        assert pool._proxy is None, "Meshctrl is using system proxies"
+        assert os_proxies.get("no", None) == "*", "System is using meshctrl proxies"
+        assert os_proxies.get("http", None) == "http://127.0.0.1:9", "System proxy not picked up"
+
+        # HTTP downloads only go through the session's proxy, so this would fail if the environment's were used
+        async def handle(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 6\r\n\r\ndirect")
+            await writer.drain()
+            writer.close()
+
+        async with await asyncio.start_server(handle, "127.0.0.1", 0) as server:
+            async with pool.get(f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/", timeout=5) as response:
+                assert await response.read() == b"direct", "Meshctrl is using system proxies"
+            await pool.close()
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+class RecordedStream(io.BytesIO):
+    # Notes where each read starts, and fails once `fail_at` bytes have been read, like a source going away mid upload
+    def __init__(self, data, fail_at=None):
+        super().__init__(data)
+        self.fail_at = fail_at
+        self.offsets = []
+
+    def read(self, size=-1):
+        if self.fail_at is not None and self.tell() >= self.fail_at:
+            raise OSError("Source went away")
+        self.offsets.append(self.tell())
+        return super().read(size)
+
+async def test_upload_download(env, tmp_path):
     async with meshctrl.Session("wss://" + env.dockerurl, user="admin", password=env.users["admin"], ignore_ssl=True, proxy=env.proxyurl) as admin_session:
         mesh = await admin_session.add_device_group("test", description="This is a test group", amtonly=False, features=0, consent=0, timeout=10)
         try:
@@ -108,6 +143,28 @@ async def test_upload_download(env):
                     else:
                         raise Exception("Uploaded file not found")
 
+                    # One chunk in flight at a time still gets the whole file across
+                    upfilestream.seek(0)
+                    r = await files.upload(upfilestream, f"{pwd}/test3", timeout=20, window=1)
+                    assert r["size"] == len(randdata), "Windowed upload sent wrong number of bytes"
+
+                    # An upload cut short leaves its checkpoint behind, and calling again with it appends the rest instead of starting over.
+                    # With a window of 1 every chunk is acked before the next is read, so the device holds exactly what was read before the source failed.
+                    checkpoint = str(tmp_path / "upload.json")
+                    cutoff = 4 * files._chunk_size
+                    with pytest.raises(meshctrl.exceptions.FileTransferError):
+                        await files.upload(RecordedStream(randdata, fail_at=cutoff), f"{pwd}/test4", timeout=20, window=1, checkpoint=checkpoint)
+                    assert os.path.exists(checkpoint), "No checkpoint left after interrupted upload"
+                    assert {f["n"]: f.get("s", None) for f in await files.ls(pwd, timeout=5)}.get("test4", None) == cutoff, "Interrupted upload left wrong amount on the device"
+                    resumestream = RecordedStream(randdata)
+                    r = await files.upload(resumestream, f"{pwd}/test4", timeout=20, checkpoint=checkpoint)
+                    assert resumestream.offsets[0] == cutoff, "Resumed upload didn't start from the checkpointed offset"
+                    assert r["size"] == len(randdata), "Resumed upload reported wrong size"
+                    assert not os.path.exists(checkpoint), "Checkpoint left after upload finished"
+                    resumedstream = io.BytesIO()
+                    await files.download(f"{pwd}/test4", resumedstream, skip_ws_attempt=True, timeout=5)
+                    assert resumedstream.getvalue() == randdata, "Resumed upload got wrong data across"
+
                     start = time.perf_counter()
                     r = await files.download(f"{pwd}/test", downfilestream, skip_ws_attempt=True, timeout=5)
                     print("\ninfo files_download: {}\n".format(r))
@@ -119,6 +176,12 @@ async def test_upload_download(env):
                     assert downfilestream.read() == randdata, "Got wrong data back"
                     downfilestream.seek(0)
 
+                    # Ranges if the server honors them, otherwise one stream. The data comes out the same either way.
+                    parallelstream = io.BytesIO()
+                    r = await files.download(f"{pwd}/test", parallelstream, skip_ws_attempt=True, timeout=5, parallel=4)
+                    assert r["size"] == len(randdata), "Parallel download got wrong number of bytes"
+                    assert parallelstream.getvalue() == randdata, "Parallel download got wrong data back"
+
                     start = time.perf_counter()
                     r = await files.download(f"{pwd}/test", downfilestream, skip_http_attempt=True, timeout=20)
                     print("\ninfo files_download: {}\n".format(r))
@@ -128,6 +191,15 @@ async def test_upload_download(env):
 
                     downfilestream.seek(0)
                     assert downfilestream.read() == randdata, "Got wrong data back"
+
+                    # Listings don't wait for a transfer on the same tunnel to finish
+                    downfilestream = io.BytesIO()
+                    download = asyncio.create_task(files.download(f"{pwd}/test", downfilestream, skip_http_attempt=True, timeout=20))
+                    await asyncio.sleep(0.1)
+                    assert any(f["n"] == "test" for f in await files.ls(pwd, timeout=5)), "Listing during download failed"
+                    assert not download.done(), "Listing waited for the download"
+                    r = await download
+                    assert r["size"] == len(randdata), "Downloaded wrong number of bytes alongside listing"
         finally:
             assert (await admin_session.remove_device_group(mesh.meshid, timeout=10)), "Failed to remove device group"
 
@@ -135,4 +207,21 @@ async def test_upload_download(env):
 
 
 
+async def test_reply_routing():
+    session = meshctrl.Session("wss://localhost:1", user="unprivileged", password="Not a real password")
+    await session.close()
+    files = meshctrl.files.Files(session, meshctrl.device.Device("node//1", session))
+    await files.close()
+    first, second, third = ({"id": i, "data": {"action": action}, "finished": asyncio.Event()} for i, action in ((1, "ls"), (2, "ls"), (3, "stat")))
+    files._replies = {1: first, 2: second, 3: third}
 
+    # A late reply to a request which already timed out belongs to nobody
+    files._handle_reply({"action": "ls", "reqid": 99})
+    assert list(files._replies) == [1, 2, 3] and not first["finished"].is_set(), "Stale reply handed to an unrelated request"
+    files._handle_reply({"action": "ls", "reqid": 2, "dir": []})
+    assert second["finished"].is_set() and second["return"]["reqid"] == 2
+    # Older agents don't echo reqid, and answer in order, so a reply goes to the oldest request of its action
+    files._handle_reply({"action": "stat", "size": 1})
+    assert third["finished"].is_set() and not first["finished"].is_set(), "Reply handed to a request of another action"
+    files._handle_reply({"action": "ls", "dir": []})
+    assert first["finished"].is_set() and not files._replies
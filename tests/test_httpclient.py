@@ -0,0 +1,213 @@
+import asyncio
+import io
+import mmap
+import pytest
+import meshctrl
+
+def _past_end(head, size):
+    return int(head.split(b"\r\nRange: bytes=", 1)[1].split(b"-", 1)[0]) >= size
+
+class _Server(object):
+    # Just enough HTTP/1.1 to answer the client: keep-alive, chunked bodies, closing after a reply, byte ranges under /ranged, interim responses and redirects
+    def __init__(self, body):
+        self.body = body
+        self.connections = 0
+        self.requests = []
+        self.writers = []
+        self.ranges = []
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        self.writers.append(writer)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                path = head.split(b" ", 2)[1].decode()
+                self.requests.append(path)
+                if path == "/chunked":
+                    writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n")
+                    for i in range(0, len(self.body), 1000):
+                        chunk = self.body[i:i+1000]
+                        writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                    writer.write(b"0\r\n\r\n")
+                elif path == "/ranged" and b"\r\nRange: bytes=" in head and _past_end(head, len(self.body)):
+                    writer.write(f"HTTP/1.1 416 Range Not Satisfiable\r\nContent-Range: bytes */{len(self.body)}\r\nContent-Length: 0\r\n\r\n".encode())
+                elif path == "/ranged" and b"\r\nRange: bytes=" in head:
+                    spec = head.split(b"\r\nRange: bytes=", 1)[1].split(b"\r\n", 1)[0].decode()
+                    first, last = spec.split("-")
+                    first = int(first)
+                    last = int(last) if last else len(self.body) - 1
+                    self.ranges.append((first, last))
+                    part = self.body[first:last+1]
+                    writer.write(f"HTTP/1.1 206 Partial Content\r\nContent-Range: bytes {first}-{last}/{len(self.body)}\r\nContent-Length: {len(part)}\r\n\r\n".encode() + part)
+                elif path == "/continue":
+                    writer.write(b"HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 103 Early Hints\r\nLink: </a>\r\n\r\n")
+                    writer.write(f"HTTP/1.1 200 OK\r\nContent-Length: {len(self.body)}\r\n\r\n".encode() + self.body)
+                elif path in ("/redirect", "/loop"):
+                    location = "/ranged" if path == "/redirect" else "/loop"
+                    writer.write(f"HTTP/1.1 302 Found\r\nLocation: {location}\r\nContent-Length: 5\r\n\r\nmoved".encode())
+                elif path == "/missing":
+                    writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                else:
+                    close = path == "/close"
+                    headers = f"Content-Length: {len(self.body)}\r\n"
+                    if close:
+                        headers += "Connection: close\r\n"
+                    writer.write(f"HTTP/1.1 200 OK\r\n{headers}\r\n".encode() + self.body)
+                    if close:
+                        await writer.drain()
+                        break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+async def _serve(body):
+    server = _Server(body)
+    listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+    return server, listener, f"http://127.0.0.1:{listener.sockets[0].getsockname()[1]}"
+
+async def test_keep_alive():
+    body = bytes(range(256)) * 1000
+    server, listener, url = await _serve(body)
+    async with listener:
+        pool = meshctrl.httpclient.HTTPPool()
+        for path in ("/a", "/chunked", "/b?x=1"):
+            async with pool.get(url + path, timeout=5) as response:
+                assert response.status == 200
+                assert await response.read() == body
+        assert server.connections == 1, "Connection wasn't reused"
+        assert server.requests == ["/a", "/chunked", "/b?x=1"]
+
+        async with pool.get(url + "/missing", timeout=5) as response:
+            assert response.status == 404
+            assert await response.read() == b""
+        async with pool.get(url + "/close", timeout=5) as response:
+            assert await response.read() == body
+        async with pool.get(url + "/a", timeout=5) as response:
+            assert await response.read() == body
+        assert server.connections == 2, "Closed connection was reused"
+        await pool.close()
+
+async def test_interim_and_redirects():
+    body = bytes(range(256)) * 1000
+    server, listener, url = await _serve(body)
+    async with listener:
+        pool = meshctrl.httpclient.HTTPPool()
+        async with pool.get(url + "/continue", timeout=5) as response:
+            assert response.status == 200, "Interim response taken as the real one"
+            assert await response.read() == body
+
+        # Headers, such as Range, go along with the redirect
+        target = io.BytesIO(body[:1000])
+        target.seek(1000)
+        assert await pool.download(url + "/redirect", target, timeout=5, offset=1000) == len(body) - 1000
+        assert target.getvalue() == body, "Redirect body written as file data"
+        assert server.ranges == [(1000, len(body) - 1)]
+
+        with pytest.raises(meshctrl.exceptions.ServerError):
+            async with pool.get(url + "/loop", timeout=5) as response:
+                pass
+        assert server.requests.count("/loop") == 6
+        await pool.close()
+
+async def test_concurrent_limit():
+    body = b"x" * 100000
+    server, listener, url = await _serve(body)
+    async with listener:
+        pool = meshctrl.httpclient.HTTPPool(max_connections=2)
+
+        async def fetch():
+            async with pool.get(url + "/a", timeout=5) as response:
+                return await response.read()
+
+        results = await asyncio.gather(*[fetch() for i in range(10)])
+        assert results == [body] * 10
+        assert server.connections <= 2
+        await pool.close()
+
+    with pytest.raises(ValueError):
+        meshctrl.httpclient.HTTPPool(max_connections=0)
+
+async def test_stale_connection():
+    server, listener, url = await _serve(b"hello")
+    async with listener:
+        pool = meshctrl.httpclient.HTTPPool()
+        async with pool.get(url + "/a", timeout=5) as response:
+            await response.read()
+        # Server drops the idle connection behind our back
+        server.writers[0].close()
+        async with pool.get(url + "/a", timeout=5) as response:
+            assert await response.read() == b"hello"
+        assert server.connections == 2
+        await pool.close()
+
+async def test_parallel_download():
+    body = bytes(range(256)) * 4000
+    server, listener, url = await _serve(body)
+    async with listener:
+        pool = meshctrl.httpclient.HTTPPool()
+        pool.min_part_size = 100000
+        target = io.BytesIO(b"head")
+        target.seek(4)
+        assert await pool.download(url + "/ranged", target, parallel=4, timeout=5) == len(body)
+        assert target.getvalue() == b"head" + body
+        assert target.tell() == 4 + len(body)
+        assert sorted(server.ranges) == [(0, len(body) - 1), (256000, 511999), (512000, 767999), (768000, 1023999)]
+
+        # Memory maps can be written at offsets too
+        mapped = mmap.mmap(-1, len(body))
+        assert await pool.download(url + "/ranged", mapped, parallel=3, timeout=5) == len(body)
+        assert mapped[:] == body
+        mapped.close()
+
+        # Server without range support, and a target which can't seek, both get one stream
+        server.ranges.clear()
+        target = io.BytesIO()
+        assert await pool.download(url + "/a", target, parallel=4, timeout=5) == len(body)
+        assert target.getvalue() == body
+
+        class Unseekable(io.BytesIO):
+            def seekable(self):
+                return False
+
+        target = Unseekable()
+        assert await pool.download(url + "/ranged", target, parallel=4, timeout=5) == len(body)
+        assert target.getvalue() == body
+        assert server.ranges == []
+
+        with pytest.raises(meshctrl.exceptions.ServerError):
+            await pool.download(url + "/missing", io.BytesIO(), timeout=5)
+        await pool.close()
+
+async def test_resume():
+    body = bytes(range(256)) * 4000
+    server, listener, url = await _serve(body)
+    async with listener:
+        pool = meshctrl.httpclient.HTTPPool()
+        seen = []
+        target = io.BytesIO(body[:300000])
+        target.seek(300000)
+        assert await pool.download(url + "/ranged", target, timeout=5, offset=300000, progress=seen.append) == len(body) - 300000
+        assert target.getvalue() == body
+        assert server.ranges == [(300000, len(body) - 1)]
+        assert seen[-1] == len(body) - 300000
+
+        # Ranges ignored: the bytes we have are skipped over
+        target = io.BytesIO(body[:300000])
+        target.seek(300000)
+        assert await pool.download(url + "/a", target, timeout=5, offset=300000) == len(body) - 300000
+        assert target.getvalue() == body
+
+        # Nothing left to fetch
+        assert await pool.download(url + "/ranged", io.BytesIO(), timeout=5, offset=len(body)) == 0
+
+        # Parallel progress only counts bytes with none missing before them
+        pool.min_part_size = 100000
+        seen.clear()
+        target = io.BytesIO()
+        assert await pool.download(url + "/ranged", target, parallel=4, timeout=5, offset=24000, progress=seen.append) == len(body) - 24000
+        assert target.getvalue() == body[24000:]
+        assert seen == sorted(seen) and seen[-1] == len(body) - 24000
+        await pool.close()
@@ -0,0 +1,69 @@
+import time
+import meshctrl
+
+def _cache(**kwargs):
+    cache = meshctrl.inventory.InventoryCache(**kwargs)
+    meshes = [{"_id": "mesh//m1", "name": "group1", "links": {}}]
+    nodes = {"mesh//m1": [{"_id": f"node//{i}", "name": f"device{i}", "conn": 1} for i in range(5)]}
+    cache.seed(meshes, nodes)
+    return cache
+
+def test_inventory_seed():
+    cache = meshctrl.inventory.InventoryCache()
+    assert cache.needs_seed
+    cache = _cache()
+    assert not cache.needs_seed
+    assert len(cache) == 5
+    node = cache.get_node("node//1")
+    assert node["name"] == "device1"
+    assert node["meshid"] == "mesh//m1"
+    node["name"] = "changed"
+    assert cache.get_node("node//1")["name"] == "device1", "Cache handed out its own data"
+    assert cache.get_node("node//missing") is None
+    assert cache.get_mesh("mesh//m1")["name"] == "group1"
+    assert (cache.hits, cache.misses) == (2, 1)
+    cache.clear()
+    assert cache.needs_seed
+    assert len(cache) == 0
+
+def test_inventory_events():
+    cache = _cache()
+    cache.handle_event({"etype": "node", "action": "changenode", "nodeid": "node//1", "node": {"_id": "node//1", "name": "renamed"}})
+    assert cache.get_node("node//1")["name"] == "renamed"
+    assert cache.get_node("node//1")["meshid"] == "mesh//m1", "Partial node update lost fields"
+    cache.handle_event({"etype": "node", "action": "nodeconnect", "nodeid": "node//2", "conn": 0, "pwr": 0})
+    assert cache.get_node("node//2")["conn"] == 0
+    cache.handle_event({"etype": "node", "action": "addnode", "node": {"_id": "node//new", "name": "new", "meshid": "mesh//m1"}})
+    assert cache.get_node("node//new")["name"] == "new"
+    cache.handle_event({"etype": "node", "action": "removenode", "nodeid": "node//3"})
+    assert "node//3" not in cache
+    cache.handle_event({"etype": "node", "action": "nodemeshchange", "nodeid": "node//4", "node": {"_id": "node//4"}, "newMeshId": "mesh//m2"})
+    assert cache.get_node("node//4")["meshid"] == "mesh//m2"
+
+    cache.handle_event({"etype": "mesh", "action": "createmesh", "meshid": "mesh//m2", "name": "group2", "msg": "Created device group group2", "username": "admin"})
+    assert cache.get_mesh("mesh//m2") == {"_id": "mesh//m2", "name": "group2"}
+    cache.handle_event({"etype": "mesh", "action": "meshchange", "meshid": "mesh//m1", "name": "renamed", "links": {"user//admin": {"rights": 1}}})
+    assert cache.get_mesh("mesh//m1")["links"] == {"user//admin": {"rights": 1}}
+    cache.handle_event({"etype": "mesh", "action": "deletemesh", "meshid": "mesh//m1"})
+    assert cache.get_mesh("mesh//m1") is None
+    assert "node//1" not in cache, "Devices in deleted group were kept"
+    assert "node//4" in cache
+
+    cache.handle_event({"etype": "user", "action": "accountchange"})
+    cache.handle_event({})
+
+def test_inventory_eviction():
+    cache = _cache(max_size=3)
+    assert len(cache) == 3
+    assert cache.get_node("node//2") is not None
+    cache.put_node({"_id": "node//new", "meshid": "mesh//m1"})
+    assert "node//3" not in cache, "Least recently used device wasn't evicted"
+    assert "node//2" in cache
+
+    cache = _cache(ttl=0.05)
+    assert cache.get_node("node//1") is not None
+    time.sleep(0.06)
+    assert cache.needs_seed
+    assert cache.get_node("node//1") is None, "Stale device was returned"
+    assert "node//1" not in cache
+    assert cache.get_mesh("mesh//m1") is None
@@ -0,0 +1,11 @@
+import meshctrl
+
+def test_compact_mesh():
+    kwargs = {"desc": "description", "mtype": 2, "creation": 1700000000000, "creatorid": "user//admin", "creatorname": "admin", "links": {"user//admin": {"rights": 1}}, "extra": 1}
+    m = meshctrl.mesh.CompactMesh("mesh//1", None, name="name", **kwargs)
+    regular = meshctrl.mesh.Mesh("mesh//1", None, name="name", **kwargs)
+    assert isinstance(m, meshctrl.mesh.Mesh), "Compact mesh isn't a mesh"
+    assert not hasattr(m, "__dict__"), "Compact mesh has a __dict__"
+    for attr in ("meshid", "name", "description", "meshtype", "created_at", "creatorid", "creatorname", "links", "_extra_props"):
+        assert getattr(m, attr) == getattr(regular, attr), f"Compact mesh has wrong {attr}"
+    assert meshctrl.mesh.CompactMesh("mesh//2", None)._links is None, "Empty links allocated before they were read"
@@ -0,0 +1,39 @@
+import meshctrl
+
+def test_in_process_metrics():
+    metrics = meshctrl.metrics.InProcessMetrics(buckets=(0.01, 0.1, 1))
+    for seconds in (0.005, 0.005, 0.05, 0.5, 5):
+        metrics.request_started("nodes")
+        assert metrics.in_flight["nodes"] == 1
+        metrics.request_finished("nodes", seconds)
+    metrics.request_started("getsysinfo")
+    metrics.request_finished("getsysinfo", 1, error=TimeoutError())
+    metrics.request_started("getsysinfo")
+    metrics.bytes_sent(100)
+    metrics.bytes_received(40)
+    metrics.bytes_received(60)
+    metrics.message_parsed(0.001)
+    metrics.message_fanout("event", 3)
+
+    snapshot = metrics.snapshot()
+    assert snapshot["requests"] == {"nodes": 5, "getsysinfo": 2}
+    assert snapshot["errors"] == {"getsysinfo": 1}
+    assert snapshot["in_flight"] == {"getsysinfo": 1}
+    latency = snapshot["latency"]["nodes"]
+    assert latency["count"] == 5
+    assert latency["buckets"] == {0.01: 2, 0.1: 1, 1: 1, float("inf"): 1}
+    assert (latency["p50"], latency["p90"], latency["p99"]) == (0.1, float("inf"), float("inf"))
+    assert (snapshot["bytes_out"], snapshot["bytes_in"], snapshot["messages_in"]) == (100, 100, 2)
+    assert snapshot["parse_time"]["count"] == 1
+    assert snapshot["parse_time"]["p50"] == 0.01
+    assert snapshot["deliveries"] == {"event": 3}
+
+def test_metrics_collector_noop():
+    # The base class accepts every call, so collectors only need to implement what they use
+    collector = meshctrl.metrics.MetricsCollector()
+    collector.request_started("nodes")
+    collector.request_finished("nodes", 0.1, error=None)
+    collector.bytes_sent(1)
+    collector.bytes_received(1)
+    collector.message_parsed(0.1)
+    collector.message_fanout("event", 1)
@@ -0,0 +1,48 @@
+import asyncio
+import pytest
+import meshctrl
+
+def test_span_timer():
+    profiler = meshctrl.profiling.SpanTimer()
+    assert meshctrl.profiling.current_span.get() is None
+    with profiler.span("session.command", {"action": "nodes"}):
+        assert meshctrl.profiling.current_span.get() == "session.command"
+        with profiler.span("session.message"):
+            assert meshctrl.profiling.current_span.get() == "session.message"
+        assert meshctrl.profiling.current_span.get() == "session.command"
+    with pytest.raises(ValueError):
+        with profiler.span("session.message"):
+            raise ValueError()
+    assert meshctrl.profiling.current_span.get() is None
+    assert profiler.spans["session.command"]["count"] == 1
+    assert profiler.spans["session.message"]["count"] == 2
+    assert profiler.spans["session.message"]["errors"] == 1
+    assert profiler.spans["session.command"]["total"] >= profiler.spans["session.command"]["max"] > 0
+    assert len(profiler.report().splitlines()) == 2
+
+async def test_message_spans():
+    class Recorder(meshctrl.profiling.Profiler):
+        def __init__(self):
+            self.events = []
+
+        def span_started(self, name, attributes):
+            self.events.append(("start", name, attributes["size"]))
+
+        def span_finished(self, name, attributes, seconds, error):
+            self.events.append(("end", name, attributes["size"], type(error).__name__ if error else None))
+
+    messages = ['{"action":"serverinfo","serverinfo":{"domain":""}}', '{"action":"close","cause":"noauth"}', '{"action":"pong"}']
+    async def websocket():
+        for message in messages:
+            yield message
+
+    profiler = Recorder()
+    s = meshctrl.Session("wss://localhost:1", user="unprivileged", password="Not a real password", profiler=profiler)
+    await s.close()
+    for listen in (s._listen_data_task, s._listen_pool_task):
+        profiler.events.clear()
+        # Handling the second message raises, which has to close its span right away rather than whenever the iterator gets finalized
+        with pytest.raises(meshctrl.exceptions.ServerError):
+            await listen(websocket())
+        assert meshctrl.profiling.current_span.get() is None, "Span left open after the handler raised"
+        assert profiler.events[-2:] == [("start", "session.message", len(messages[1])), ("end", "session.message", len(messages[1]), "ServerError")]
@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+import meshctrl
+
+async def _run(scheduler, action, order, release):
+    async with scheduler.slot(action):
+        order.append(action)
+        await release.wait()
+
+async def test_scheduler_limits():
+    scheduler = meshctrl.scheduler.CommandScheduler(max_in_flight=3, action_limits={"getsysinfo": 1})
+    release = asyncio.Event()
+    order = []
+    tasks = [asyncio.create_task(_run(scheduler, "getsysinfo", order, release)) for i in range(3)]
+    tasks += [asyncio.create_task(_run(scheduler, "nodes", order, release)) for i in range(3)]
+    await asyncio.sleep(0.01)
+    assert order == ["getsysinfo", "nodes", "nodes"]
+    stats = scheduler.stats()
+    assert (stats["in_flight"], stats["queued"]) == (3, 3)
+    assert stats["queued_by_action"] == {"getsysinfo": 2, "nodes": 1}
+    assert stats["in_flight_by_action"] == {"getsysinfo": 1, "nodes": 2}
+    release.set()
+    await asyncio.gather(*tasks)
+    stats = scheduler.stats()
+    assert (stats["in_flight"], stats["queued"], stats["completed"]) == (0, 0, 6)
+    assert stats["latency"]["max"] >= stats["latency"]["p50"] > 0
+
+async def test_scheduler_fairness():
+    scheduler = meshctrl.scheduler.CommandScheduler(max_in_flight=1)
+    order = []
+    release = asyncio.Event()
+    blocker = asyncio.create_task(_run(scheduler, "block", order, release))
+    await asyncio.sleep(0)
+    done = asyncio.Event()
+    done.set()
+    tasks = [asyncio.create_task(_run(scheduler, "bulk", order, done)) for i in range(5)]
+    tasks.append(asyncio.create_task(_run(scheduler, "ping", order, done)))
+    await asyncio.sleep(0)
+    assert scheduler.queued == 6
+    release.set()
+    await asyncio.gather(blocker, *tasks)
+    assert order == ["block", "bulk", "ping", "bulk", "bulk", "bulk", "bulk"], "Lone command was stuck behind the flood"
+    assert scheduler.stats()["in_flight"] == 0
+    assert scheduler.stats()["queued"] == 0
+
+async def test_scheduler_cancel_while_queued():
+    scheduler = meshctrl.scheduler.CommandScheduler(max_in_flight=1)
+    release = asyncio.Event()
+    order = []
+    first = asyncio.create_task(_run(scheduler, "a", order, release))
+    await asyncio.sleep(0)
+    with pytest.raises(TimeoutError):
+        async with asyncio.timeout(0.01):
+            await _run(scheduler, "b", order, release)
+    assert scheduler.queued == 0
+    release.set()
+    await first
+    assert scheduler.in_flight == 0
+    await _run(scheduler, "c", order, release)
+    assert order == ["a", "c"]
+
+def test_scheduler_invalid():
+    with pytest.raises(ValueError):
+        meshctrl.scheduler.CommandScheduler(max_in_flight=0)
+    with pytest.raises(ValueError):
+        meshctrl.scheduler.CommandScheduler(action_limits={"nodes": 0})
@@ -67,6 +67,14 @@ async def test_auto_reconnect(env):
             raise Exception("Failed to reconnect")
 
 
+async def test_connection_pool(env):
+    async with meshctrl.Session(env.mcurl, user="admin", password=env.users["admin"], ignore_ssl=True, connections=3) as admin_session:
+        await asyncio.sleep(1)
+        assert all(connection.open for connection in admin_session._pool), "Extra connections failed to open"
+        results = await asyncio.gather(*[admin_session.list_users(timeout=10) for i in range(30)])
+        assert all(len(users) == len(env.users.keys()) for users in results)
+        assert all(connection.in_flight == set() for connection in admin_session._pool), "Finished requests were still tracked"
+
 async def test_users(env):
     try:
         async with meshctrl.Session(env.mcurl[3:], user="admin", password=env.users["admin"], ignore_ssl=True) as admin_session:
@@ -226,6 +234,19 @@ async def test_mesh_device(env):
             r = await admin_session.list_devices(details=True, timeout=10)
             print("\ninfo list_devices_details: {}\n".format(r))
 
+            r = await admin_session.list_devices(lazy=True, timeout=10)
+            print("\ninfo list_devices_lazy: {}\n".format(r))
+            assert len(r) == 3, "Incorrect number of agents in lazy list"
+            assert {d.nodeid for d in r} == {agent.nodeid, agent2.nodeid, agent3.nodeid}, "Lazy list has wrong devices"
+            assert [d for d in r if d.mesh.meshid == mesh.meshid][0].mesh is [d for d in r if d.mesh.meshid == mesh.meshid][1].mesh, "Devices in the same group don't share a mesh"
+
+            r = [d async for d in admin_session.iter_devices(timeout=10)]
+            print("\ninfo iter_devices: {}\n".format(r))
+            assert len(r) == 3, "Incorrect number of agents iterated"
+            assert len([d async for d in admin_session.iter_devices(by_group=True, timeout=10)]) == 3, "Incorrect number of agents iterated by group"
+            assert len([d async for d in admin_session.iter_devices(details=True, timeout=10)]) == 3, "Incorrect number of agents iterated with details"
+            assert len([d async for d in privileged_session.iter_devices(timeout=10)]) == 2, "Incorrect number of agents iterated"
+
             r = await admin_session.list_devices(group=mesh.name, timeout=10)
             print("\ninfo list_devices_group: {}\n".format(r))
 
@@ -234,6 +255,11 @@ async def test_mesh_device(env):
 
             r = await admin_session.device_info(agent.nodeid, timeout=10)
             print("\ninfo admin_device_info: {}\n".format(r))
+            assert (await admin_session.device_info(agent.nodeid, meshid=mesh.meshid, timeout=10)).nodeid == r.nodeid, "Scoped device_info found a different device"
+
+            r = await admin_session.device_infos([agent.nodeid, agent2.nodeid], timeout=10)
+            print("\ninfo admin_device_infos: {}\n".format(r))
+            assert r[agent.nodeid].nodeid == agent.nodeid and r[agent2.nodeid].nodeid == agent2.nodeid, "device_infos mixed up devices"
 
             # Test editing device info propagating correctly
             assert await admin_session.edit_device(agent.nodeid, name="new_name", description="New Description", tags="device", consent=meshctrl.constants.ConsentFlags.all, timeout=10), "Failed to edit device info"
@@ -251,6 +277,16 @@ async def test_mesh_device(env):
             assert "Run commands completed." not in r[agent2.nodeid]["result"], "Didn't parse run command ending correctly"
             assert "meshagent" in (await privileged_session.run_command(agent.nodeid, "ls", timeout=10))[agent.nodeid]["result"], "ls gave incorrect data"
 
+            records = [r async for r in admin_session.run_command_stream([agent.nodeid, agent2.nodeid], "ls", node_timeout=10, timeout=10)]
+            print("\ninfo run_command_stream: {}\n".format(records))
+            assert {r["nodeid"] for r in records if r["complete"]} == {agent.nodeid, agent2.nodeid}, "Not every node completed in run_command_stream"
+            assert "meshagent" in "".join(r["output"] for r in records if r["nodeid"] == agent.nodeid and r["output"]), "run_command_stream gave incorrect data"
+
+            # Overlapping calls on one session each get their own output
+            r1, r2 = await asyncio.gather(admin_session.run_command(agent.nodeid, "echo first", timeout=10), admin_session.run_command(agent2.nodeid, "echo second", timeout=10))
+            assert "first" in r1[agent.nodeid]["result"] and "second" not in r1[agent.nodeid]["result"], "Concurrent run_command mixed up output"
+            assert "second" in r2[agent2.nodeid]["result"] and "first" not in r2[agent2.nodeid]["result"], "Concurrent run_command mixed up output"
+
             # Test run_commands missing device
             try:
                 await admin_session.run_command([agent.nodeid, "notanid"], "ls", timeout=10)
@@ -0,0 +1,7 @@
+import meshctrl
+
+def test_compact_user_group():
+    g = meshctrl.user_group.CompactUserGroup("ugrp//1", None, name="name", desc="description", domain="")
+    assert isinstance(g, meshctrl.user_group.UserGroup), "Compact user group isn't a user group"
+    assert not hasattr(g, "__dict__"), "Compact user group has a __dict__"
+    assert (g.ugrpid, g.name, g.description, g.domain, g.links) == ("ugrp//1", "name", "description", "", {})
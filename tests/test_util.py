@@ -18,6 +18,7 @@ test_dict = {
 
 def compare_dict(d):
     assert meshctrl.util.compare_dict(d["dict"], test_dict) == d["equal"], f"dict equality incorrect: isequal: {not d['equal']} {d['dict']} {test_dict}"
+    assert meshctrl.util.compile_filter(d["dict"])(test_dict) == d["equal"], f"compiled filter incorrect: isequal: {not d['equal']} {d['dict']} {test_dict}"
 
 def test_compare_dict_string_equals():
     compare_dict({
@@ -135,4 +136,161 @@ def test_compare_dict_dict_not_equals_key():
                 "string2": "string"
             }
         }
-    })
\ No newline at end of file
+    })
+
+def test_iter_json_array():
+    import json
+    data = [{"node": {"_id": "node//1"}}, [1, 2], "string", 3, None]
+    assert list(meshctrl.util._iter_json_array(json.dumps(data))) == data
+    # Meshcentral likes to wrap getDeviceDetails in extra strings
+    assert list(meshctrl.util._iter_json_array(json.dumps(json.dumps(json.dumps(data))))) == data
+    assert list(meshctrl.util._iter_json_array(json.dumps(data).encode())) == data
+    assert list(meshctrl.util._iter_json_array(" [ ] ")) == []
+    assert list(meshctrl.util._iter_json_array(data)) == data
+    for bad in ("{}", "[1 2]", "[1,"):
+        try:
+            list(meshctrl.util._iter_json_array(bad))
+        except ValueError:
+            pass
+        else:
+            raise Exception(f"Invalid array {bad} didn't raise")
+
+def test_subscriber_index():
+    index = meshctrl.util._SubscriberIndex()
+    got = {}
+    def sub(name, filter):
+        return index.add(filter, lambda data: got.setdefault(name, []).append(data))
+    handles = [
+        sub("console", {"action": "msg", "type": "console"}),
+        sub("node", {"action": "msg", "nodeid": "node//1"}),
+        sub("event", {"event": {"etype": "node"}}),
+        sub("all", None),
+    ]
+    assert len(index) == 4
+    messages = [
+        {"action": "msg", "type": "console", "nodeid": "node//1", "value": "hi"},
+        {"action": "msg", "type": "console", "nodeid": "node//2", "value": "hi"},
+        {"action": "event", "event": {"etype": "node", "action": "changenode"}},
+        {"action": "msg", "nodeid": {"unhashable": True}},
+    ]
+    for message in messages:
+        index.dispatch(message)
+    assert got["console"] == messages[:2]
+    assert got["node"] == messages[:1]
+    assert got["event"] == messages[2:3]
+    assert got["all"] == messages
+    for handle in handles:
+        index.remove(handle)
+    index.remove(handles[0])
+    assert len(index) == 0
+    assert not index._index and not index._unindexed, "Empty buckets were left behind"
+
+def test_compile_filter_matches_compare_dict():
+    filters = [
+        {},
+        {"action": "msg", "type": "console"},
+        {"event": {"etype": "node", "action": "agentlog"}},
+        {"tags": {"prod", "windows"}},
+        {"tags": {"prod", "linux"}},
+        {"tags": set()},
+        {"users": [{"name": "admin"}]},
+        {"users": []},
+        {"name": ["h", "o", "s", "t"]},
+        {"name": {"h"}},
+        {"conn": True},
+        {"missing": None},
+    ]
+    data = [
+        {"action": "msg", "type": "console", "nodeid": "node//1", "value": "hi"},
+        {"action": "event", "event": {"etype": "node", "action": "agentlog", "nodeid": "node//1"}},
+        {"tags": ["prod", "windows", "eu"], "users": [{"name": "admin", "rights": 1}], "name": "host", "conn": 1},
+        {"tags": {"prod": 1, "windows": 2}, "users": {}, "name": ["h", "o", "s", "t"], "conn": 0, "missing": None},
+        {"tags": "prod", "users": [{"name": "other"}]},
+        ["not", "a", "dict"],
+    ]
+    for f in filters:
+        compiled = meshctrl.util.compile_filter(f)
+        for d in data:
+            assert compiled(d) == meshctrl.util.compare_dict(f, d), f"compile_filter disagrees with compare_dict: {f} {d}"
+
+def test_subscriber_queue_policies():
+    OverflowPolicy = meshctrl.constants.OverflowPolicy
+    def drain(q):
+        return [q.get_nowait() for _ in range(q.qsize())]
+
+    q = meshctrl.util.SubscriberQueue(2, OverflowPolicy.drop_oldest)
+    for i in range(5):
+        assert q.offer(i) is None
+    assert drain(q) == [3, 4]
+    assert (q.dropped, q.high_water) == (3, 2)
+
+    q = meshctrl.util.SubscriberQueue(2, "drop_newest")
+    for i in range(5):
+        q.offer(i)
+    assert drain(q) == [0, 1]
+    assert q.dropped == 3
+
+    q = meshctrl.util.SubscriberQueue(2, OverflowPolicy.coalesce, coalesce_key=lambda d: d.get("nodeid"))
+    for d in [{"nodeid": "a", "n": 1}, {"nodeid": "b", "n": 1}, {"nodeid": "a", "n": 2}, {"n": 1}]:
+        q.offer(d)
+    # a was replaced in place, then dropped as the oldest to make room for the message without a key
+    assert drain(q) == [{"nodeid": "b", "n": 1}, {"n": 1}]
+    assert (q.coalesced, q.dropped) == (1, 1)
+    q.offer({"nodeid": "a", "n": 3})
+    assert drain(q) == [{"nodeid": "a", "n": 3}], "Coalesce key outlived its message"
+
+    q = meshctrl.util.SubscriberQueue(None)
+    for i in range(1000):
+        q.offer(i)
+    assert q.qsize() == 1000 and q.stats()["max_size"] is None
+
+    try:
+        meshctrl.util.SubscriberQueue(2, OverflowPolicy.coalesce)
+    except ValueError:
+        pass
+    else:
+        raise Exception("Coalesce without a key didn't raise")
+
+    async def block():
+        q = meshctrl.util.SubscriberQueue(1, OverflowPolicy.block)
+        assert q.offer(1) is None
+        waiter = q.offer(2)
+        assert waiter is not None, "Full blocking queue didn't return a waiter"
+        put = asyncio.ensure_future(waiter)
+        await asyncio.sleep(0)
+        assert not put.done()
+        assert await q.get() == 1
+        await put
+        assert await q.get() == 2
+        assert q.dropped == 0
+    asyncio.run(block())
+
+def test_eventer_listening():
+    eventer = meshctrl.util.Eventer()
+    listening = eventer.listening
+    async def f(data):
+        pass
+    assert not eventer.has_listeners("raw")
+    eventer.on("raw", f)
+    eventer.once("server_event", f)
+    assert listening == {"raw", "server_event"}
+    asyncio.run(eventer.emit("server_event", {}))
+    assert listening == {"raw"}, "Once listener still counted after it fired"
+    eventer.off("raw", f)
+    assert not listening
+    assert eventer.listening is listening, "listening set was replaced"
+
+def test_priority_lanes():
+    Priority = meshctrl.constants.Priority
+    lanes = meshctrl.util.PriorityLanes(starvation_limit=2)
+    for i in range(4):
+        lanes.put_nowait(f"bulk{i}", Priority.bulk)
+    lanes.put_nowait("normal0")
+    for i in range(6):
+        lanes.put_nowait(f"interactive{i}", Priority.interactive)
+    assert lanes.qsize() == 11
+    assert lanes.depths() == {Priority.interactive: 6, Priority.normal: 1, Priority.bulk: 4}
+    order = [lanes.get_nowait() for i in range(11)]
+    # Bulk waited through the normal message too, so it gets its next turn sooner
+    assert order == ["interactive0", "interactive1", "bulk0", "normal0", "interactive2", "bulk1", "interactive3", "interactive4", "bulk2", "interactive5", "bulk3"]
+    assert lanes.empty()